@@ -1,16 +1,27 @@
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import jwt, JWTError
+from jose import JWTError
 import os
+import logging
 from dotenv import load_dotenv
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 security = HTTPBearer()
 
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", "")
 
+from .services.jwt_verifier import JWTVerifier, JWKSClient, SUPABASE_JWKS_URL
+
+# Signature checks are cached per token; RS256/ES256 keys come from the project JWKS if configured
+jwt_verifier = JWTVerifier(
+    SUPABASE_JWT_SECRET,
+    jwks_client=JWKSClient(SUPABASE_JWKS_URL) if SUPABASE_JWKS_URL else None
+)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """
     Validate Supabase JWT token and extract user information
@@ -26,27 +37,23 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         }
     
     try:
-        # Decode the JWT token
-        payload = jwt.decode(
-            token,
-            SUPABASE_JWT_SECRET,
-            algorithms=["HS256"],
-            options={"verify_aud": False}
-        )
+        # Decode the JWT token (a repeat of a verified token is one dict lookup)
+        payload = jwt_verifier.cache.get(token)
+        if payload is None:
+            # Signature check, and the first JWKS download, run off the event loop
+            payload = await run_in_threadpool(jwt_verifier.verify_signature, token)
         
         user_id: str = payload.get("sub")
         email: str = payload.get("email")
         role: str = payload.get("role", "user")
         
         if user_id is None:
-            print("DEBUG: JWT payload missing 'sub' (user_id)")
+            logger.debug("JWT payload missing 'sub' (user_id)")
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Could not validate credentials",
             )
         
-        print(f"DEBUG: Validated user_id: {user_id}, role: {role}")
-        
         return {
             "id": user_id,
             "email": email,
@@ -71,8 +78,9 @@ async def get_current_admin_user(current_user: dict = Depends(get_current_user))
     return current_user
 
 from .database import get_db
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
 from . import models
+from .services.tenant_cache import tenant_cache
 import uuid
 
 async def get_user_company(
@@ -84,7 +92,11 @@ async def get_user_company(
     For MVP/Demo, if no company exists for the user, create one.
     """
     user_id = current_user["id"]
-    print(f"DEBUG: get_user_company called for user {user_id}")
+    # Linked users are cached: no users/companies SELECT on every request
+    cached = tenant_cache.get(user_id)
+    if cached:
+        return cached["company_id"]
+    logger.debug(f"get_user_company cache miss for user {user_id}")
     
     # Check if user exists in DB (sync with Supabase Auth)
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
@@ -103,21 +115,23 @@ async def get_user_company(
 
     # 1. If user is already a member of a company, return that ID
     if db_user.company_id:
+        tenant_cache.set(db_user)
         return db_user.company_id
 
     # 2. If not a member, check if they OWN a company (Legacy 1-1 check)
     company = db.query(models.Company).filter(models.Company.user_id == user_id).first()
     
     if company:
-        print(f"DEBUG: User {user_id} owns/is-linked-to company {company.id}")
+        logger.debug(f"User {user_id} owns/is-linked-to company {company.id}")
         # Link them properly if not linked
         if not db_user.company_id:
             db_user.company_id = company.id
             db.add(db_user)
             db.commit()
+        tenant_cache.set(db_user)
         return company.id
     
-    print(f"DEBUG: User {user_id} has no company linked. Role is {db_user.role}")
+    logger.debug(f"User {user_id} has no company linked. Role is {db_user.role}")
         
     # 3. If no company and user is ADMIN (Default), Create New Company
     if db_user.role == models.UserRole.ADMIN.value:
@@ -138,6 +152,7 @@ async def get_user_company(
         db.add(db_user)
         
         db.commit()
+        tenant_cache.set(db_user)
         return company.id
     else:
         # User is a GUIDE but has no company? They need to join one.
@@ -146,7 +161,7 @@ async def get_user_company(
         # Or simplistic fallback: Create a personal sandbox company? 
         # Let's enforce: Must join via Invite Code.
         # DEBUG Fallback: Create a sandbox company if it's the first time
-        print(f"DEBUG: User {user_id} is a Guide but has no company. Auto-creating personal sandbox.")
+        logger.debug(f"User {user_id} is a Guide but has no company. Auto-creating personal sandbox.")
         company = models.Company(
             id=str(uuid.uuid4()),
             user_id=user_id,
@@ -158,6 +173,7 @@ async def get_user_company(
         db_user.company_id = company.id
         db.add(db_user)
         db.commit()
+        tenant_cache.set(db_user)
         return company.id
         
         # raise HTTPException(
@@ -173,6 +189,10 @@ async def get_current_active_user(
     Returns the current active user model, creating it if it doesn't exist (sync with Auth).
     """
     user_id = current_user["id"]
+    cached = tenant_cache.get(user_id)
+    if cached:
+        return _cached_user(db, cached)
+
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     
     if not db_user:
@@ -192,7 +212,16 @@ async def get_current_active_user(
             await get_user_company(current_user, db)
             db.refresh(db_user)
         except Exception as e:
-            print(f"Error auto-creating company: {e}")
+            logger.error(f"Error auto-creating company: {e}")
 
-        
+    tenant_cache.set(db_user)
     return db_user
+
+def _cached_user(db: Session, cached: dict) -> models.User:
+    """
+    Attaches a User built from the cache to the session without a SELECT
+    (merge with load=False). Other columns and relationships load lazily on access.
+    """
+    user = models.User(**cached)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
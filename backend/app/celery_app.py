@@ -0,0 +1,56 @@
+import os
+from celery import Celery
+from kombu import Queue
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Queue producers only use Celery when a broker is configured; otherwise the
+# routers fall back to FastAPI BackgroundTasks (local dev, tests).
+CELERY_ENABLED = bool(os.getenv("REDIS_URL")) and os.getenv("CELERY_ENABLED", "true").lower() == "true"
+
+celery_app = Celery(
+    "reportpilot",
+    broker=REDIS_URL,
+    backend=REDIS_URL,
+    include=["app.services.tasks"]
+)
+
+celery_app.conf.update(
+    # Separate queues so a month-end OCR burst never delays exports or sheet syncs.
+    # Run e.g. `celery -A app.celery_app worker -Q ocr` and `-Q exports,sync` as separate workers.
+    task_queues=(
+        Queue("ocr"),
+        Queue("exports"),
+        Queue("sync"),
+    ),
+    task_default_queue="ocr",
+    task_routes={
+        "app.services.tasks.process_receipt_task": {"queue": "ocr"},
+        "app.services.tasks.process_receipt_batch_task": {"queue": "ocr"},
+        "app.services.tasks.process_purchase_task": {"queue": "ocr"},
+        "app.services.tasks.reap_ocr_leases_task": {"queue": "ocr"},
+        "app.services.tasks.export_receipts_zip_task": {"queue": "exports"},
+        "app.services.tasks.sync_purchase_task": {"queue": "sync"},
+    },
+    # Ack after the task finishes: a worker killed mid-OCR leaves the message in Redis
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # One message at a time per process, so queued work from other companies interleaves
+    worker_prefetch_multiplier=1,
+    task_track_started=True,
+    # Run `celery -A app.celery_app beat` once per deployment to recover receipts of dead workers
+    beat_schedule={
+        "reap-ocr-leases": {
+            "task": "app.services.tasks.reap_ocr_leases_task",
+            "schedule": float(os.getenv("OCR_JOB_REAP_INTERVAL", "60")),
+        },
+    },
+    result_expires=int(os.getenv("CELERY_RESULT_EXPIRES", "86400")),
+    task_serializer="json",
+    result_serializer="json",
+    accept_content=["json"],
+    timezone="UTC",
+)
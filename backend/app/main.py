@@ -1,11 +1,13 @@
 from fastapi import FastAPI, Request
 from .database import engine, Base
-from .routers import receipts, purchases, auth, exports, users, budgets, closures, providers, products, recipes, reports
+from .routers import receipts, purchases, auth, exports, users, budgets, closures, providers, products, recipes, reports, jobs
 import time
 import os
 import sentry_sdk
 from sentry_sdk.integrations.fastapi import FastApiIntegration
 from .services.logging_config import setup_logging
+from .services import spend_rollups  # registers the purchase -> spend rollup listener
+from .services import product_search  # item search index DDL
 
 # Setup Logging
 logger = setup_logging()
@@ -22,6 +24,20 @@ if os.getenv("SENTRY_DSN"):
 # Create tables
 Base.metadata.create_all(bind=engine)
 
+# Tables created before the item search index existed get it here
+try:
+    product_search.ensure_search_index(engine)
+except Exception as e:
+    logger.warning(f"Product search index setup skipped: {e}")
+
+# Drop OCR cache entries produced by an older prompt/model chain
+try:
+    from .services.ocr import OCR_PROMPT_VERSION
+    from .services.ocr_cache import ocr_cache
+    ocr_cache.invalidate(keep_version=OCR_PROMPT_VERSION)
+except Exception as e:
+    logger.warning(f"OCR cache cleanup skipped: {e}")
+
 import os
 UPLOAD_DIR = "uploads"
 if not os.path.exists(UPLOAD_DIR):
@@ -63,6 +79,7 @@ app.add_middleware(
     allow_credentials=False, # authorization header doesn't require this, and '*' needs it False
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor", "X-Total-Count"], # Cursor pagination of list endpoints
 )
 
 # Mount uploads directory for static file access
@@ -83,6 +100,7 @@ app.include_router(users.router, tags=["Users"])
 app.include_router(budgets.router, prefix="/budgets", tags=["Budgets"])
 app.include_router(closures.router, prefix="/closures", tags=["Closures"])
 app.include_router(reports.router, prefix="/reports", tags=["Reports"])
+app.include_router(jobs.router, prefix="/jobs", tags=["Jobs"])
 
 @app.get("/")
 def read_root():
@@ -91,3 +109,21 @@ def read_root():
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+@app.get("/health/auth")
+def auth_health():
+    from .auth import jwt_verifier
+    from .services.tenant_cache import tenant_cache
+    return {"jwt": jwt_verifier.stats(), "tenant_cache": tenant_cache.stats()}
+
+@app.get("/health/storage")
+def storage_health():
+    from .services.storage import storage_service
+    return storage_service.stats()
+
+@app.get("/health/ocr")
+def ocr_health():
+    from .services.gemini_client import gemini_client
+    from .services.ocr_cache import ocr_cache
+    from .services.ocr_schema import extraction_stats
+    return {"gemini": gemini_client.stats(), "cache": ocr_cache.stats(), "extraction": extraction_stats.stats()}
@@ -1,6 +1,7 @@
 from sqlalchemy import Column, String, Integer, Float, ForeignKey, Boolean, DateTime, Date, Text, Index
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
 from .database import Base
+from .product_names import normalize_product_name
 import uuid
 import enum  # Added missing import
 from datetime import datetime
@@ -77,6 +78,10 @@ class Provider(Base):
     
     created_at = Column(DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        Index('idx_provider_company_name', 'company_id', 'name'),
+    )
+    
     company = relationship("Company", back_populates="providers")
     products = relationship("Product", back_populates="provider")
     purchases = relationship("Purchase", back_populates="provider")
@@ -91,6 +96,7 @@ class Product(Base):
     name = Column(String, nullable=False)
     unit = Column(String, default="unit") # kg, lb, lt, unit
     last_price = Column(Float, default=0.0)
+    last_price_date = Column(Date, nullable=True) # Purchase.date of the approved purchase that set last_price
     
     company = relationship("Company", back_populates="products")
     provider = relationship("Provider", back_populates="products")
@@ -109,15 +115,24 @@ class Receipt(Base):
     
     status = Column(String, default=ReceiptStatus.PENDING.value)
     
+    # Near-duplicate detection (perceptual hash of the image, 64-bit hex)
+    phash = Column(String, nullable=True)
+    duplicate_of_id = Column(String, ForeignKey("receipts.id"), nullable=True)
+    duplicate_distance = Column(Integer, nullable=True) # Hamming distance to duplicate_of_id
+    
+    batch_job_id = Column(String, ForeignKey("ocr_batch_jobs.id"), nullable=True, index=True)
+    
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     processed_at = Column(DateTime, nullable=True)
 
     company = relationship("Company", back_populates="receipts")
     parsed_data = relationship("ParsedData", back_populates="receipt", uselist=False)
+    batch_job = relationship("OCRBatchJob", back_populates="receipts")
 
     __table_args__ = (
         Index('idx_receipt_company_date', 'company_id', 'created_at'),
+        Index('idx_receipt_company_phash', 'company_id', 'phash'),
     )
 
 class ParsedData(Base):
@@ -132,12 +147,18 @@ class ParsedData(Base):
     currency = Column(String)
     category = Column(String)
     confidence_score = Column(Float)
+    ocr_tier = Column(String, nullable=True) # Who produced confidence_score: local, pdf_text, gemini, fallback
     
     # Items extracted from receipt
     items = Column(Text, nullable=True) # JSON list of items found
 
     receipt = relationship("Receipt", back_populates="parsed_data")
 
+    __table_args__ = (
+        # One extraction per receipt: a retried OCR job updates it instead of adding a row
+        Index('uq_parsed_data_receipt', 'receipt_id', unique=True),
+    )
+
 class Purchase(Base):
     __tablename__ = "purchases" # Was reports
 
@@ -164,6 +185,7 @@ class Purchase(Base):
     # Duplicate Detection
     is_duplicate = Column(Boolean, default=False)
     potential_duplicate_of = Column(String, nullable=True) 
+    duplicate_distance = Column(Integer, nullable=True) # Image Hamming distance, None if matched by amount/date
 
     # Notes
     notes = Column(Text)
@@ -182,10 +204,14 @@ class Purchase(Base):
     
     __table_args__ = (
         Index('idx_purchase_company_date', 'company_id', 'date'),
+        Index('idx_purchase_company_created', 'company_id', 'created_at'),
     )
     
     items = relationship("PurchaseItem", back_populates="purchase", cascade="all, delete-orphan")
 
+def _product_key_default(context):
+    return normalize_product_name(context.get_current_parameters().get("name")) or None
+
 class PurchaseItem(Base):
     __tablename__ = "purchase_items"
     
@@ -193,15 +219,25 @@ class PurchaseItem(Base):
     purchase_id = Column(String, ForeignKey("purchases.id"), nullable=False, index=True)
     
     name = Column(String, nullable=False)
+    # Normalized name ("pechuga pollo"), the price-trend series key. Follows every change of name
+    product_key = Column(String, nullable=True, index=True, default=_product_key_default)
     quantity = Column(Float, default=1.0)
     unit = Column(String, nullable=True) # kg, lb, unit
     unit_price = Column(Float, default=0.0)
     total_price = Column(Float, default=0.0)
+    # Matched inventory product, set when the purchase is approved
+    product_id = Column(String, ForeignKey("products.id"), nullable=True, index=True)
     
     created_at = Column(DateTime, default=datetime.utcnow)
     
     purchase = relationship("Purchase", back_populates="items")
 
+    @validates("name")
+    def _sync_product_key(self, key, name):
+        # Renaming an item moves it to the series of its new name (the default only covers Core INSERTs)
+        self.product_key = normalize_product_name(name) or None
+        return name
+
 class Recipe(Base):
     __tablename__ = "recipes"
     
@@ -236,6 +272,7 @@ class CategoryBudget(Base):
     
     period = Column(String, default="MONTHLY") # WEEKLY, MONTHLY
     category = Column(String, nullable=False)
+    tour_id = Column(String, nullable=True, index=True) # Per-tour fund (category TOTAL), used by /reports
     budget_amount = Column(Float, nullable=False)
     
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -261,6 +298,93 @@ class DailyClosure(Base):
     
     company = relationship("Company")
 
+class OCRBatchJob(Base):
+    __tablename__ = "ocr_batch_jobs"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    company_id = Column(String, ForeignKey("companies.id"), nullable=False, index=True)
+
+    status = Column(String, default=ReceiptStatus.PENDING.value) # PENDING -> PROCESSING -> COMPLETED
+    total = Column(Integer, default=0)
+    processed = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    receipts = relationship("Receipt", back_populates="batch_job")
+
+class OCRJob(Base):
+    __tablename__ = "ocr_jobs"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    # Idempotency key: one job per receipt, however many times it is enqueued or retried
+    receipt_id = Column(String, ForeignKey("receipts.id"), nullable=False, unique=True)
+    company_id = Column(String, ForeignKey("companies.id"), nullable=False, index=True)
+
+    status = Column(String, default=ReceiptStatus.PENDING.value) # PENDING -> PROCESSING -> COMPLETED / FAILED
+    attempts = Column(Integer, default=0)
+
+    # Lease: the worker owns the job until lease_expires_at, then the reaper may re-queue it
+    worker_id = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index('idx_ocr_job_status_lease', 'status', 'lease_expires_at'),
+    )
+
+class SpendRollup(Base):
+    __tablename__ = "spend_rollups"
+
+    # Maintained incrementally from Purchase writes (services/spend_rollups.py).
+    # '' stands for no category / no provider, since these columns are part of the key.
+    company_id = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True) # Purchase.date
+    category = Column(String, primary_key=True)
+    provider_id = Column(String, primary_key=True)
+
+    total_amount = Column(Float, default=0.0) # All statuses
+    purchase_count = Column(Integer, default=0)
+    rejected_amount = Column(Float, default=0.0) # Subset of total_amount with status REJECTED
+    rejected_count = Column(Integer, default=0)
+
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class ProductAlias(Base):
+    __tablename__ = "product_aliases"
+
+    id = Column(String, primary_key=True, default=generate_uuid)
+    company_id = Column(String, ForeignKey("companies.id"), nullable=False)
+    alias_key = Column(String, nullable=False) # normalize_product_name(item name)
+    product_id = Column(String, ForeignKey("products.id"), nullable=False, index=True)
+    source = Column(String, default="fuzzy") # fuzzy (learned by the matcher) or confirmed (by a user)
+    score = Column(Float, nullable=True) # Similarity of the fuzzy match
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index('uq_product_alias_company_key', 'company_id', 'alias_key', unique=True),
+    )
+
+class OCRCacheEntry(Base):
+    __tablename__ = "ocr_cache"
+
+    # sha256(prompt_version + raw uploaded bytes)
+    cache_key = Column(String, primary_key=True)
+    prompt_version = Column(String, nullable=False, index=True)
+
+    result = Column(Text, nullable=False) # JSON extraction returned by the model
+    hits = Column(Integer, default=0)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_accessed_at = Column(DateTime, default=datetime.utcnow, index=True) # LRU eviction order
+
 # Backward Compatibility
 Report = Purchase
 ReportStatus = PurchaseStatus
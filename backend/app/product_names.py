@@ -0,0 +1,33 @@
+import re
+import unicodedata
+
+# Words that do not identify a product: Spanish connectors and units/packaging printed on receipts
+STOPWORDS = {
+    "de", "del", "la", "el", "los", "las", "y", "con", "en", "por", "para", "a", "x",
+    "kg", "kgs", "kilo", "kilos", "g", "gr", "grs", "gramos", "lb", "lbs", "libra", "libras",
+    "und", "un", "unid", "unidad", "unidades", "ml", "l", "lt", "lts", "litro", "litros", "cc",
+    "paq", "paquete", "bolsa", "caja"
+}
+
+# Quantities such as "2", "1.5", "500g" or "1kg"
+_QUANTITY = re.compile(r"^\d+([.,]\d+)?[a-z]{0,3}$")
+
+def strip_accents(text: str) -> str:
+    return "".join(
+        c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c)
+    )
+
+def normalize_product_name(name: str) -> str:
+    """
+    Product key of an item name: lowercase, no accents, punctuation, quantities,
+    units or connectors. "Pechuga pollo kg" and "PECHUGA DE POLLO" -> "pechuga pollo".
+    Returns "" when nothing identifying is left.
+    """
+    if not name:
+        return ""
+    text = re.sub(r"[^a-z0-9.,]+", " ", strip_accents(name.lower()))
+    tokens = [token.strip(".,") for token in text.split()]
+    return " ".join(
+        token for token in tokens
+        if token and token not in STOPWORDS and not _QUANTITY.match(token)
+    )
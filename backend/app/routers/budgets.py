@@ -88,17 +88,18 @@ def get_budget_status(
     except Exception:
         return {"error": "Invalid date"}
 
+    # Daily spend rollup, minus rejected purchases
     actuals = db.query(
-        models.Purchase.category,
-        func.sum(models.Purchase.amount).label("total_spent")
+        models.SpendRollup.category,
+        func.sum(models.SpendRollup.total_amount - models.SpendRollup.rejected_amount).label("total_spent"),
+        func.sum(models.SpendRollup.purchase_count - models.SpendRollup.rejected_count)
     ).filter(
-        models.Purchase.company_id == company_id,
-        models.Purchase.date >= start_date,
-        models.Purchase.date <= end_date,
-        models.Purchase.status != models.PurchaseStatus.REJECTED.value 
-    ).group_by(models.Purchase.category).all()
+        models.SpendRollup.company_id == company_id,
+        models.SpendRollup.day >= start_date,
+        models.SpendRollup.day <= end_date
+    ).group_by(models.SpendRollup.category).all()
     
-    actual_map = {category: amount for category, amount in actuals}
+    actual_map = {category or None: amount for category, amount, count in actuals if count}
     
     comparison = []
     # Include all budgeted categories
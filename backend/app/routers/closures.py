@@ -49,18 +49,11 @@ def get_daily_summary(
     )
 
 # ... (previous imports)
-import os
 import uuid
-import shutil
 from ..services.report_generator import generate_clearance_act
-# Assuming simple local storage for now as seen in tours.py, or should use services.storage if available.
-# Let's check services.storage first. It was in the file list.
+# Signature and act go to the configured storage backend only (no local copies)
 from ..services.storage import storage_service
-
-UPLOAD_DIR = "uploads/signatures"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-PDF_DIR = "uploads/actas"
-os.makedirs(PDF_DIR, exist_ok=True)
+from ..services.storage_backends import SIGNATURE_MAX_BYTES
 
 @router.post("/close", response_model=schemas.DailyClosure)
 async def close_day(
@@ -86,15 +79,16 @@ async def close_day(
 
     # 2. Upload Signature
     sig_filename = f"sig_{closure_date}_{uuid.uuid4()}.png"
-    sig_path = os.path.join(UPLOAD_DIR, sig_filename)
     
+    # Streamed to the Cloud/Storage Service, capped at SIGNATURE_MAX_BYTES
+    sig_storage_data = storage_service.upload_stream(
+        signature.file, sig_filename, "image/png", current_user.company_id,
+        size=signature.size, max_bytes=SIGNATURE_MAX_BYTES
+    )
+    cloud_sig_path = sig_storage_data.get("storage_path")
+    # Bounded by the cap above, embedded in the PDF
+    await signature.seek(0)
     content = await signature.read()
-    with open(sig_path, "wb") as buffer:
-        buffer.write(content)
-        
-    # Upload to Cloud/Storage Service
-    sig_storage_data = storage_service.upload_bytes(content, sig_filename, "image/png", current_user.company_id)
-    cloud_sig_path = sig_storage_data.get("storage_path", sig_path)
     
     # 3. Calculate Financials (Balance Logic)
     # Reusing logic from summary endpoint or calculating fresh
@@ -132,21 +126,14 @@ async def close_day(
         "expense_details": expense_details
     }
     
-    # Absolute path for signature for Weasyprint (needs file URI or http URL)
-    abs_sig_path = os.path.abspath(sig_path)
-    abs_sig_path_uri = f"file:///{abs_sig_path.replace(os.sep, '/')}"
-
-    pdf_bytes = generate_clearance_act(closure_data, abs_sig_path_uri)
+    # The signature image is embedded from memory
+    pdf_bytes = generate_clearance_act(closure_data, content)
     
     pdf_filename = f"Acta_Cierre_{closure_date}.pdf"
-    pdf_path = os.path.join(PDF_DIR, pdf_filename)
-    
-    with open(pdf_path, "wb") as f:
-        f.write(pdf_bytes)
         
     # Upload PDF
     pdf_storage_data = storage_service.upload_bytes(pdf_bytes, pdf_filename, "application/pdf", current_user.company_id)
-    cloud_pdf_path = pdf_storage_data.get("storage_path", pdf_path)
+    cloud_pdf_path = pdf_storage_data.get("storage_path")
 
     # Create DB Record
     new_closure = models.DailyClosure(
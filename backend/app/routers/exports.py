@@ -1,11 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
+from typing import List, Optional
 from ..database import get_db
 from .. import models, auth
+from ..services import bulk_export, columnar_export
 from fastapi.responses import StreamingResponse
 import pandas as pd
 import io
-from datetime import datetime
+from datetime import datetime, date
 
 router = APIRouter(
     prefix="/exports",
@@ -80,3 +82,45 @@ def export_providers_excel(
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
+
+@router.get("/parquet")
+def export_parquet(
+    destination: str = Query("download", pattern="^(download|storage)$"),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    status: Optional[List[str]] = Query(None),
+    category: Optional[List[str]] = Query(None),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    """
+    Purchases and line items as Parquet datasets partitioned by month
+    (purchases/month=YYYY-MM/, items/month=YYYY-MM/) plus a _manifest.json with the
+    schema version and per-partition row counts, for BI tools and incremental loads.
+    download: streamed as a zip. storage: written under exports/{company_id}/parquet/,
+    whole unfiltered months only, merged into the stored manifest.
+    """
+    filters = bulk_export.purchase_filters(
+        current_user.company_id, start_date=start_date, end_date=end_date,
+        statuses=status, categories=category
+    )
+    if destination == "storage":
+        # Storage paths are one file per month: a partial month would replace the full one
+        if status or category or not columnar_export.is_whole_month_window(start_date, end_date):
+            raise HTTPException(
+                status_code=400,
+                detail="destination=storage exports whole months only: start_date on the 1st, end_date on the last day, no status/category filters"
+            )
+        try:
+            return columnar_export.export_to_storage(
+                db, current_user.company_id, filters, start_date=start_date, end_date=end_date
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Parquet export failed: {e}")
+
+    filename = f"Compras_Parquet_v{columnar_export.SCHEMA_VERSION}_{datetime.now().strftime('%Y%m%d')}.zip"
+    return StreamingResponse(
+        columnar_export.stream_zip(filters),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
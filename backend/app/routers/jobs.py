@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, HTTPException
+from ..auth import get_user_company
+from ..services import tasks
+
+router = APIRouter(
+    tags=["jobs"],
+)
+
+@router.get("/{job_id}")
+def get_job_status(
+    job_id: str,
+    company_id: str = Depends(get_user_company)
+):
+    """
+    Status of a queued background job (OCR, export, sync).
+    States: PENDING, STARTED, RETRY, SUCCESS, FAILURE.
+    """
+    if not tasks.CELERY_ENABLED:
+        raise HTTPException(status_code=404, detail="Job queue not enabled")
+
+    if tasks.get_job_owner(job_id) != company_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    result = tasks.celery_app.AsyncResult(job_id)
+    response = {"job_id": job_id, "status": result.state}
+    if result.state == "SUCCESS":
+        response["result"] = result.result
+    elif result.state in ("FAILURE", "RETRY"):
+        response["error"] = str(result.info)
+    return response
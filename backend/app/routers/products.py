@@ -3,6 +3,8 @@ from sqlalchemy.orm import Session
 from typing import List
 from ..database import get_db
 from .. import models, schemas, auth
+from ..services import product_matcher
+from ..product_names import normalize_product_name
 
 router = APIRouter(
     tags=["products"],
@@ -57,3 +59,29 @@ def create_product(
     db.commit()
     db.refresh(new_product)
     return new_product
+
+class ProductAliasCreate(BaseModel):
+    name: str # Item name as printed on receipts
+    product_id: str
+
+@router.post("/aliases", response_model=dict)
+def confirm_product_alias(
+    alias: ProductAliasCreate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    """Confirms (or corrects) which product a receipt item name refers to. Later matches use it directly."""
+    product = db.query(models.Product).filter(
+        models.Product.id == alias.product_id,
+        models.Product.company_id == current_user.company_id
+    ).first()
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    key = normalize_product_name(alias.name)
+    if not key:
+        raise HTTPException(status_code=400, detail="Item name has no product words")
+
+    product_matcher.save_alias(db, current_user.company_id, key, product.id, source=product_matcher.CONFIRMED)
+    db.commit()
+    return {"alias": key, "product_id": product.id}
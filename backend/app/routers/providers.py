@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from .. import models, schemas, auth
 from ..database import get_db
+from ..services import pagination
 
 router = APIRouter(
     tags=["providers"],
@@ -12,13 +13,19 @@ router = APIRouter(
 
 @router.get("", response_model=List[schemas.Provider])
 def read_providers(
+    response: Response,
     skip: int = 0, 
-    limit: int = 100, 
+    limit: int = Query(100, ge=1, le=1000), 
+    cursor: Optional[str] = None,
+    include_total: bool = False,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    providers = db.query(models.Provider).filter(models.Provider.company_id == current_user.company_id).offset(skip).limit(limit).all()
-    return providers
+    query = db.query(models.Provider).filter(models.Provider.company_id == current_user.company_id)
+    # Alphabetical keyset on (name, id): served by idx_provider_company_name at any depth
+    page = pagination.paginate(query, [models.Provider.name, models.Provider.id], limit, cursor, descending=False, skip=skip)
+    pagination.set_page_headers(response, page, pagination.estimate_count(db, query) if include_total else None)
+    return page.items
 
 @router.post("", response_model=schemas.Provider)
 def create_provider(
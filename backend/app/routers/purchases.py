@@ -1,12 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Response
+from sqlalchemy import func, extract
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime, date
+import calendar
 
 from ..database import get_db
 from .. import models, schemas, auth
-from ..services import purchase_processor
+from ..services import purchase_processor, tasks, spend_rollups, product_search, pagination
 from ..services.google_sheets_service import google_sheets_service
 
 router = APIRouter(
@@ -39,6 +40,27 @@ def create_purchase(
                 models.Purchase.date == date_obj
             ).first()
 
+        # Image near-duplicate detected at upload time takes precedence (perceptual hash)
+        duplicate_distance = None
+        if purchase.source_file_path:
+            source_receipt = db.query(models.Receipt).filter(
+                models.Receipt.company_id == current_user.company_id,
+                models.Receipt.storage_path == purchase.source_file_path
+            ).first()
+            if source_receipt and source_receipt.duplicate_of_id:
+                original_receipt = db.query(models.Receipt).filter(
+                    models.Receipt.id == source_receipt.duplicate_of_id
+                ).first()
+                original_purchase = None
+                if original_receipt and original_receipt.storage_path:
+                    original_purchase = db.query(models.Purchase).filter(
+                        models.Purchase.company_id == current_user.company_id,
+                        models.Purchase.source_file_path == original_receipt.storage_path
+                    ).first()
+                if original_purchase:
+                    existing_duplicate = original_purchase
+                    duplicate_distance = source_receipt.duplicate_distance
+
         # Logic to Auto-Link or Auto-Create Provider
         final_provider_id = purchase.provider_id
         
@@ -90,7 +112,8 @@ def create_purchase(
             status=models.PurchaseStatus.PROCESSING.value,
             
             is_duplicate=True if existing_duplicate else False,
-            potential_duplicate_of=existing_duplicate.id if existing_duplicate else None
+            potential_duplicate_of=existing_duplicate.id if existing_duplicate else None,
+            duplicate_distance=duplicate_distance
         )
         
         db.add(db_purchase)
@@ -126,20 +149,26 @@ def create_purchase(
                 db.commit()
         
         # Trigger background processing (OCR linking, classification refinement)
-        background_tasks.add_task(purchase_processor.process_purchase, db_purchase.id)
+        tasks.dispatch(
+            tasks.process_purchase_task, background_tasks, purchase_processor.process_purchase,
+            db_purchase.id, company_id=current_user.company_id
+        )
         
         # Trigger Google Sheets Sync
         try:
             items_list = purchase.extracted_data.get('items', []) if purchase.extracted_data else []
             sync_data = {
-                "date": db_purchase.date,
+                "date": str(db_purchase.date),
                 "provider": db_purchase.provider.name if db_purchase.provider else (purchase.extracted_data.get('vendor') if purchase.extracted_data else "Sin Proveedor"),
                 "category": db_purchase.category,
                 "amount": db_purchase.amount,
                 "currency": db_purchase.currency,
                 "items_count": len(items_list) if isinstance(items_list, list) else 0
             }
-            background_tasks.add_task(google_sheets_service.sync_purchase, sync_data)
+            tasks.dispatch(
+                tasks.sync_purchase_task, background_tasks, google_sheets_service.sync_purchase,
+                sync_data, company_id=current_user.company_id
+            )
         except Exception as e:
             print(f"DEBUG: Error preparing GSheets sync: {e}")
         
@@ -151,8 +180,11 @@ def create_purchase(
 
 @router.get("", response_model=List[schemas.Purchase])
 def list_purchases(
+    response: Response,
     skip: int = 0, 
-    limit: int = 100, 
+    limit: int = Query(100, ge=1, le=1000), 
+    cursor: Optional[str] = None,
+    include_total: bool = False,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
     provider_id: Optional[str] = None,
@@ -167,8 +199,11 @@ def list_purchases(
         query = query.filter(models.Purchase.date <= end_date)
     if provider_id:
         query = query.filter(models.Purchase.provider_id == provider_id)
-        
-    return query.order_by(models.Purchase.date.desc()).offset(skip).limit(limit).all()
+    
+    # Keyset on (date, id): served by idx_purchase_company_date at any depth
+    page = pagination.paginate(query, [models.Purchase.date, models.Purchase.id], limit, cursor, skip=skip)
+    pagination.set_page_headers(response, page, pagination.estimate_count(db, query) if include_total else None)
+    return page.items
 
 @router.get("/{purchase_id}", response_model=schemas.Purchase)
 def read_purchase(
@@ -192,46 +227,54 @@ def get_dashboard_stats(
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
     company_id = current_user.company_id
-    query = db.query(models.Purchase).filter(models.Purchase.company_id == company_id)
+    # Aggregates come from the daily spend rollup: O(days), not O(purchases)
+    rollup_filters = [models.SpendRollup.company_id == company_id]
+    if start_date:
+        rollup_filters.append(models.SpendRollup.day >= start_date)
+    if end_date:
+        rollup_filters.append(models.SpendRollup.day <= end_date)
+    
+    total_reports, total_spent = db.query(
+        func.sum(models.SpendRollup.purchase_count),
+        func.sum(models.SpendRollup.total_amount)
+    ).filter(*rollup_filters).one()
+    total_reports = total_reports or 0
+    total_spent = total_spent or 0
+    
+    # Monthly Stats
+    month_col = extract("month", models.SpendRollup.day)
+    monthly_rows = db.query(month_col, func.sum(models.SpendRollup.total_amount)) \
+        .filter(*rollup_filters).group_by(month_col).order_by(month_col).all()
+    monthly_stats = [{"month": calendar.month_abbr[int(m)], "total": int(v or 0)} for m, v in monthly_rows]
+    
+    # Category Stats
+    category_rows = db.query(models.SpendRollup.category, func.sum(models.SpendRollup.total_amount)) \
+        .filter(*rollup_filters).group_by(models.SpendRollup.category).all()
+    category_stats = [{"name": k or "Otros", "value": int(v or 0)} for k, v in category_rows]
+    
+    # Provider Stats: linked providers from the rollup, unlinked purchases by their vendor text
+    provider_rows = db.query(models.Provider.name, func.sum(models.SpendRollup.total_amount)).join(
+        models.Provider, models.Provider.id == models.SpendRollup.provider_id
+    ).filter(*rollup_filters).group_by(models.Provider.name).all()
     
+    query = db.query(models.Purchase).filter(models.Purchase.company_id == company_id)
     if start_date:
         query = query.filter(models.Purchase.date >= start_date)
     if end_date:
         query = query.filter(models.Purchase.date <= end_date)
-        
-    purchases = query.all()
     
-    total_spent = 0
-    total_reports = len(purchases)
+    vendor_col = func.coalesce(func.nullif(models.Purchase.vendor, ""), "Otros")
+    vendor_rows = query.filter(models.Purchase.provider_id == None) \
+        .with_entities(vendor_col, func.sum(models.Purchase.amount)).group_by(vendor_col).all()
     
-    monthly_data = {}
-    category_data = {}
     provider_data = {}
-    
-    for p in purchases:
-        amount = p.amount or 0
-        total_spent += amount
-        
-        # Monthly Stats
-        month_key = p.date.strftime("%b")
-        monthly_data[month_key] = monthly_data.get(month_key, 0) + amount
-        
-        # Category Stats
-        cat = p.category or "Otros"
-        category_data[cat] = category_data.get(cat, 0) + amount
-        
-        # Provider Stats
-        prov = p.provider.name if p.provider else (p.vendor or "Otros")
-        provider_data[prov] = provider_data.get(prov, 0) + amount
-
-    monthly_stats = [{"month": k, "total": int(v)} for k, v in monthly_data.items()]
-    category_stats = [{"name": k, "value": int(v)} for k, v in category_data.items()]
+    for name, value in provider_rows + vendor_rows:
+        provider_data[name] = provider_data.get(name, 0) + (value or 0)
     provider_stats = [{"name": k, "value": int(v)} for k, v in provider_data.items()]
-    
     provider_stats.sort(key=lambda x: x['value'], reverse=True)
     
     recent_activity = []
-    for p in sorted(purchases, key=lambda x: x.date, reverse=True)[:5]:
+    for p in query.order_by(models.Purchase.date.desc()).limit(5).all():
          recent_activity.append({
              "id": p.id,
              "created_at": p.date.isoformat(),
@@ -255,50 +298,12 @@ def get_price_trends(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    search_term = f"%{query.lower()}%"
-    results = db.query(
-        models.Purchase.date,
-        func.avg(models.PurchaseItem.unit_price).label('avg_price')
-    ).join(
-        models.PurchaseItem, models.Purchase.id == models.PurchaseItem.purchase_id
-    ).filter(
-        models.Purchase.company_id == current_user.company_id,
-        func.lower(models.PurchaseItem.name).like(search_term),
-        models.PurchaseItem.unit_price > 0
-    ).group_by(
-        models.Purchase.date
-    ).order_by(
-        models.Purchase.date.asc()
-    ).all()
-    
-    return [{"date": r.date.strftime("%Y-%m-%d"), "price": int(r.avg_price)} for r in results]
+    return product_search.price_trends(db, current_user.company_id, query)
 
 @router.get("/provider-trends", response_model=List[dict])
 def get_provider_trends(
-    months: int = 6,
+    months: int = Query(6, ge=1),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    results = db.query(models.Purchase).options(
-        db.joinedload(models.Purchase.provider)
-    ).filter(
-        models.Purchase.company_id == current_user.company_id,
-        models.Purchase.provider_id != None
-    ).order_by(models.Purchase.date.asc()).all()
-    
-    data_map = {}
-    for p in results:
-        month_key = p.date.strftime("%b %Y")
-        prov_name = p.provider.name if p.provider else "Otros"
-        amount = p.amount or 0
-        if month_key not in data_map: data_map[month_key] = {}
-        data_map[month_key][prov_name] = data_map[month_key].get(prov_name, 0) + amount
-        
-    sorted_keys = sorted(data_map.keys(), key=lambda x: datetime.strptime(x, "%b %Y"))
-    final_list = []
-    for m in sorted_keys:
-        item = {"month": m}
-        item.update(data_map[m])
-        final_list.append(item)
-        
-    return final_list[-months:]
+    return spend_rollups.provider_trends(db, current_user.company_id, months, unknown_name="Otros")
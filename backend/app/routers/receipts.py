@@ -1,17 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, UploadFile, File, Query, Response
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from ..database import get_db
 from .. import models, schemas
-from ..services import ocr
+from ..services import ocr, tasks, pagination
 
 router = APIRouter()
 
 from ..auth import get_user_company
 
 from pathlib import Path
-import shutil
-import uuid
+from contextlib import contextmanager
 import os
 
 @router.post("/upload", response_model=schemas.Receipt)
@@ -23,53 +22,194 @@ def upload_receipt(
 ):
     # 1. Cloud Storage Integration
     from ..services.storage import storage_service
+    from ..services.storage_backends import UPLOAD_MAX_BYTES, UploadTooLarge
+    from ..services.image_hash import compute_dhash, duplicate_index
     
-    # 2. Upload to Cloud (Supabase)
-    # We pass company_id to organize files in the bucket
-    storage_data = storage_service.upload_file(file, company_id)
-    cloud_path = storage_data.get("storage_path")
-    
-    # 3. Save File Locally (Fallback/Cache)
-    UPLOAD_DIR = "uploads/receipts"
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    # Reject a declared oversize upload before reading (or decoding) any of it
+    if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+        raise UploadTooLarge(UPLOAD_MAX_BYTES)
     
-    file_extension = Path(file.filename).suffix
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    local_path = os.path.join(UPLOAD_DIR, unique_filename)
+    # 2. Stream to the configured storage backend (the only copy, OCR reads it back from there)
+    # Size limit, sha256 and MIME sniff happen in the same pass. We pass company_id to organize files in the bucket
+    storage_data = storage_service.upload_file(file, company_id)
     
-    # Reset file pointer after storage_service read it
+    # 2b. Perceptual hash for near-duplicate detection (before paying for OCR), only once the
+    # size limit held. PIL reads the spooled upload from disk, the file is never held in memory
     file.file.seek(0)
-    with open(local_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # 4. Create Receipt Record
+    phash = compute_dhash(file.file)
+    duplicate = duplicate_index.find_duplicate(db, company_id, phash)
+    
+    # 3. Create Receipt Record
     db_receipt = models.Receipt(
         company_id=company_id,
-        file_url=local_path,       # Keep local path for immediate background processing
-        storage_path=cloud_path,   # Permanent cloud path
+        file_url=storage_data.get("file_url"), # Direct URL when the backend has one (local disk)
+        storage_path=storage_data.get("storage_path"),
         filename=file.filename,
-        content_type=file.content_type,
-        status=models.ReceiptStatus.PENDING.value
+        content_type=storage_data.get("content_type") or file.content_type, # Sniffed from the bytes
+        status=models.ReceiptStatus.PENDING.value,
+        phash=phash,
+        duplicate_of_id=duplicate[0] if duplicate else None,
+        duplicate_distance=duplicate[1] if duplicate else None
     )
     db.add(db_receipt)
     db.commit()
     db.refresh(db_receipt)
+    duplicate_index.add(company_id, db_receipt.id, phash)
     
-    # 5. Trigger OCR (Background)
+    # 4. Trigger OCR (Celery "ocr" queue, or BackgroundTasks when no broker is configured)
     # Important: We ONLY pass the ID, the task will create its own DB session
-    background_tasks.add_task(ocr.process_receipt, db_receipt.id)
+    db_receipt.job_id = tasks.dispatch(
+        tasks.process_receipt_task, background_tasks, ocr.process_receipt, db_receipt.id, company_id=company_id
+    )
     
     return db_receipt
 
+BATCH_ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".pdf"}
+BATCH_MAX_FILES = int(os.getenv("OCR_BATCH_MAX_FILES", "500"))
+
+@contextmanager
+def _rewound(file):
+    file.seek(0)
+    yield file
+
+def _list_batch_files(files: List[UploadFile]) -> list:
+    """
+    Lists (filename, content_type, size, open_file) for every receipt in the upload,
+    expanding ZIP archives from their central directory without reading any file.
+    `open_file()` is a context manager over a fresh binary stream of the file, so it
+    can be read more than once without loading it into memory.
+    """
+    import zipfile
+    import mimetypes
+    
+    entries = []
+    for upload in files:
+        suffix = Path(upload.filename or "").suffix.lower()
+        if suffix == ".zip" or upload.content_type in ("application/zip", "application/x-zip-compressed"):
+            # Not closed here: members are opened later. The archive does not own upload.file
+            archive = zipfile.ZipFile(upload.file)
+            for info in archive.infolist():
+                name = Path(info.filename).name
+                if info.is_dir() or name.startswith(".") or Path(name).suffix.lower() not in BATCH_ALLOWED_EXTENSIONS:
+                    continue
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                # file_size is only what the archive claims, UPLOAD_MAX_BYTES is enforced on the real bytes
+                entries.append((name, content_type, info.file_size, lambda archive=archive, info=info: archive.open(info)))
+        elif suffix in BATCH_ALLOWED_EXTENSIONS:
+            entries.append((upload.filename, upload.content_type, upload.size, lambda upload=upload: _rewound(upload.file)))
+    return entries
+
+@router.post("/upload-batch", response_model=schemas.OCRBatchJob)
+def upload_receipts_batch(
+    files: List[UploadFile] = File(...),
+    background_tasks: BackgroundTasks = BackgroundTasks(),
+    db: Session = Depends(get_db),
+    company_id: str = Depends(get_user_company)
+):
+    """
+    Month-end bulk upload: many images/PDFs or ZIP archives in one request.
+    Files are pushed to storage one at a time, and OCR runs as a single batch job
+    whose progress is available at GET /receipts/batch/{job_id}. The batch is all or
+    nothing: if any file fails, the files already stored are deleted again.
+    """
+    from ..services.storage import storage_service
+    from ..services.image_hash import compute_dhash, duplicate_index, BKTree, PHASH_MAX_DISTANCE
+    
+    entries = _list_batch_files(files)
+    if not entries:
+        raise HTTPException(status_code=400, detail="No valid receipt files found in upload")
+    if len(entries) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"Too many files in batch (max {BATCH_MAX_FILES})")
+    
+    job = models.OCRBatchJob(company_id=company_id, status=models.ReceiptStatus.PENDING.value)
+    db.add(job)
+    db.flush()
+    
+    receipts = []
+    # The shared index only learns these receipts after the commit: duplicates within
+    # the batch itself (the same photo twice in a ZIP) are found here
+    batch_hashes = BKTree()
+    try:
+        for filename, content_type, size, open_file in entries:
+            with open_file() as source:
+                storage_data = storage_service.upload_stream(source, filename, content_type, company_id, size=size)
+            if storage_data.get("storage_path") is None:
+                raise HTTPException(status_code=500, detail=f"File upload failed for {filename}: {storage_data.get('error')}")
+            receipt = models.Receipt(
+                id=models.generate_uuid(),
+                company_id=company_id,
+                file_url=storage_data.get("file_url"),
+                storage_path=storage_data.get("storage_path"),
+                filename=filename,
+                content_type=storage_data.get("content_type") or content_type,
+                status=models.ReceiptStatus.PENDING.value,
+                batch_job_id=job.id
+            )
+            receipts.append(receipt)
+            
+            with open_file() as source:
+                receipt.phash = compute_dhash(source)
+            duplicate = duplicate_index.find_duplicate(db, company_id, receipt.phash)
+            if receipt.phash:
+                duplicate = duplicate or batch_hashes.find_nearest(int(receipt.phash, 16), PHASH_MAX_DISTANCE)
+                batch_hashes.add(int(receipt.phash, 16), receipt.id)
+            if duplicate:
+                receipt.duplicate_of_id, receipt.duplicate_distance = duplicate
+    except Exception:
+        db.rollback()
+        for receipt in receipts:
+            storage_service.delete_file(receipt.storage_path)
+        raise
+    
+    job.total = len(receipts)
+    db.add_all(receipts)
+    db.commit()
+    db.refresh(job)
+    for r in receipts:
+        duplicate_index.add(company_id, r.id, r.phash)
+    
+    celery_job_id = tasks.dispatch(
+        tasks.process_receipt_batch_task, background_tasks, ocr.process_receipt_batch, job.id, company_id=company_id
+    )
+    
+    result = schemas.OCRBatchJob.model_validate(job)
+    result.receipt_ids = [r.id for r in receipts]
+    result.celery_job_id = celery_job_id
+    return result
+
+@router.get("/batch/{job_id}", response_model=schemas.OCRBatchJob)
+def read_batch_job(
+    job_id: str,
+    db: Session = Depends(get_db),
+    company_id: str = Depends(get_user_company)
+):
+    job = db.query(models.OCRBatchJob).filter(
+        models.OCRBatchJob.id == job_id,
+        models.OCRBatchJob.company_id == company_id
+    ).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    
+    result = schemas.OCRBatchJob.model_validate(job)
+    result.receipt_ids = [r.id for r in job.receipts]
+    return result
+
 @router.get("/", response_model=List[schemas.Receipt])
 def read_receipts(
+    response: Response,
     skip: int = 0, 
-    limit: int = 100, 
+    limit: int = Query(100, ge=1, le=1000), 
+    cursor: Optional[str] = None,
+    include_total: bool = False,
     db: Session = Depends(get_db),
     company_id: str = Depends(get_user_company)
 ):
     from ..services.storage import storage_service
-    receipts = db.query(models.Receipt).filter(models.Receipt.company_id == company_id).offset(skip).limit(limit).all()
+    query = db.query(models.Receipt).filter(models.Receipt.company_id == company_id)
+    # Keyset on (created_at, id), newest first: served by idx_receipt_company_date at any depth
+    page = pagination.paginate(query, [models.Receipt.created_at, models.Receipt.id], limit, cursor, skip=skip)
+    pagination.set_page_headers(response, page, pagination.estimate_count(db, query) if include_total else None)
+    receipts = page.items
     
     # Enrich with signed URLs if they are in cloud
     for r in receipts:
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List, Optional
 from ..database import get_db
 from .. import models, schemas, auth
+from ..services.recipe_costing import recipe_cost_cache
 import uuid  # Add this import
 
 router = APIRouter(
@@ -42,41 +43,38 @@ def get_recipes(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(auth.get_current_active_user)
 ):
-    recipes = db.query(models.Recipe).filter(models.Recipe.company_id == current_user.company_id).all()
-    
-    results = []
-    for r in recipes:
-        # Calculate cost dynamically based on current inventory price
-        total_cost = 0
-        items_out = []
-        for item in r.items:
-            # item.product.last_price is the cost per unit
-            cost = item.quantity * (item.product.last_price if item.product else 0)
-            total_cost += cost
-            
-            items_out.append({
-                "id": item.id,
-                "product_name": item.product.name if item.product else "Unknown",
-                "quantity": item.quantity,
-                "unit": item.product.unit if item.product else "-",
-                "unit_price": item.product.last_price if item.product else 0,
-                "total_cost": cost
-            })
-            
-        margin = 0
-        if r.sale_price > 0:
-            margin = ((r.sale_price - total_cost) / r.sale_price) * 100
-            
-        results.append({
-            "id": r.id,
-            "name": r.name,
-            "sale_price": r.sale_price,
-            "total_cost": total_cost,
-            "margin": margin,
-            "items": items_out
-        })
-        
-    return results
+    # Costs and margins come from the cached cost graph (one query per company, patched on price changes)
+    return recipe_cost_cache.recipes(db, current_user.company_id)
+
+class PriceShock(BaseModel):
+    product_id: Optional[str] = None
+    name: Optional[str] = None # Every product whose name contains it, e.g. "pollo"
+    change_pct: float # +15 = 15% more expensive
+
+class SimulationRequest(BaseModel):
+    shocks: List[PriceShock]
+
+class RecipeSimulationOut(BaseModel):
+    id: str
+    name: str
+    sale_price: float
+    total_cost: float
+    margin: float
+    simulated_cost: float
+    simulated_margin: float
+    cost_delta: float
+
+@router.post("/simulate", response_model=List[RecipeSimulationOut])
+def simulate_price_shocks(
+    request: SimulationRequest,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(auth.get_current_active_user)
+):
+    """What-if costing of the whole menu under product price changes. Nothing is saved."""
+    for shock in request.shocks:
+        if not shock.product_id and not shock.name:
+            raise HTTPException(status_code=400, detail="Each shock needs a product_id or a name")
+    return recipe_cost_cache.simulate(db, current_user.company_id, [shock.dict() for shock in request.shocks])
 
 @router.post("/", response_model=dict)
 def create_recipe(
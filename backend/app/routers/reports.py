@@ -1,20 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query
-from sqlalchemy import func
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, Response
+from sqlalchemy import func, case, or_, extract
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime, date
 from pathlib import Path
 import shutil
 import uuid
+import calendar
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Query, UploadFile, File
+from fastapi.responses import StreamingResponse
 from ..database import get_db
 from .. import models, schemas
 from ..services import report_generator
 from ..auth import get_current_user, get_user_company
-from ..services import tasks
+from ..services import tasks, spend_rollups, product_search, product_matcher, pagination, bulk_export
 
 router = APIRouter()
 
+# Money received for a tour, not spend
+NON_EXPENSE_CATEGORIES = ("ANTICIPO_RECIBIDO", "RECAUDO_CLIENTE")
+
 @router.on_event("startup")
 def startup_event():
     pass
@@ -24,9 +29,15 @@ def export_zip_endpoint(
     month: int = Query(...),
     year: int = Query(...),
     status: Optional[str] = Query(None, description="Filter by status: 'paid', 'pending', or None for all"),
+    queued: bool = Query(False, description="Run on the 'exports' queue and poll GET /jobs/{job_id}"),
     db: Session = Depends(get_db),
     company_id: str = Depends(get_user_company)
 ):
+    if queued and tasks.CELERY_ENABLED:
+        job = tasks.export_receipts_zip_task.apply_async(args=[month, year, status], kwargs={"company_id": company_id})
+        tasks.remember_job_owner(job.id, company_id)
+        return {"status": "queued", "job_id": job.id}
+
     # Run synchronously for immediate download (MVP)
     # This calls the task function directly instead of queueing it
     result = tasks.export_receipts_zip(company_id, month, year, status_filter=status)
@@ -178,6 +189,8 @@ def approve_report(
     report = db.query(models.Purchase).filter(models.Purchase.id == report_id, models.Purchase.company_id == company_id).first()
     if not report: raise HTTPException(status_code=404, detail="Report not found")
     report.status = models.PurchaseStatus.APPROVED.value
+    # Approved prices feed recipe costing through Product.last_price
+    product_matcher.apply_approved_purchases(db, [report])
     db.commit()
     db.refresh(report)
     return report
@@ -300,56 +313,61 @@ def get_admin_summary(
     """
     Returns a list of all tours with their financial status for the accountant.
     """
-    # 1. Get all unique tours for this company
-    query = db.query(models.Purchase.tour_id).filter(models.Purchase.company_id == company_id)
-    if month: query = query.filter(models.Purchase.month == month)
-    if year: query = query.filter(models.Purchase.year == year)
+    # Tours with activity in the period; their totals cover all of the tour's purchases
+    tours_query = db.query(models.Purchase.tour_id).filter(
+        models.Purchase.company_id == company_id,
+        models.Purchase.tour_id != None,
+        models.Purchase.tour_id != ""
+    )
+    if month: tours_query = tours_query.filter(models.Purchase.month == month)
+    if year: tours_query = tours_query.filter(models.Purchase.year == year)
     
-    tours = [r[0] for r in query.distinct().all() if r[0]]
+    # One grouped pass for every tour: totals per (tour, category)
+    category_col = func.coalesce(models.Purchase.category, "📦 Otros")
+    rows = db.query(
+        models.Purchase.tour_id,
+        category_col,
+        func.sum(func.coalesce(models.Purchase.amount, 0)),
+        func.max(models.Purchase.client_name)
+    ).filter(
+        models.Purchase.company_id == company_id,
+        models.Purchase.tour_id.in_(tours_query.distinct())
+    ).group_by(models.Purchase.tour_id, category_col).all()
     
-    summary_list = []
+    tours = {}
+    for t_id, category, total, client_name in rows:
+        tour = tours.setdefault(t_id, {
+            "client_name": "N/A", "advances": 0, "collections": 0, "expenses": 0, "categories": {}
+        })
+        if client_name: tour["client_name"] = client_name
+        total = total or 0
+        if category == "ANTICIPO_RECIBIDO":
+            tour["advances"] += total
+        elif category == "RECAUDO_CLIENTE":
+            tour["collections"] += total
+        else:
+            tour["expenses"] += total
+            tour["categories"][category] = total
     
-    for t_id in tours:
-        # Get Budget (cat TOTAL)
-        budget_rec = db.query(models.CategoryBudget).filter(
-            models.CategoryBudget.tour_id == t_id,
-            models.CategoryBudget.company_id == company_id,
-            models.CategoryBudget.category == "TOTAL"
-        ).first()
-        budget = budget_rec.budget_amount if budget_rec else 0
-
-        # Get stats
-        reports = db.query(models.Purchase).filter(
-            models.Purchase.tour_id == t_id,
-            models.Purchase.company_id == company_id
-        ).all()
-        
-        advances = 0
-        collections = 0
-        expenses = 0
-        categories = {}
-        client_name = "N/A"
-        
-        for r in reports:
-            if r.client_name: client_name = r.client_name
-            amount = r.amount or 0
-            if r.category == "ANTICIPO_RECIBIDO":
-                advances += amount
-            elif r.category == "RECAUDO_CLIENTE":
-                collections += amount
-            else:
-                expenses += amount
-                cat = r.category or "📦 Otros"
-                categories[cat] = categories.get(cat, 0) + amount
-        
+    # Budgets (cat TOTAL) of all those tours in one query
+    budgets = dict(db.query(models.CategoryBudget.tour_id, models.CategoryBudget.budget_amount).filter(
+        models.CategoryBudget.company_id == company_id,
+        models.CategoryBudget.category == "TOTAL",
+        models.CategoryBudget.tour_id.in_(list(tours))
+    ).all()) if tours else {}
+    
+    summary_list = []
+    for t_id in sorted(tours):
+        tour = tours[t_id]
+        budget = budgets.get(t_id) or 0
         summary_list.append({
             "tour_id": t_id,
-            "client_name": client_name,
+            "client_name": tour["client_name"],
             "total_advances": int(budget), # We use budget as the main "advance/fund"
-            "total_collections": int(collections),
-            "total_expenses": int(expenses),
-            "balance": int((budget + collections) - expenses),
-            "categories": categories
+            "total_collections": int(tour["collections"]),
+            "total_expenses": int(tour["expenses"]),
+            "balance": int((budget + tour["collections"]) - tour["expenses"]),
+            "categories": tour["categories"]
         })
         
     return summary_list
@@ -362,71 +380,71 @@ def get_dashboard_stats(
     db: Session = Depends(get_db),
     company_id: str = Depends(get_user_company)
 ):
-    # Base query
-    query = db.query(models.Purchase).filter(models.Purchase.company_id == company_id)
-    
+    # Totals, monthly and category series come from the daily spend rollup: O(days), not O(purchases)
+    rollup_filters = [models.SpendRollup.company_id == company_id]
+    filters = [models.Purchase.company_id == company_id]
     if start_date:
-        query = query.filter(models.Purchase.created_at >= start_date)
+        rollup_filters.append(models.SpendRollup.day >= start_date)
+        filters.append(models.Purchase.date >= start_date)
     if end_date:
-        query = query.filter(models.Purchase.created_at <= datetime.combine(end_date, datetime.max.time()))
-        
-    reports = query.all()
+        rollup_filters.append(models.SpendRollup.day <= end_date)
+        filters.append(models.Purchase.date <= end_date)
     
-    total_spent = 0
-    total_advances = 0
-    total_collections = 0
-    total_reports = len(reports)
+    rollup_amount = models.SpendRollup.total_amount
+    # Advances and collections are money in, not spend ('' = no category, counts as spend)
+    rollup_is_expense = models.SpendRollup.category.notin_(NON_EXPENSE_CATEGORIES)
     
-    monthly_data = {}
-    category_data = {}
-    client_data = {}
+    totals = db.query(
+        func.sum(models.SpendRollup.purchase_count),
+        func.sum(case((models.SpendRollup.category == "ANTICIPO_RECIBIDO", rollup_amount), else_=0)),
+        func.sum(case((models.SpendRollup.category == "RECAUDO_CLIENTE", rollup_amount), else_=0)),
+        func.sum(case((rollup_is_expense, rollup_amount), else_=0))
+    ).filter(*rollup_filters).one()
+    total_reports, total_advances, total_collections, total_spent = totals
+    total_reports = total_reports or 0
+    total_spent = total_spent or 0
+    total_advances = total_advances or 0
+    total_collections = total_collections or 0
     
-    for r in reports:
-        amount = r.amount or 0
-        
-        # Handle Advances vs Recaudos vs Expenses
-        if r.category == "ANTICIPO_RECIBIDO":
-            total_advances += amount
-            continue # Don't count as spent
-        
-        if r.category == "RECAUDO_CLIENTE":
-            total_collections += amount
-            continue # Don't count as spent
-            
-        total_spent += amount
-        
-        # Monthly Stats
-        month_key = r.created_at.strftime("%b") # Jan, Feb
-        monthly_data[month_key] = monthly_data.get(month_key, 0) + amount
-        
-        # Category Stats
-        cat = r.category or "Uncategorized"
-        category_data[cat] = category_data.get(cat, 0) + amount
-        
-        # Client Stats (Top Clients by Spend)
-        client = r.client_name or "Unknown"
-        client_data[client] = client_data.get(client, 0) + amount
-
-    # Format for Charts
-    monthly_stats = [{"month": k, "total": int(v)} for k, v in monthly_data.items()]
-    category_stats = [{"name": k, "value": int(v)} for k, v in category_data.items()]
-    client_stats = [{"name": k, "value": int(v)} for k, v in client_data.items()]
+    # Monthly Stats (keyed by month name across years, Jan, Feb)
+    month_col = extract("month", models.SpendRollup.day)
+    monthly_rows = db.query(month_col, func.sum(rollup_amount)).filter(*rollup_filters, rollup_is_expense) \
+        .group_by(month_col).order_by(month_col).all()
+    monthly_stats = [{"month": calendar.month_abbr[int(m)], "total": int(v or 0)} for m, v in monthly_rows]
+    
+    # Category Stats
+    category_rows = db.query(models.SpendRollup.category, func.sum(rollup_amount)) \
+        .filter(*rollup_filters, rollup_is_expense).group_by(models.SpendRollup.category).all()
+    category_stats = [{"name": k or "Uncategorized", "value": int(v or 0)} for k, v in category_rows]
     
-    # Sort
-    client_stats.sort(key=lambda x: x['value'], reverse=True)
-    client_stats = client_stats[:5] # Top 5
+    # Client Stats (Top 5 Clients by Spend); clients are not a rollup dimension
+    amount = func.coalesce(models.Purchase.amount, 0)
+    is_expense = or_(
+        models.Purchase.category == None,
+        models.Purchase.category.notin_(NON_EXPENSE_CATEGORIES)
+    )
+    client_col = func.coalesce(models.Purchase.client_name, "Unknown")
+    client_total = func.sum(amount)
+    client_rows = db.query(client_col, client_total).filter(*filters, is_expense) \
+        .group_by(client_col).order_by(client_total.desc()).limit(5).all()
+    client_stats = [{"name": k, "value": int(v or 0)} for k, v in client_rows]
     
-    recent_activity = []
-    # Sort reports by date desc for recent activity
-    sorted_reports = sorted(reports, key=lambda x: x.created_at, reverse=True)
-    for r in sorted_reports[:5]:
-         recent_activity.append({
-             "id": r.id,
-             "tour_id": r.tour_id,
-             "created_at": r.created_at.isoformat(),
-             "amount": int(r.amount) if r.amount else 0,
-             "category": r.category
-         })
+    recent_rows = db.query(
+        models.Purchase.id,
+        models.Purchase.tour_id,
+        models.Purchase.created_at,
+        models.Purchase.amount,
+        models.Purchase.category
+    ).filter(*filters).order_by(models.Purchase.created_at.desc()).limit(5).all()
+    recent_activity = [
+        {
+            "id": r.id,
+            "tour_id": r.tour_id,
+            "created_at": r.created_at.isoformat(),
+            "amount": int(r.amount) if r.amount else 0,
+            "category": r.category
+        } for r in recent_rows
+    ]
 
     # --- NEW: Active Tour Logic ---
     active_tour = None
@@ -444,19 +462,15 @@ def get_dashboard_stats(
         
         if not is_closed:
             # Calculate tour summary
-            tour_reports = db.query(models.Purchase).filter(
+            tour_spent, tour_advances = db.query(
+                func.sum(case((is_expense, amount), else_=0)),
+                func.sum(case((is_expense, 0), else_=amount))
+            ).filter(
                 models.Purchase.tour_id == latest_report.tour_id,
                 models.Purchase.company_id == company_id
-            ).all()
-            
-            tour_spent = 0
-            tour_advances = 0
-            for tr in tour_reports:
-                amt = tr.amount or 0
-                if tr.category in ["ANTICIPO_RECIBIDO", "RECAUDO_CLIENTE"]:
-                    tour_advances += amt
-                else:
-                    tour_spent += amt
+            ).one()
+            tour_spent = tour_spent or 0
+            tour_advances = tour_advances or 0
             
             # Get category-specific budgets
             budgets = db.query(models.CategoryBudget).filter(
@@ -491,10 +505,13 @@ def get_dashboard_stats(
 
 @router.get("/admin/transactions", response_model=List[schemas.Purchase])
 def list_admin_transactions(
+    response: Response,
     month: Optional[int] = Query(None),
     year: Optional[int] = Query(None),
-    limit: int = 100,
+    limit: int = Query(100, ge=1, le=1000),
     skip: int = 0,
+    cursor: Optional[str] = None,
+    include_total: bool = False,
     db: Session = Depends(get_db),
     company_id: str = Depends(get_user_company)
 ):
@@ -508,8 +525,38 @@ def list_admin_transactions(
         query = query.filter(models.Purchase.month == month)
     if year:
         query = query.filter(models.Purchase.year == year)
-        
-    return query.order_by(models.Purchase.created_at.desc()).offset(skip).limit(limit).all()
+    
+    # Keyset on (created_at, id): served by idx_purchase_company_created at any depth
+    page = pagination.paginate(query, [models.Purchase.created_at, models.Purchase.id], limit, cursor, skip=skip)
+    pagination.set_page_headers(response, page, pagination.estimate_count(db, query) if include_total else None)
+    return page.items
+
+@router.get("/admin/transactions/stream")
+def stream_admin_transactions(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    start_date: Optional[date] = Query(None),
+    end_date: Optional[date] = Query(None),
+    status: Optional[List[str]] = Query(None),
+    category: Optional[List[str]] = Query(None),
+    month: Optional[int] = Query(None),
+    year: Optional[int] = Query(None),
+    company_id: str = Depends(get_user_company)
+):
+    """
+    Every matching transaction of the company with its items and provider, streamed
+    in constant memory ('Sábana de Datos' in one request instead of 100-row pages).
+    NDJSON: one purchase per line, items nested. CSV: one row per line item.
+    """
+    filters = bulk_export.purchase_filters(
+        company_id, start_date=start_date, end_date=end_date,
+        statuses=status, categories=category, month=month, year=year
+    )
+    if format == "csv":
+        return StreamingResponse(
+            bulk_export.stream_csv(filters), media_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename=transacciones.csv"}
+        )
+    return StreamingResponse(bulk_export.stream_ndjson(filters), media_type="application/x-ndjson")
 
 @router.get("/price-trends", response_model=List[dict])
 def get_price_trends(
@@ -518,82 +565,18 @@ def get_price_trends(
     company_id: str = Depends(get_user_company)
 ):
     """
-    Returns price history for a given product name (fuzzy search).
+    Returns price history for a given product name (indexed search on the normalized product key).
     """
-    # Find items matching the query
-    # Join with Purchase to get the Date
-    # We want: Date, Unit Price
-    
-    # Lowercase for case-insensitivity
-    search_term = f"%{query.lower()}%"
-    
-    results = db.query(
-        models.Purchase.date,
-        func.avg(models.PurchaseItem.unit_price).label('avg_price')
-    ).join(
-        models.PurchaseItem, models.Purchase.id == models.PurchaseItem.purchase_id
-    ).filter(
-        models.Purchase.company_id == company_id,
-        func.lower(models.PurchaseItem.name).like(search_term),
-        models.PurchaseItem.unit_price > 0 # Ignore zero prices
-    ).group_by(
-        models.Purchase.date
-    ).order_by(
-        models.Purchase.date.asc()
-    ).all()
-    
-    # Format
-    return [
-        {"date": r.date.strftime("%Y-%m-%d"), "price": int(r.avg_price)}
-        for r in results
-    ]
+    return product_search.price_trends(db, company_id, query)
+
 @router.get("/provider-trends", response_model=List[dict])
 def get_provider_trends(
-    months: int = 6,
+    months: int = Query(6, ge=1),
     db: Session = Depends(get_db),
     company_id: str = Depends(get_user_company)
 ):
     """
     Returns monthly spending trends per provider for the last N months.
-    Output: [{ "month": "Jan", "Coca Cola": 100, "MacPollo": 200 }, ...]
+    Output: [{ "month": "Jan 2024", "Coca Cola": 100, "MacPollo": 200 }, ...]
     """
-    # Calculate start date
-    # Simple logic: Go back N months from today
-    # (For production, better date handling suggested)
-    
-    # query all purchases with provider info
-    # We do python-side aggregation for DB compatibility
-    results = db.query(models.Purchase).options(
-        db.joinedload(models.Purchase.provider)
-    ).filter(
-        models.Purchase.company_id == company_id,
-        models.Purchase.provider_id != None  # Only linked purchases
-    ).order_by(models.Purchase.date.asc()).all()
-    
-    data_map = {} # Key: "YYYY-MM", Value: { "provider_name": amount }
-    
-    for p in results:
-        month_key = p.date.strftime("%b %Y") # e.g. "Jan 2024"
-        prov_name = p.provider.name if p.provider else "Unknown"
-        amount = p.amount or 0
-        
-        if month_key not in data_map:
-            data_map[month_key] = {}
-        
-        data_map[month_key][prov_name] = data_map[month_key].get(prov_name, 0) + amount
-        
-    # Transform to list
-    final_list = []
-    # Sort by date implicitly if we iterate the map keys in order? 
-    # Better to use the known sorted order from the query or sort keys now.
-    # Quick fix: Sort keys by datetime parsing
-    
-    sorted_keys = sorted(data_map.keys(), key=lambda x: datetime.strptime(x, "%b %Y"))
-    
-    for m in sorted_keys:
-        item = {"month": m}
-        item.update(data_map[m])
-        final_list.append(item)
-        
-    # Limit to last N months
-    return final_list[-months:]
+    return spend_rollups.provider_trends(db, company_id, months, unknown_name="Unknown")
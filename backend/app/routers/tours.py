@@ -13,6 +13,7 @@ import os
 import uuid
 from datetime import datetime
 from ..services.email_service import email_service
+from ..services.storage_backends import SIGNATURE_MAX_BYTES
 # from ..routers.reports import get_tour_summary_data # REMOVED
 
 router = APIRouter(
@@ -21,11 +22,6 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-UPLOAD_DIR = "uploads/signatures"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-PDF_DIR = "uploads/actas"
-os.makedirs(PDF_DIR, exist_ok=True)
-
 @router.post("/{tour_id}/close")
 async def close_tour(
     tour_id: str,
@@ -49,19 +45,16 @@ async def close_tour(
         # 3. Setup Signature
         from ..services.storage import storage_service
         sig_filename = f"{tour_id}_sig_{uuid.uuid4()}.png"
-        sig_path = os.path.join(UPLOAD_DIR, sig_filename)
         
+        # Stream Signature to the storage backend (the only copy), capped at SIGNATURE_MAX_BYTES
+        sig_storage_data = storage_service.upload_stream(
+            signature.file, sig_filename, "image/png", company_id,
+            size=signature.size, max_bytes=SIGNATURE_MAX_BYTES
+        )
+        cloud_sig_path = sig_storage_data.get("storage_path")
+        # Bounded by the cap above, embedded in the PDF
+        await signature.seek(0)
         content = await signature.read()
-        with open(sig_path, "wb") as buffer:
-            buffer.write(content)
-        
-        # Upload Signature to Supabase
-        sig_storage_data = storage_service.upload_bytes(content, sig_filename, "image/png", company_id)
-        cloud_sig_path = sig_storage_data.get("storage_path", sig_path)
-        
-        # Absolute path for WeasyPrint template
-        abs_sig_path = os.path.abspath(sig_path)
-        abs_sig_path_uri = f"file:///{abs_sig_path.replace(os.sep, '/')}"
     
         # 4. Calculate Financials
         total_advances = 0
@@ -104,19 +97,15 @@ async def close_tour(
         }
     
         # 5. Generate PDF
-        pdf_bytes = generate_clearance_act(tour_data, abs_sig_path_uri)
+        pdf_bytes = generate_clearance_act(tour_data, content)
         if not pdf_bytes:
             raise HTTPException(status_code=500, detail="Failed to generate PDF")
             
         pdf_filename = f"Acta_{tour_id}.pdf"
-        pdf_path = os.path.join(PDF_DIR, pdf_filename)
-        
-        with open(pdf_path, "wb") as f:
-            f.write(pdf_bytes)
                 
-        # Upload PDF to Supabase
+        # Upload PDF to the storage backend
         pdf_storage_data = storage_service.upload_bytes(pdf_bytes, pdf_filename, "application/pdf", company_id)
-        cloud_pdf_path = pdf_storage_data.get("storage_path", pdf_path)
+        cloud_pdf_path = pdf_storage_data.get("storage_path")
     
         # 6. Create Closure Record
         closure = models.TourClosure(
@@ -140,7 +129,7 @@ async def close_tour(
             guide_name=guide_name
         )
     
-        return {"status": "success", "message": "Tour closed successfully", "pdf_url": pdf_path}
+        return {"status": "success", "message": "Tour closed successfully", "pdf_url": cloud_pdf_path}
     except Exception as e:
         import traceback
         error_msg = traceback.format_exc()
@@ -4,6 +4,7 @@ from typing import List, Optional
 from ..database import get_db
 from .. import models, schemas
 from ..auth import get_current_user, get_user_company
+from ..services.tenant_cache import tenant_cache
 
 router = APIRouter()
 
@@ -39,6 +40,7 @@ def join_organization(
     db_user.role = models.UserRole.STAFF.value # Ensure they become Staff
     
     db.commit()
+    tenant_cache.invalidate(user_id)
     return {"status": "success", "company_name": company.name}
 
 @router.get("/admin/team")
@@ -115,6 +117,7 @@ def deactivate_member(
     # For now toggle active.
     
     db.commit()
+    tenant_cache.invalidate(target_user.id)
     return {"status": "success"}
 
 @router.post("/admin/users")
@@ -146,6 +149,7 @@ def create_user_manual(
             existing_user.company_id = company_id
             existing_user.role = user_data.role
             db.commit()
+            tenant_cache.invalidate(existing_user.id)
             return {"status": "success", "message": "Usuario existente añadido a la empresa"}
             
     # 3. Create pre-provisioned user
@@ -159,5 +163,6 @@ def create_user_manual(
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    tenant_cache.invalidate(new_user.id)
     
     return {"status": "success", "user": new_user}
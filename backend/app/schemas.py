@@ -65,6 +65,7 @@ class ParsedDataBase(BaseModel):
     currency: Optional[str] = None
     category: Optional[str] = None
     confidence_score: Optional[float] = None
+    ocr_tier: Optional[str] = None # local, pdf_text, gemini, fallback
     items: Optional[str] = None # JSON string
 
 class ParsedDataCreate(ParsedDataBase):
@@ -96,7 +97,28 @@ class Receipt(ReceiptBase):
     filename: Optional[str] = None
     content_type: Optional[str] = None
     
+    # Near-duplicate detection
+    phash: Optional[str] = None
+    duplicate_of_id: Optional[str] = None
+    duplicate_distance: Optional[int] = None
+    
     parsed_data: Optional[ParsedData] = None
+    job_id: Optional[str] = None # Celery job id for the OCR task (GET /jobs/{job_id})
+
+    class Config:
+        from_attributes = True
+
+class OCRBatchJob(BaseModel):
+    id: str
+    company_id: str
+    status: str
+    total: int
+    processed: int
+    failed: int
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    receipt_ids: List[str] = []
+    celery_job_id: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -136,6 +158,7 @@ class Purchase(PurchaseBase):
     
     is_duplicate: bool = False
     potential_duplicate_of: Optional[str] = None
+    duplicate_distance: Optional[int] = None
     
     provider: Optional[Provider] = None
 
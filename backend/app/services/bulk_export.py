@@ -0,0 +1,138 @@
+import io
+import os
+import csv
+import json
+import logging
+from datetime import date, datetime
+from collections import defaultdict
+from sqlalchemy import select
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round-trip from the server-side cursor; memory stays O(chunk) whatever the total
+BULK_EXPORT_CHUNK_SIZE = int(os.getenv("BULK_EXPORT_CHUNK_SIZE", "2000"))
+
+Purchase = models.Purchase
+Item = models.PurchaseItem
+
+PURCHASE_COLUMNS = {
+    "id": Purchase.id,
+    "date": Purchase.date,
+    "created_at": Purchase.created_at,
+    "status": Purchase.status,
+    "category": Purchase.category,
+    "amount": Purchase.amount,
+    "currency": Purchase.currency,
+    "vendor": Purchase.vendor,
+    "invoice_number": Purchase.invoice_number,
+    "client_name": Purchase.client_name,
+    "tour_id": Purchase.tour_id,
+    "provider_id": Purchase.provider_id,
+    "provider_name": models.Provider.name,
+}
+
+ITEM_COLUMNS = {
+    "item_id": Item.id,
+    "item_name": Item.name,
+    "item_product_key": Item.product_key,
+    "item_quantity": Item.quantity,
+    "item_unit": Item.unit,
+    "item_unit_price": Item.unit_price,
+    "item_total_price": Item.total_price,
+}
+
+def purchase_filters(company_id: str, start_date: date = None, end_date: date = None, statuses: list = None,
+                     categories: list = None, month: int = None, year: int = None) -> list:
+    """WHERE clauses pushed down to SQL; company_id first so the (company_id, date) index leads."""
+    filters = [Purchase.company_id == company_id]
+    if start_date:
+        filters.append(Purchase.date >= start_date)
+    if end_date:
+        filters.append(Purchase.date <= end_date)
+    if statuses:
+        filters.append(Purchase.status.in_(statuses))
+    if categories:
+        filters.append(Purchase.category.in_(categories))
+    if month:
+        filters.append(Purchase.month == month)
+    if year:
+        filters.append(Purchase.year == year)
+    return filters
+
+def iter_chunks(db, filters: list, chunk_size: int = None):
+    """
+    Yields lists of (purchase row dict, [item row dicts]). Purchases come from one
+    server-side cursor (yield_per); items are read with one query per chunk.
+    No ORM objects are built.
+    """
+    chunk_size = chunk_size or BULK_EXPORT_CHUNK_SIZE
+    purchases = select(*[c.label(name) for name, c in PURCHASE_COLUMNS.items()]).outerjoin(
+        models.Provider, models.Provider.id == Purchase.provider_id
+    ).where(*filters).order_by(Purchase.date, Purchase.id).execution_options(yield_per=chunk_size)
+
+    for partition in db.execute(purchases).mappings().partitions():
+        rows = [dict(row) for row in partition]
+        items = defaultdict(list)
+        item_rows = db.execute(
+            select(Item.purchase_id, *[c.label(name) for name, c in ITEM_COLUMNS.items()])
+            .where(Item.purchase_id.in_([row["id"] for row in rows]))
+            .order_by(Item.purchase_id, Item.id)
+        ).mappings()
+        for item in item_rows:
+            item = dict(item)
+            items[item.pop("purchase_id")].append(item)
+        yield [(row, items.get(row["id"], [])) for row in rows]
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def _with_session(session_factory, produce):
+    """Streaming responses outlive the request's session: each stream owns one."""
+    if session_factory is None:
+        from ..database import SessionLocal
+        session_factory = SessionLocal
+    db = session_factory()
+    try:
+        yield from produce(db)
+    finally:
+        db.close()
+
+def stream_ndjson(filters: list, session_factory=None, chunk_size: int = None):
+    """One JSON object per purchase, items nested: {"id": ..., "items": [{"item_name": ...}]}."""
+    def produce(db):
+        count = 0
+        for chunk in iter_chunks(db, filters, chunk_size):
+            lines = []
+            for purchase, items in chunk:
+                purchase["items"] = items
+                lines.append(json.dumps(purchase, default=_json_default, ensure_ascii=False))
+            count += len(chunk)
+            yield "\n".join(lines) + "\n"
+        logger.info(f"Streamed {count} purchases as NDJSON")
+    return _with_session(session_factory, produce)
+
+def stream_csv(filters: list, session_factory=None, chunk_size: int = None):
+    """One row per line item with the purchase columns repeated; purchases without items get one row."""
+    def produce(db):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(list(PURCHASE_COLUMNS) + list(ITEM_COLUMNS))
+        empty_item = [None] * len(ITEM_COLUMNS)
+        count = 0
+        for chunk in iter_chunks(db, filters, chunk_size):
+            for purchase, items in chunk:
+                values = [_json_default(v) if isinstance(v, (date, datetime)) else v for v in purchase.values()]
+                for item in items or [None]:
+                    writer.writerow(values + (list(item.values()) if item else empty_item))
+            count += len(chunk)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+        logger.info(f"Streamed {count} purchases as CSV")
+    return _with_session(session_factory, produce)
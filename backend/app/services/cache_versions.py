@@ -0,0 +1,53 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cross-worker invalidation of in-process caches, on whenever Redis is configured
+CACHE_VERSIONS_REDIS = bool(os.getenv("REDIS_URL"))
+
+ALL = "all"
+
+class CacheVersions:
+    """
+    Per-company version counters in Redis for caches that live in each worker's memory.
+    A worker bumps the counter after committing a change; every worker compares the
+    version its cached copy was built under with `current()` and reloads on mismatch.
+    Without Redis (or while it is unreachable) `current()` is None and the caches
+    fall back to their TTL.
+    """
+    def __init__(self, namespace: str, redis_client=None):
+        self.namespace = namespace
+        self._redis = redis_client
+        self._use_redis = redis_client is not None or CACHE_VERSIONS_REDIS
+
+    def _get_redis(self):
+        if self._redis is None:
+            import redis
+            from ..celery_app import REDIS_URL
+            self._redis = redis.Redis.from_url(REDIS_URL)
+        return self._redis
+
+    def _key(self, company_id: str = None) -> str:
+        return f"cache_version:{self.namespace}:{company_id or ALL}"
+
+    def current(self, company_id: str) -> tuple:
+        """(global version, company version), or None when versions are not shared."""
+        if not self._use_redis:
+            return None
+        try:
+            everyone, company = self._get_redis().mget(self._key(), self._key(company_id))
+            return (int(everyone or 0), int(company or 0))
+        except Exception as e:
+            logger.warning(f"Cache version lookup for {self.namespace} failed: {e}")
+            return None
+
+    def bump(self, company_id: str = None) -> int:
+        """Marks one company (or every company) as changed. Returns the new counter, None without Redis."""
+        if not self._use_redis:
+            return None
+        try:
+            return int(self._get_redis().incr(self._key(company_id)))
+        except Exception as e:
+            logger.warning(f"Cache version bump for {self.namespace} failed: {e}")
+            return None
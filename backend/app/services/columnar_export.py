@@ -0,0 +1,212 @@
+import os
+import json
+import shutil
+import logging
+import zipfile
+import calendar
+import tempfile
+from datetime import date, datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .bulk_export import iter_chunks, _with_session, BULK_EXPORT_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Bumped on any incompatible change to the columns below. Downstream jobs read it from
+# _manifest.json (and each file's metadata) and re-read every partition when it changes.
+SCHEMA_VERSION = 1
+# Bytes per read when streaming the finished archive to the client
+COLUMNAR_EXPORT_STREAM_BYTES = int(os.getenv("COLUMNAR_EXPORT_STREAM_BYTES", str(1024 * 1024)))
+
+MANIFEST = "_manifest.json"
+PURCHASES = "purchases"
+ITEMS = "items"
+
+def _schema(dataset: str, fields: list) -> pa.Schema:
+    return pa.schema(fields, metadata={"schema_version": str(SCHEMA_VERSION), "dataset": dataset})
+
+PURCHASES_SCHEMA = _schema(PURCHASES, [
+    ("id", pa.string()),
+    ("date", pa.date32()),
+    ("created_at", pa.timestamp("us")),
+    ("status", pa.string()),
+    ("category", pa.string()),
+    ("amount", pa.float64()),
+    ("currency", pa.string()),
+    ("vendor", pa.string()),
+    ("invoice_number", pa.string()),
+    ("client_name", pa.string()),
+    ("tour_id", pa.string()),
+    ("provider_id", pa.string()),
+    ("provider_name", pa.string()),
+])
+
+ITEMS_SCHEMA = _schema(ITEMS, [
+    ("purchase_id", pa.string()),
+    ("date", pa.date32()),
+    ("item_id", pa.string()),
+    ("item_name", pa.string()),
+    ("item_product_key", pa.string()),
+    ("item_quantity", pa.float64()),
+    ("item_unit", pa.string()),
+    ("item_unit_price", pa.float64()),
+    ("item_total_price", pa.float64()),
+])
+
+SCHEMAS = {PURCHASES: PURCHASES_SCHEMA, ITEMS: ITEMS_SCHEMA}
+
+def month_key(day) -> str:
+    return day.strftime("%Y-%m")
+
+def partition_path(dataset: str, month: str) -> str:
+    """Hive-style layout, readable as one dataset by pyarrow, Spark, DuckDB or pandas."""
+    return f"{dataset}/month={month}/part-0.parquet"
+
+class PartitionedWriter:
+    """
+    One ParquetWriter per (dataset, month) under `root`. Purchases arrive sorted by
+    date, so a month's writer is closed as soon as the next month starts and only one
+    file per dataset is open at a time.
+    """
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.partitions = {}
+        self._open = {}
+
+    def write(self, dataset: str, month: str, rows: list):
+        if not rows:
+            return
+        current = self._open.get(dataset)
+        if current is not None and current[0] != month:
+            current[1].close()
+            current = None
+        if current is None:
+            path = partition_path(dataset, month)
+            os.makedirs(os.path.dirname(os.path.join(self.root, path)), exist_ok=True)
+            current = (month, pq.ParquetWriter(os.path.join(self.root, path), SCHEMAS[dataset], compression="zstd"))
+            self._open[dataset] = current
+            self.partitions.setdefault((dataset, month), {"dataset": dataset, "month": month, "path": path, "rows": 0})
+        current[1].write_batch(pa.RecordBatch.from_pylist(rows, schema=SCHEMAS[dataset]))
+        self.partitions[(dataset, month)]["rows"] += len(rows)
+
+    def close(self) -> dict:
+        for _, writer in self._open.values():
+            writer.close()
+        self._open.clear()
+        manifest = {
+            "schema_version": SCHEMA_VERSION,
+            "generated_at": datetime.utcnow().isoformat(),
+            "partitions": sorted(self.partitions.values(), key=lambda p: (p["dataset"], p["month"])),
+        }
+        with open(os.path.join(self.root, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+def write_dataset(db, filters: list, root: str, chunk_size: int = None) -> dict:
+    """
+    Writes the matching purchases and their items as Parquet partitioned by month
+    under `root`, one Arrow record batch per month and chunk. Returns the manifest.
+    """
+    writer = PartitionedWriter(root)
+    try:
+        for chunk in iter_chunks(db, filters, chunk_size or BULK_EXPORT_CHUNK_SIZE):
+            purchases, items = {}, {}
+            for purchase, purchase_items in chunk:
+                month = month_key(purchase["date"])
+                purchases.setdefault(month, []).append(purchase)
+                items.setdefault(month, []).extend(
+                    dict(item, purchase_id=purchase["id"], date=purchase["date"]) for item in purchase_items
+                )
+            for month in sorted(purchases):
+                writer.write(PURCHASES, month, purchases[month])
+                writer.write(ITEMS, month, items[month])
+    finally:
+        manifest = writer.close()
+    logger.info(f"Wrote {len(manifest['partitions'])} Parquet partitions (schema v{SCHEMA_VERSION})")
+    return manifest
+
+def _archive(root: str, zip_path: str):
+    # Parquet is already compressed: store the files as they are
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as archive:
+        for folder, _, files in os.walk(root):
+            for name in sorted(files):
+                path = os.path.join(folder, name)
+                archive.write(path, os.path.relpath(path, root))
+
+def stream_zip(filters: list, session_factory=None, chunk_size: int = None):
+    """
+    Yields a zip of the partitioned dataset plus _manifest.json. Partitions are
+    written to a temp dir first (Parquet needs its footer), then read back in chunks.
+    """
+    def produce(db):
+        workdir = tempfile.mkdtemp(prefix="parquet_export_")
+        try:
+            root = os.path.join(workdir, "dataset")
+            write_dataset(db, filters, root, chunk_size)
+            zip_path = os.path.join(workdir, "export.zip")
+            _archive(root, zip_path)
+            with open(zip_path, "rb") as f:
+                while True:
+                    block = f.read(COLUMNAR_EXPORT_STREAM_BYTES)
+                    if not block:
+                        break
+                    yield block
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return _with_session(session_factory, produce)
+
+def is_whole_month_window(start_date: date = None, end_date: date = None) -> bool:
+    """True when the window starts on a month's first day and ends on a month's last day (open ends allowed)."""
+    if start_date and start_date.day != 1:
+        return False
+    if end_date and end_date.day != calendar.monthrange(end_date.year, end_date.month)[1]:
+        return False
+    return True
+
+def _in_window(month: str, start_date: date = None, end_date: date = None) -> bool:
+    return (not start_date or month >= month_key(start_date)) and (not end_date or month <= month_key(end_date))
+
+def _previous_manifest(storage_service, prefix: str) -> dict:
+    raw = storage_service.download_file(f"{prefix}/{MANIFEST}")
+    if not raw:
+        return {"partitions": []}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        logger.warning(f"Unreadable {prefix}/{MANIFEST}, rebuilding it from this export")
+        return {"partitions": []}
+
+def export_to_storage(db, company_id: str, filters: list, chunk_size: int = None,
+                      start_date: date = None, end_date: date = None) -> dict:
+    """
+    Uploads every partition under exports/{company_id}/parquet/v{SCHEMA_VERSION}/ and merges
+    the manifest. Paths are stable, so re-exporting a month replaces its files and downstream
+    jobs can compare manifests to re-read only the months that changed. `filters` must cover
+    whole months between start_date and end_date with no other conditions (see
+    is_whole_month_window): months outside that window keep their files and manifest entries,
+    months inside it that no longer have rows are removed.
+    """
+    from .storage import storage_service
+    prefix = f"exports/{company_id}/parquet/v{SCHEMA_VERSION}"
+    workdir = tempfile.mkdtemp(prefix="parquet_export_")
+    try:
+        manifest = write_dataset(db, filters, workdir, chunk_size)
+        for partition in manifest["partitions"]:
+            with open(os.path.join(workdir, partition["path"]), "rb") as f:
+                storage_service.put_bytes(f"{prefix}/{partition['path']}", f.read(), "application/vnd.apache.parquet")
+
+        written = {partition["path"] for partition in manifest["partitions"]}
+        kept = []
+        for partition in _previous_manifest(storage_service, prefix)["partitions"]:
+            if not _in_window(partition["month"], start_date, end_date):
+                kept.append(partition)
+            elif partition["path"] not in written:
+                storage_service.delete_file(f"{prefix}/{partition['path']}")
+        manifest["partitions"] = sorted(kept + manifest["partitions"], key=lambda p: (p["dataset"], p["month"]))
+
+        storage_service.put_bytes(f"{prefix}/{MANIFEST}", json.dumps(manifest, indent=2).encode("utf-8"), "application/json")
+        return {"status": "success", "prefix": prefix, "manifest": manifest}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,207 @@
+import os
+import time
+import bisect
+import asyncio
+import logging
+import threading
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# Seconds. Upper bounds of the latency histogram buckets (last bucket is +inf)
+LATENCY_BUCKETS = [0.5, 1, 2, 5, 10, 20, 30, 60]
+
+class AllModelsFailed(Exception):
+    pass
+
+class CircuitBreaker:
+    """
+    Per-model breaker. Opens after `failure_threshold` consecutive failures
+    (or immediately on a rate limit) and lets a single probe through after `cooldown`.
+    """
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self, rate_limited: bool = False):
+        self.failures += 1
+        self._probing = False
+        if rate_limited or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def to_dict(self) -> dict:
+        labels = [f"le_{b}" for b in self.buckets] + ["le_inf"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.count,
+            "avg_seconds": (self.total / self.count) if self.count else 0.0
+        }
+
+def _is_rate_limit(error: Exception) -> bool:
+    text = str(error)
+    return "429" in text or "ResourceExhausted" in type(error).__name__ or "quota" in text.lower()
+
+class GeminiOCRClient:
+    """
+    Asyncio Gemini client shared by the whole process.
+    - GenerativeModel instances are built once per model name and reused.
+    - A semaphore caps in-flight requests across all callers.
+    - Each model has a circuit breaker, so a model that is failing or rate limited
+      is skipped for a cool-down window instead of being retried on every receipt.
+    Sync callers (BackgroundTasks, Celery) go through `generate_sync`, which runs the
+    coroutine on a dedicated event-loop thread so the concurrency cap stays global.
+    """
+    def __init__(self):
+        self.max_concurrency = int(os.getenv("GEMINI_MAX_CONCURRENCY", "4"))
+        self.failure_threshold = int(os.getenv("GEMINI_BREAKER_FAILURES", "3"))
+        self.cooldown = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "60"))
+        self.reset()
+
+    def reset(self):
+        """Drops cached models, breakers and metrics (and stops the loop thread, if any)."""
+        loop = getattr(self, "_loop", None)
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+        self._models = {}
+        self._breakers = {}
+        self._histograms = {}
+        self._loop = None
+        self._thread = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    def _get_model(self, model_name: str):
+        model = self._models.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(model_name)
+            self._models[model_name] = model
+        return model
+
+    def breaker(self, model_name: str) -> CircuitBreaker:
+        if model_name not in self._breakers:
+            self._breakers[model_name] = CircuitBreaker(self.failure_threshold, self.cooldown)
+        return self._breakers[model_name]
+
+    def _histogram(self, model_name: str) -> LatencyHistogram:
+        if model_name not in self._histograms:
+            self._histograms[model_name] = LatencyHistogram()
+        return self._histograms[model_name]
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                self._thread = threading.Thread(target=self._loop.run_forever, name="gemini-client", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    async def _generate(self, model_names: list, contents: list, parse=None, retries: int = 1, generation_config=None):
+        for model_name in model_names:
+            breaker = self.breaker(model_name)
+            if not breaker.allow_request():
+                logger.info(f"Skipping {model_name}: circuit {breaker.state}")
+                continue
+
+            delay = 2
+            for attempt in range(retries + 1):
+                logger.info(f"Trying OCR with model: {model_name} (Attempt {attempt+1})")
+                started = time.monotonic()
+                try:
+                    async with self._semaphore:
+                        response = await self._get_model(model_name).generate_content_async(
+                            contents, generation_config=generation_config
+                        )
+                    if not response or not response.text:
+                        raise Exception("Empty response from Gemini")
+                except Exception as e:
+                    self._histogram(model_name).observe(time.monotonic() - started)
+                    rate_limited = _is_rate_limit(e)
+                    breaker.record_failure(rate_limited=rate_limited)
+                    logger.error(f"Gemini error with {model_name} on attempt {attempt+1}: {e}")
+                    if rate_limited or not breaker.allow_request() or attempt >= retries:
+                        break
+                    await asyncio.sleep(delay)
+                    delay *= 2
+                    continue
+
+                self._histogram(model_name).observe(time.monotonic() - started)
+                breaker.record_success()
+                try:
+                    return (parse(response.text) if parse else response.text), model_name
+                except Exception as e:
+                    # Model is healthy, the answer was unusable: retry without tripping the breaker
+                    logger.error(f"Unparseable response from {model_name} on attempt {attempt+1}: {e}")
+                    if attempt >= retries:
+                        break
+
+        raise AllModelsFailed("No Gemini model produced a usable response")
+
+    async def generate(self, model_names: list, contents: list, parse=None, retries: int = 1, generation_config=None):
+        """Awaitable from any event loop. Returns (result, model_name)."""
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(
+            self._generate(model_names, contents, parse, retries, generation_config), loop
+        )
+        return await asyncio.wrap_future(future)
+
+    def generate_sync(self, model_names: list, contents: list, parse=None, retries: int = 1, generation_config=None):
+        """Blocking variant for worker threads. Returns (result, model_name)."""
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(
+            self._generate(model_names, contents, parse, retries, generation_config), loop
+        )
+        return future.result()
+
+    def stats(self) -> dict:
+        names = set(self._breakers) | set(self._histograms)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "models": {
+                name: {
+                    "circuit": self.breaker(name).state,
+                    "consecutive_failures": self.breaker(name).failures,
+                    "latency": self._histogram(name).to_dict()
+                } for name in sorted(names)
+            }
+        }
+
+# Singleton instance
+gemini_client = GeminiOCRClient()
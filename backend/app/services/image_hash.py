@@ -0,0 +1,151 @@
+import io
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+from PIL import Image
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# Max Hamming distance (out of 64 bits) to consider two receipt photos the same document
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "6"))
+# created_at is stamped by the inserting worker's clock at INSERT, before its commit: a receipt
+# committed after a sync can carry an earlier created_at. Each sync re-reads this far back
+# (already indexed ids are skipped), covering open transactions and clock skew between workers.
+PHASH_SYNC_OVERLAP_SECONDS = int(os.getenv("PHASH_SYNC_OVERLAP_SECONDS", "120"))
+
+def compute_dhash(file_data, hash_size: int = 8) -> str:
+    """
+    Difference hash: grayscale, shrink to (hash_size+1 x hash_size) and compare
+    adjacent pixels. Robust to re-compression, resizing and small lighting changes.
+    `file_data` is bytes or a binary file object (read from its current position).
+    Returns a 16-char hex string, or None if the file is not a decodable image.
+    """
+    try:
+        img = Image.open(file_data if hasattr(file_data, "read") else io.BytesIO(file_data))
+        # JPEG draft mode decodes at 1/2..1/8 scale, we only need a tiny thumbnail
+        img.draft("L", (hash_size * 16, hash_size * 16))
+        img = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+        pixels = img.tobytes()
+    except Exception as e:
+        logger.info(f"Perceptual hash skipped (not an image): {e}")
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (1 if pixels[offset + col] > pixels[offset + col + 1] else 0)
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance.
+    Radius queries only visit children whose edge distance is within [d - r, d + r].
+    """
+    def __init__(self):
+        self.root = None # (hash_int, receipt_id, {distance: child_node})
+        self.size = 0
+
+    def add(self, hash_int: int, receipt_id: str):
+        node = (hash_int, receipt_id, {})
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+
+        current = self.root
+        while True:
+            distance = hamming_distance(hash_int, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def find_nearest(self, hash_int: int, max_distance: int):
+        """Returns (receipt_id, distance) of the closest entry within max_distance, or None."""
+        if self.root is None:
+            return None
+
+        best = None
+        stack = [self.root]
+        while stack:
+            node_hash, receipt_id, children = stack.pop()
+            distance = hamming_distance(hash_int, node_hash)
+            if distance <= max_distance and (best is None or distance < best[1]):
+                best = (receipt_id, distance)
+                if distance == 0:
+                    break
+            low, high = distance - max_distance, distance + max_distance
+            for edge, child in children.items():
+                if low <= edge <= high:
+                    stack.append(child)
+        return best
+
+class DuplicateImageIndex:
+    """
+    Per-company in-memory BK-trees of receipt perceptual hashes.
+    A tree is loaded once from the indexed `receipts.phash` column, then topped up
+    with receipts created since the last sync (other workers' uploads) on each lookup.
+    """
+    def __init__(self):
+        self._entries = {} # company_id -> {"tree": BKTree, "ids": set, "synced_at": datetime}
+        self._lock = threading.Lock()
+
+    def _sync(self, db, company_id: str) -> BKTree:
+        entry = self._entries.get(company_id)
+        if entry is None:
+            entry = {"tree": BKTree(), "ids": set(), "synced_at": None}
+            self._entries[company_id] = entry
+
+        query = db.query(models.Receipt.id, models.Receipt.phash).filter(
+            models.Receipt.company_id == company_id,
+            models.Receipt.phash != None
+        )
+        if entry["synced_at"] is not None:
+            # Served by idx_receipt_company_date
+            since = entry["synced_at"] - timedelta(seconds=PHASH_SYNC_OVERLAP_SECONDS)
+            query = query.filter(models.Receipt.created_at >= since)
+
+        entry["synced_at"] = datetime.utcnow()
+        for receipt_id, phash in query.all():
+            if receipt_id not in entry["ids"]:
+                entry["ids"].add(receipt_id)
+                entry["tree"].add(int(phash, 16), receipt_id)
+        return entry["tree"]
+
+    def find_duplicate(self, db, company_id: str, phash: str, max_distance: int = None):
+        """Returns (receipt_id, distance) for the closest earlier receipt, or None."""
+        if not phash:
+            return None
+        if max_distance is None:
+            max_distance = PHASH_MAX_DISTANCE
+
+        with self._lock:
+            tree = self._sync(db, company_id)
+            return tree.find_nearest(int(phash, 16), max_distance)
+
+    def add(self, company_id: str, receipt_id: str, phash: str):
+        if not phash:
+            return
+        with self._lock:
+            entry = self._entries.get(company_id)
+            if entry and receipt_id not in entry["ids"]:
+                entry["ids"].add(receipt_id)
+                entry["tree"].add(int(phash, 16), receipt_id)
+
+    def clear(self, company_id: str = None):
+        with self._lock:
+            if company_id:
+                self._entries.pop(company_id, None)
+            else:
+                self._entries.clear()
+
+# Singleton instance
+duplicate_index = DuplicateImageIndex()
@@ -0,0 +1,65 @@
+import io
+import os
+import logging
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# OCR input normalization (all overridable per environment)
+OCR_IMAGE_MAX_SIZE = int(os.getenv("OCR_IMAGE_MAX_SIZE", "1024"))
+OCR_IMAGE_FORMAT = os.getenv("OCR_IMAGE_FORMAT", "JPEG").upper() # JPEG or WEBP
+OCR_IMAGE_QUALITY = int(os.getenv("OCR_IMAGE_QUALITY", "85"))
+OCR_IMAGE_GRAYSCALE = os.getenv("OCR_IMAGE_GRAYSCALE", "true").lower() == "true"
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+class PreparedImage:
+    """Normalized, encoded receipt image. Only the compressed bytes are kept in memory."""
+    def __init__(self, data: bytes, mime_type: str, size: tuple):
+        self.data = data
+        self.mime_type = mime_type
+        self.size = size
+
+    def as_part(self) -> dict:
+        """Inline blob accepted by GenerativeModel.generate_content."""
+        return {"mime_type": self.mime_type, "data": self.data}
+
+def preprocess_image(
+    file_data: bytes,
+    max_size: int = None,
+    output_format: str = None,
+    quality: int = None,
+    grayscale: bool = None
+) -> PreparedImage:
+    """
+    Decode once, normalize, re-encode once.
+    - JPEG draft mode lets libjpeg decode directly at 1/2, 1/4 or 1/8 scale, so a
+      12MP phone photo never materializes at full resolution.
+    - EXIF orientation is applied so sideways photos reach the model upright.
+    - Optional grayscale + autocontrast for faded thermal-printer receipts.
+    Raises if the bytes are not a decodable image.
+    """
+    max_size = max_size or OCR_IMAGE_MAX_SIZE
+    output_format = (output_format or OCR_IMAGE_FORMAT).upper()
+    quality = quality or OCR_IMAGE_QUALITY
+    grayscale = OCR_IMAGE_GRAYSCALE if grayscale is None else grayscale
+
+    img = Image.open(io.BytesIO(file_data))
+    try:
+        if img.format == "JPEG":
+            img.draft("L" if grayscale else "RGB", (max_size, max_size))
+
+        img = ImageOps.exif_transpose(img)
+
+        if grayscale:
+            img = ImageOps.autocontrast(img.convert("L"), cutoff=1)
+        elif img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+
+        img.thumbnail((max_size, max_size))
+
+        out = io.BytesIO()
+        img.save(out, format=output_format, quality=quality)
+        return PreparedImage(out.getvalue(), MIME_TYPES.get(output_format, "image/jpeg"), img.size)
+    finally:
+        img.close()
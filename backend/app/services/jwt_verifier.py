@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import urllib.request
+from collections import OrderedDict
+from jose import jwt, JWTError
+
+logger = logging.getLogger(__name__)
+
+JWT_CACHE_MAX_ENTRIES = int(os.getenv("JWT_CACHE_MAX_ENTRIES", "10000"))
+# Upper bound on how long a verified token is trusted without re-verifying, even if exp is later
+JWT_CACHE_MAX_TTL_SECONDS = int(os.getenv("JWT_CACHE_MAX_TTL_SECONDS", "300"))
+# Asymmetric (RS256/ES256) Supabase keys: set SUPABASE_JWKS_URL, e.g.
+# https://<project>.supabase.co/auth/v1/.well-known/jwks.json
+SUPABASE_JWKS_URL = os.getenv("SUPABASE_JWKS_URL", "")
+JWKS_REFRESH_SECONDS = int(os.getenv("JWKS_REFRESH_SECONDS", "600"))
+# An unknown kid forces a refresh (key rotation), at most this often
+JWKS_MIN_REFRESH_SECONDS = int(os.getenv("JWKS_MIN_REFRESH_SECONDS", "30"))
+
+ASYMMETRIC_ALGORITHMS = ("RS256", "ES256")
+
+class VerifiedTokenCache:
+    """
+    sha256(token) -> verified claims, until the token's exp (capped by max_ttl).
+    A dashboard's parallel calls with one token then verify the signature once.
+    Bounded LRU; only successfully verified tokens are stored.
+    """
+    def __init__(self, max_entries: int = None, max_ttl_seconds: int = None):
+        self.max_entries = JWT_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_ttl_seconds = JWT_CACHE_MAX_TTL_SECONDS if max_ttl_seconds is None else max_ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> dict:
+        key = self.key(token)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None and cached[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            if cached is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, token: str, claims: dict):
+        expires_at = time.time() + self.max_ttl_seconds
+        if claims.get("exp") is not None:
+            expires_at = min(expires_at, float(claims["exp"]))
+        if expires_at <= time.time():
+            return
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries
+        }
+
+class JWKSClient:
+    """
+    Public keys of the Supabase project, fetched from the JWKS endpoint and kept
+    in memory. Only the very first load is waited for; afterwards the keys are
+    refreshed in a background thread every `refresh_seconds`, or early when a token
+    names a kid we do not know (rate limited), and requests keep using the keys
+    already loaded. If a refresh fails the previous keys keep serving.
+    """
+    def __init__(self, url: str, refresh_seconds: int = None, min_refresh_seconds: int = None, timeout: float = 5.0):
+        self.url = url
+        self.refresh_seconds = JWKS_REFRESH_SECONDS if refresh_seconds is None else refresh_seconds
+        self.min_refresh_seconds = JWKS_MIN_REFRESH_SECONDS if min_refresh_seconds is None else min_refresh_seconds
+        self.timeout = timeout
+        self._lock = threading.Lock() # Held for the whole fetch
+        self._keys = {}
+        self._fetched_at = None
+        self._thread_lock = threading.Lock()
+        self._refresh_thread = None
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    def _fetch(self) -> dict:
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            document = json.loads(response.read())
+        return {key["kid"]: key for key in document.get("keys", []) if key.get("kid")}
+
+    def refresh(self, only_if_never_loaded: bool = False):
+        with self._lock:
+            if only_if_never_loaded and self._fetched_at is not None:
+                return
+            try:
+                keys = self._fetch()
+            except Exception as e:
+                self.refresh_errors += 1
+                logger.warning(f"JWKS refresh from {self.url} failed: {e}")
+                # Back off before the next attempt instead of fetching on every request
+                self._fetched_at = time.monotonic()
+                return
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            self.refreshes += 1
+            logger.info(f"Loaded {len(keys)} JWKS keys")
+
+    def refresh_in_background(self) -> threading.Thread:
+        """Starts a refresh unless one is already running; never waits for it."""
+        with self._thread_lock:
+            if self._refresh_thread is None or not self._refresh_thread.is_alive():
+                self._refresh_thread = threading.Thread(target=self.refresh, name="jwks-refresh", daemon=True)
+                self._refresh_thread.start()
+            return self._refresh_thread
+
+    def _age(self) -> float:
+        return float("inf") if self._fetched_at is None else time.monotonic() - self._fetched_at
+
+    def get_key(self, kid: str) -> dict:
+        if self._fetched_at is None:
+            # Cold start: nothing to verify with yet, concurrent callers share one fetch
+            self.refresh(only_if_never_loaded=True)
+        elif self._age() >= self.refresh_seconds:
+            self.refresh_in_background()
+        key = self._keys.get(kid)
+        if key is None and self._age() >= self.min_refresh_seconds:
+            # Possibly a rotated key: this token is rejected, the next one finds the new key
+            self.refresh_in_background()
+        return key
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "keys": len(self._keys),
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors
+        }
+
+class JWTVerifier:
+    """
+    Verifies Supabase access tokens: HS256 with the project JWT secret, and
+    RS256/ES256 with the project's JWKS when a jwks_client is configured.
+    Verified claims are cached per token. Raises JWTError on any failure.
+    """
+    def __init__(self, secret: str, jwks_client: JWKSClient = None, cache: VerifiedTokenCache = None):
+        self.secret = secret
+        self.jwks_client = jwks_client
+        self.cache = cache or VerifiedTokenCache()
+
+    def _key_for(self, header: dict):
+        algorithm = header.get("alg")
+        if algorithm == "HS256":
+            if not self.secret:
+                raise JWTError("HS256 token but SUPABASE_JWT_SECRET is not set")
+            return self.secret
+        if algorithm in ASYMMETRIC_ALGORITHMS:
+            if self.jwks_client is None:
+                raise JWTError(f"{algorithm} token but SUPABASE_JWKS_URL is not set")
+            key = self.jwks_client.get_key(header.get("kid"))
+            if key is None:
+                raise JWTError(f"Unknown signing key {header.get('kid')}")
+            return key
+        raise JWTError(f"Unsupported algorithm {algorithm}")
+
+    def verify(self, token: str) -> dict:
+        claims = self.cache.get(token)
+        if claims is not None:
+            return claims
+        return self.verify_signature(token)
+
+    def verify_signature(self, token: str) -> dict:
+        """Full check of a token not found in the cache; may wait for the first JWKS load."""
+        header = jwt.get_unverified_header(token)
+        claims = jwt.decode(
+            token,
+            self._key_for(header),
+            algorithms=[header.get("alg")],
+            options={"verify_aud": False}
+        )
+        self.cache.set(token, claims)
+        return claims
+
+    def stats(self) -> dict:
+        return {
+            "cache": self.cache.stats(),
+            "jwks": self.jwks_client.stats() if self.jwks_client else None
+        }
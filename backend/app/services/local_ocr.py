@@ -0,0 +1,212 @@
+import io
+import os
+import re
+import logging
+from datetime import datetime, date
+from PIL import Image
+
+from .image_preprocess import preprocess_image
+
+logger = logging.getLogger(__name__)
+
+OCR_LOCAL_ENABLED = os.getenv("OCR_LOCAL_ENABLED", "true").lower() == "true"
+# Below this confidence the receipt is escalated to Gemini
+OCR_LOCAL_MIN_CONFIDENCE = float(os.getenv("OCR_LOCAL_MIN_CONFIDENCE", "0.8"))
+OCR_LOCAL_LANG = os.getenv("OCR_LOCAL_LANG", "spa+eng")
+# Thermal-printer fonts are small, tesseract needs more pixels than the vision model
+OCR_LOCAL_MAX_SIZE = int(os.getenv("OCR_LOCAL_MAX_SIZE", "2000"))
+
+# Field weights for the rule-based confidence (sum = 1.0)
+FIELD_WEIGHTS = {"amount": 0.4, "date": 0.2, "vendor_nit": 0.2, "vendor": 0.1, "invoice_number": 0.1}
+
+NIT_RE = re.compile(r"\bN\.?\s?I\.?\s?T\.?\s*[:.#]?\s*((?:\d[\d.\s]{5,13}\d)(?:\s?-\s?\d)?)", re.IGNORECASE)
+TOTAL_RE = re.compile(r"^(?!.*SUB\s*-?\s*TOTAL).*\bTOTAL(?:\s+A\s+PAGAR)?\b[^\d$]*\$?\s*([\d][\d.,\s]*\d)", re.IGNORECASE | re.MULTILINE)
+INVOICE_RE = re.compile(
+    r"(?:FACTURA(?:\s+(?:DE\s+VENTA|ELECTR[OÓ]NICA(?:\s+DE\s+VENTA)?))?|FACT\.?|TIQUETE)\s*(?:No\.?|N[°º]|#)?\s*[:.]?\s*([A-Z]{0,5}\s?-?\s?\d{2,})",
+    re.IGNORECASE
+)
+# "PECHUGA POLLO KG   2   36.000" / "ARROZ 500G  3 x 2.500  7.500" / "PAN TAJADO  4.200"
+ITEM_RE = re.compile(
+    r"^(?P<name>.*?[A-Za-zÁÉÍÓÚÑáéíóúñ]{3}.*?)\s+"
+    r"(?:(?P<qty>\d{1,3}(?:[.,]\d{1,3})?)\s*(?:[xX*@]\s*\$?\s*(?P<price>\d[\d.,]*\d)\s+)?)?"
+    r"\$?\s*(?P<total>\d[\d.,]*\d)\s*$"
+)
+# Whole words only: "ACEITE DE OLIVA", "CAJA HUEVOS" and "PASTEL POLLO" are items.
+# A bare "CAJA 01" line is the register number.
+NOT_ITEM_RE = re.compile(
+    r"\b(?:(?:SUB)?TOTAL(?:ES)?|IVA|NIT|FACTURA|FECHA|CAMBIO|EFECTIVO|TARJETA|DESCUENTOS?|PROPINA|BASE"
+    r"|TEL(?:[EÉ]FONO)?|CAJER[OA])\b|\b(?:RESOLUCI|DIRECCI)\w*|^CAJA\s*(?:No\.?|N[°º]|#|:)?\s*\d+$",
+    re.IGNORECASE
+)
+UNIT_RE = re.compile(r"\b(KG|KGS|GR|LB|LT|UND|UNID|UN)\b\.?$", re.IGNORECASE)
+# Item totals must add up to the grand total within this share for the local result to be trusted
+ITEMS_TOTAL_TOLERANCE = 0.01
+
+DATE_PATTERNS = [
+    (re.compile(r"\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b"), ("y", "m", "d")),
+    (re.compile(r"\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})\b"), ("d", "m", "y")),
+    (re.compile(r"\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{2})\b"), ("d", "m", "y")),
+]
+
+def parse_amount(raw: str) -> float:
+    """
+    Colombian receipts use '.' as thousands separator ("150.000") and ',' for
+    decimals ("150.000,50"), but POS systems also print "150,000.00".
+    """
+    raw = raw.replace(" ", "")
+    if "," in raw and "." in raw:
+        decimal_sep = "," if raw.rfind(",") > raw.rfind(".") else "."
+        thousands_sep = "." if decimal_sep == "," else ","
+        raw = raw.replace(thousands_sep, "").replace(decimal_sep, ".")
+    elif "," in raw or "." in raw:
+        sep = "," if "," in raw else "."
+        head, _, tail = raw.rpartition(sep)
+        # "150.000" / "1,250" -> thousands; "12.50" -> decimals
+        raw = raw.replace(sep, "") if len(tail) == 3 else head.replace(sep, "") + "." + tail
+    return float(raw)
+
+def parse_date(text: str) -> str:
+    today = date.today()
+    for pattern, order in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            parts = dict(zip(order, (int(g) for g in match.groups())))
+            year = parts["y"] + 2000 if parts["y"] < 100 else parts["y"]
+            try:
+                found = date(year, parts["m"], parts["d"])
+            except ValueError:
+                continue
+            if 2000 <= found.year <= today.year + 1:
+                return found.strftime("%Y-%m-%d")
+    return None
+
+def parse_items(text: str) -> list:
+    """Line items in the Gemini shape (name, qty, unit, price, total); lines that don't parse are skipped."""
+    items = []
+    for line in text.splitlines():
+        line = line.strip()
+        if NOT_ITEM_RE.search(line):
+            continue
+        match = ITEM_RE.match(line)
+        if not match:
+            continue
+        try:
+            total = parse_amount(match.group("total"))
+            qty = float(match.group("qty").replace(",", ".")) if match.group("qty") else 1.0
+            price = parse_amount(match.group("price")) if match.group("price") else (total / qty if qty else total)
+        except ValueError:
+            continue
+        name = match.group("name").strip()
+        unit = UNIT_RE.search(name)
+        items.append({
+            "name": name[:120],
+            "qty": qty,
+            "unit": unit.group(1).lower() if unit else None,
+            "price": round(price, 2),
+            "total": total
+        })
+    return items
+
+def items_match_total(result: dict) -> bool:
+    """True when the parsed line items add up to the receipt total, i.e. none were missed."""
+    amount = result.get("amount")
+    items = result.get("items") or []
+    if not amount or not items:
+        return False
+    return abs(sum(item["total"] for item in items) - amount) <= amount * ITEMS_TOTAL_TOLERANCE
+
+def parse_receipt_text(text: str, text_confidence: float = 1.0) -> dict:
+    """
+    Rule-based extraction for Colombian receipts (NIT, total, date, invoice number, line items).
+    `confidence_score` = weighted share of fields found x OCR text confidence.
+    """
+    result = {
+        "vendor": None,
+        "vendor_nit": None,
+        "date": None,
+        "amount": None,
+        "currency": "COP",
+        "category": "📦 Otros",
+        "invoice_number": None,
+        "items": []
+    }
+
+    nit = NIT_RE.search(text)
+    if nit:
+        result["vendor_nit"] = re.sub(r"[\s.]", "", nit.group(1))
+
+    totals = []
+    for match in TOTAL_RE.finditer(text):
+        try:
+            totals.append(parse_amount(match.group(1)))
+        except ValueError:
+            continue
+    if totals:
+        # "TOTAL" may appear on several lines (items, IVA); the grand total is the largest
+        result["amount"] = max(totals)
+
+    result["date"] = parse_date(text)
+
+    result["items"] = parse_items(text)
+
+    invoice = INVOICE_RE.search(text)
+    if invoice:
+        result["invoice_number"] = re.sub(r"\s", "", invoice.group(1))
+
+    for line in text.splitlines():
+        line = line.strip()
+        letters = sum(c.isalpha() for c in line)
+        if letters >= 3 and not NIT_RE.search(line) and not re.search(r"FACTURA|FECHA|DIRECCI|TEL", line, re.IGNORECASE):
+            result["vendor"] = line[:120]
+            break
+
+    found = sum(weight for field, weight in FIELD_WEIGHTS.items() if result.get(field))
+    result["confidence_score"] = round(found * max(0.0, min(1.0, text_confidence)), 3)
+    return result
+
+def run_tesseract(file_data: bytes):
+    """Returns (text, mean word confidence 0-1), or None when tesseract is unavailable."""
+    try:
+        import pytesseract
+    except ImportError:
+        return None
+
+    try:
+        prepared = preprocess_image(file_data, max_size=OCR_LOCAL_MAX_SIZE, output_format="PNG", grayscale=True)
+        img = Image.open(io.BytesIO(prepared.data))
+        data = pytesseract.image_to_data(img, lang=OCR_LOCAL_LANG, output_type=pytesseract.Output.DICT)
+    except Exception as e:
+        logger.info(f"Local OCR unavailable: {e}")
+        return None
+
+    words, lines, confidences = [], {}, []
+    for i, word in enumerate(data.get("text", [])):
+        word = (word or "").strip()
+        conf = float(data["conf"][i])
+        if not word or conf < 0:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        confidences.append(conf)
+
+    text = "\n".join(" ".join(words) for words in lines.values())
+    mean_conf = (sum(confidences) / len(confidences) / 100.0) if confidences else 0.0
+    return text, mean_conf
+
+def extract_locally(file_data: bytes) -> dict:
+    """Tier 1: tesseract + rules. Returns an extraction dict tagged ocr_tier='local', or None."""
+    if not OCR_LOCAL_ENABLED:
+        return None
+
+    started = datetime.now()
+    ocr_result = run_tesseract(file_data)
+    if ocr_result is None:
+        return None
+
+    text, text_confidence = ocr_result
+    extracted = parse_receipt_text(text, text_confidence)
+    extracted["ocr_tier"] = "local"
+    logger.info(
+        f"Local OCR confidence {extracted['confidence_score']} "
+        f"in {(datetime.now() - started).total_seconds():.2f}s"
+    )
+    return extracted
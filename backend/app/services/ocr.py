@@ -2,8 +2,8 @@ from sqlalchemy.orm import Session
 from .. import models
 import os
 import google.generativeai as genai
-from PIL import Image
 import json
+import time
 from datetime import datetime
 import logging
 
@@ -18,101 +18,65 @@ if GEMINI_API_KEY:
 else:
     logger.warning("GEMINI_API_KEY not found in environment variables")
 
-import time
+from .ocr_cache import ocr_cache
+from .gemini_client import gemini_client
+from .image_preprocess import preprocess_image
+from .pdf_extract import pdf_extractor, is_pdf
+from . import local_ocr
+from . import ocr_jobs
+from .ocr_schema import parse_extraction, GENERATION_CONFIG, RESPONSE_SCHEMA
 
-import io
+# Prompt and model chain are module-level so the cache can derive a version from them.
+# Any edit here changes OCR_PROMPT_VERSION and makes old cached extractions unreachable.
+OCR_PROMPT = """
+Analiza esta imagen de factura/recibo de compra y extrae la siguiente información en formato JSON:
 
-def process_receipt_with_gemini(file_data: bytes, retries=1) -> dict:
-    """
-    Process receipt image using Gemini Vision API with model fallback.
-    Includes image resizing to save memory on Render.
-    """
-    # 1. OPTIMIZE IMAGE (Resize if large to save RAM on Render)
-    try:
-        img = Image.open(io.BytesIO(file_data))
-        # Max dimension 1024px is plenty for OCR and saves tons of RAM
-        if max(img.size) > 1024:
-            img.thumbnail((1024, 1024))
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format=img.format or 'JPEG')
-            file_data = img_byte_arr.getvalue()
-            logger.info(f"Resized image to {img.size} for memory efficiency")
-    except Exception as e:
-        logger.warning(f"Could not resize image: {e}")
-
-    # 2. MODELS TO TRY (Robust naming)
-    models_to_try = [
-        'gemini-2.0-flash',
-        'gemini-flash-latest',
-        'gemini-1.5-flash',
-        'gemini-pro-latest'
+{
+    "vendor": "nombre del proveedor/comercio",
+    "vendor_nit": "NIT/RUT si existe",
+    "date": "YYYY-MM-DD",
+    "amount": 1234.56,
+    "currency": "COP",
+    "category": "Categoría sugerida (Ej: Carnes, Frutas, Bebidas, Aseo, Mantenimiento)",
+    "invoice_number": "Número de factura si existe",
+    "confidence_score": 0.95,
+    "items": [
+        {
+            "name": "nombre producto detallado", 
+            "qty": 1.0, 
+            "unit": "kg/lb/unid (detectar si existe)", 
+            "price": 1000.0, 
+            "total": 1000.0
+        }
     ]
-    
-    for model_name in models_to_try:
-        delay = 2
-        for attempt in range(retries + 1):
-            try:
-                # Re-open image for each attempt to be safe
-                img = Image.open(io.BytesIO(file_data))
-                logger.info(f"Trying OCR with model: {model_name} (Attempt {attempt+1})")
-                
-                model = genai.GenerativeModel(model_name)
-                
-                prompt = """
-                Analiza esta imagen de factura/recibo de compra y extrae la siguiente información en formato JSON:
-                
-                {
-                    "vendor": "nombre del proveedor/comercio",
-                    "vendor_nit": "NIT/RUT si existe",
-                    "date": "YYYY-MM-DD",
-                    "amount": 1234.56,
-                    "currency": "COP",
-                    "category": "Categoría sugerida (Ej: Carnes, Frutas, Bebidas, Aseo, Mantenimiento)",
-                    "invoice_number": "Número de factura si existe",
-                    "confidence_score": 0.95,
-                    "items": [
-                        {
-                            "name": "nombre producto detallado", 
-                            "qty": 1.0, 
-                            "unit": "kg/lb/unid (detectar si existe)", 
-                            "price": 1000.0, 
-                            "total": 1000.0
-                        }
-                    ]
-                }
-                
-                Instrucciones Clave:
-                1. Extrae TODOS los items de compra posibles.
-                2. Si la cantidad no es explícita, asume 1.
-                3. 'price' es el precio unitario. 'total' es precio * cantidad.
-                4. Solo responde con el objeto JSON puro.
-                """
-                
-                response = model.generate_content([prompt, img])
-                if not response or not response.text:
-                    raise Exception("Empty response from Gemini")
-                    
-                response_text = response.text.strip()
-                
-                # Clean JSON markdown
-                if "```json" in response_text:
-                    response_text = response_text.split("```json")[1].split("```")[0]
-                elif "```" in response_text:
-                    response_text = response_text.split("```")[1].split("```")[0]
-                
-                extracted_data = json.loads(response_text.strip())
-                return extracted_data
-                
-            except Exception as e:
-                logger.error(f"Gemini error with {model_name} on attempt {attempt+1}: {e}")
-                last_error_context = f"Error previo: {str(e)}. "
-                if attempt < retries:
-                    time.sleep(delay)
-                    delay *= 2
-                    continue
-                break
-    
-    # Fallback
+}
+
+Instrucciones Clave:
+1. Extrae TODOS los items de compra posibles.
+2. Si la cantidad no es explícita, asume 1.
+3. 'price' es el precio unitario. 'total' es precio * cantidad.
+4. Solo responde con el objeto JSON puro.
+"""
+
+OCR_MODELS = [
+    'gemini-2.0-flash',
+    'gemini-flash-latest',
+    'gemini-1.5-flash',
+    'gemini-pro-latest'
+]
+
+# Digitally generated PDFs: same JSON contract, but the model only reads text (much cheaper than vision)
+OCR_TEXT_PROMPT = OCR_PROMPT.replace(
+    "Analiza esta imagen de factura/recibo de compra",
+    "Analiza el siguiente texto extraído de una factura/recibo de compra"
+)
+
+# The response schema is part of the version: entries cached before validation existed are dropped
+OCR_PROMPT_VERSION = ocr_cache.compute_version(
+    OCR_PROMPT + OCR_TEXT_PROMPT + json.dumps(RESPONSE_SCHEMA, sort_keys=True), OCR_MODELS
+)
+
+def fallback_extraction() -> dict:
     return {
         "vendor": "Comercio no detectado",
         "date": datetime.now().strftime("%Y-%m-%d"),
@@ -120,72 +84,297 @@ def process_receipt_with_gemini(file_data: bytes, retries=1) -> dict:
         "currency": "COP",
         "category": "📦 Otros",
         "confidence_score": 0.1,
-        "items": []
+        "items": [],
+        "ocr_tier": "fallback"
     }
 
-def process_receipt(receipt_id: str):
+def _is_confident(local_result: dict) -> bool:
+    """
+    The local tier is kept only when its fields are confident and its line items add up
+    to the total: price trends, product matching and recipe costs are built on the items.
+    """
+    if not local_result or local_result["confidence_score"] < local_ocr.OCR_LOCAL_MIN_CONFIDENCE:
+        return False
+    if not local_ocr.items_match_total(local_result):
+        logger.info(f"{local_result['ocr_tier']} tier is confident but its items don't add up to the total, escalating")
+        return False
+    logger.info(f"OCR served by {local_result['ocr_tier']} tier ({local_result['confidence_score']})")
+    return True
+
+def _serve_local(local_result: dict, cache_key: str) -> dict:
+    ocr_cache.set(cache_key, OCR_PROMPT_VERSION, local_result)
+    return local_result
+
+def _escalate(local_result: dict, contents: list, retries: int, cache_key: str) -> dict:
     """
-    Process receipt using Gemini Vision API (background task)
+    Tiered OCR: ask Gemini when the local (tesseract/text-layer + rules) result was
+    not confident enough. If Gemini is down, a low-confidence local result that at
+    least found a total still beats the empty fallback.
+    """
+    extracted_data = _extract_with_models(contents, retries, cache_key)
+    if extracted_data.get("ocr_tier") == "fallback" and local_result and local_result.get("amount"):
+        logger.warning("Gemini unavailable, using low-confidence local OCR result")
+        return local_result
+    return extracted_data
+
+def _prepare_image_part(file_data: bytes) -> dict:
+    """Decode/normalize once (draft-mode decode, EXIF orientation, grayscale/contrast, resize)."""
+    try:
+        prepared = preprocess_image(file_data)
+        logger.info(f"Preprocessed image to {prepared.size} ({len(prepared.data)} bytes)")
+        return prepared.as_part()
+    except Exception as e:
+        logger.warning(f"Could not preprocess image, sending original bytes: {e}")
+        return {"mime_type": "image/jpeg", "data": file_data}
+
+def _extract_with_models(contents: list, retries: int, cache_key: str) -> dict:
+    """The model chain; a successful answer is cached under `cache_key` (the caller already looked it up)."""
+    # Shared async client: reused models, concurrency cap, circuit breakers.
+    # JSON mode + response schema; parse_extraction salvages partial answers instead of retrying.
+    try:
+        extracted_data, model_name = gemini_client.generate_sync(
+            OCR_MODELS, contents, parse=parse_extraction, retries=retries,
+            generation_config=GENERATION_CONFIG
+        )
+        logger.info(f"OCR extracted with model: {model_name}")
+        extracted_data["ocr_tier"] = "gemini"
+        ocr_cache.set(cache_key, OCR_PROMPT_VERSION, extracted_data)
+        return extracted_data
+    except Exception as e:
+        logger.error(f"All Gemini models failed: {e}")
+    
+    return fallback_extraction()
+
+def process_pdf_with_gemini(file_data: bytes, retries: int, cache_key: str) -> dict:
+    """
+    PDF invoices: use the embedded text layer when present (text-only model call),
+    and only send page images for pages that have no text (scans).
+    """
+    try:
+        pages = pdf_extractor.extract(file_data)
+    except Exception as e:
+        logger.error(f"Could not read PDF: {e}")
+        return fallback_extraction()
+
+    text = "\n\n".join(p.text.strip() for p in pages if p.has_text)
+    images = [image for p in pages if not p.has_text for image in p.images]
+
+    if images:
+        contents = [OCR_PROMPT] + [_prepare_image_part(image) for image in images]
+        if text:
+            contents.append(f"Texto de las demás páginas:\n{text}")
+        logger.info(f"PDF: {len(images)} scanned page image(s) sent to vision model")
+    elif text:
+        contents = [OCR_TEXT_PROMPT, text]
+        logger.info("PDF: using embedded text layer, no vision call")
+        # Digital invoice text is exact, so the rule parser gets full text confidence
+        local_result = local_ocr.parse_receipt_text(text) if local_ocr.OCR_LOCAL_ENABLED else None
+        if local_result:
+            local_result["ocr_tier"] = "pdf_text"
+        if _is_confident(local_result):
+            return _serve_local(local_result, cache_key)
+        return _escalate(local_result, contents, retries, cache_key)
+    else:
+        logger.warning("PDF has neither text nor images")
+        return fallback_extraction()
+
+    return _extract_with_models(contents, retries, cache_key)
+
+def process_receipt_with_gemini(file_data: bytes, retries=1) -> dict:
+    """
+    Process receipt image (or PDF) using Gemini API with model fallback.
+    The image is decoded and normalized once (see image_preprocess) and the same
+    encoded bytes are sent on every attempt, keeping memory flat on Render.
+    The cache is keyed on the uploaded bytes and checked before any tier runs, so a
+    duplicate upload costs neither tesseract nor Gemini.
+    """
+    cache_key = ocr_cache.make_key(file_data, OCR_PROMPT_VERSION)
+    cached = ocr_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"OCR cache hit for {cache_key[:12]}")
+        return cached
+
+    if is_pdf(file_data):
+        return process_pdf_with_gemini(file_data, retries, cache_key)
+
+    local_result = local_ocr.extract_locally(file_data)
+    if _is_confident(local_result):
+        return _serve_local(local_result, cache_key)
+
+    return _escalate(local_result, [OCR_PROMPT, _prepare_image_part(file_data)], retries, cache_key)
+
+def build_parsed_data(receipt_id: str, extracted_data: dict) -> models.ParsedData:
+    """Maps a model extraction dict onto a ParsedData row (not yet added to a session)."""
+    date_obj = None
+    if extracted_data.get("date"):
+        try:
+            date_obj = datetime.strptime(extracted_data["date"], "%Y-%m-%d").date()
+        except Exception:
+            pass
+    
+    return models.ParsedData(
+        receipt_id=receipt_id,
+        vendor=extracted_data.get("vendor", "Comercio no detectado"),
+        vendor_nit=extracted_data.get("vendor_nit"),
+        date=date_obj,
+        amount=float(extracted_data.get("amount", 0.0)),
+        currency=extracted_data.get("currency", "COP"),
+        category=extracted_data.get("category", "📦 Otros"),
+        confidence_score=float(extracted_data.get("confidence_score", 0.0)),
+        ocr_tier=extracted_data.get("ocr_tier"),
+        items=json.dumps(extracted_data.get("items", []))
+    )
+
+def load_receipt_bytes(file_path: str, local_path: str = None) -> bytes:
+    """Downloads receipt bytes from storage, falling back to the local copy."""
+    from ..services.storage import storage_service
+    file_bytes = storage_service.download_file(file_path)
+    
+    local_path = local_path or file_path
+    if not file_bytes and local_path and os.path.exists(local_path):
+         with open(local_path, "rb") as f:
+             file_bytes = f.read()
+    return file_bytes
+
+def process_receipt(receipt_id: str, raise_errors: bool = False):
+    """
+    Process receipt using Gemini Vision API (background task).
+    The receipt is leased through its OCRJob first, so a re-delivered or duplicated
+    task is a no-op and a retry never adds a second ParsedData row.
+    With `raise_errors`, failures with attempts left are re-raised so a Celery task
+    can retry them; the last attempt marks the receipt FAILED.
     """
     from ..database import SessionLocal
     db = SessionLocal()
+    worker_id = ocr_jobs.new_worker_id()
     
-    logger.info(f"--- START OCR TASK for {receipt_id} ---")
+    logger.info(f"--- START OCR TASK for {receipt_id} ({worker_id}) ---")
     
-    receipt = db.query(models.Receipt).filter(models.Receipt.id == receipt_id).first()
-    if not receipt:
-        logger.error(f"Receipt {receipt_id} not found")
+    try:
+        receipt = db.query(models.Receipt).filter(models.Receipt.id == receipt_id).first()
+        if not receipt:
+            logger.error(f"Receipt {receipt_id} not found")
+            return
+
+        if not ocr_jobs.claim(db, [receipt], worker_id):
+            logger.info(f"Receipt {receipt_id} already processed or leased by another worker, skipping")
+            return
+
+        try:
+            # Load file bytes
+            file_bytes = load_receipt_bytes(receipt.storage_path or receipt.file_url, receipt.file_url)
+
+            if not file_bytes:
+                 raise Exception("File bytes extraction failed")
+
+            extracted_data = process_receipt_with_gemini(file_bytes)
+            if ocr_jobs.complete(db, receipt, worker_id, build_parsed_data(receipt.id, extracted_data)):
+                db.commit()
+                logger.info(f"Receipt {receipt_id} PROCESSED successfully")
+            else:
+                db.rollback()
+            
+        except Exception as e:
+            logger.error(f"Critical error processing receipt {receipt_id}: {e}")
+            db.rollback()
+            will_retry = ocr_jobs.fail(db, receipt, worker_id, e, retry=raise_errors)
+            db.commit()
+            if will_retry:
+                raise
+    finally:
         db.close()
-        return
 
+
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "10"))
+OCR_BATCH_WORKERS = int(os.getenv("OCR_BATCH_WORKERS", "4"))
+
+def _extract_receipt(receipt_id: str, file_path: str, local_path: str):
+    """Worker-pool unit: download + OCR, no DB access. Returns (receipt_id, extracted_data or None, error)."""
     try:
-        receipt.status = "PROCESSING"
-        db.commit()
+        file_bytes = load_receipt_bytes(file_path, local_path)
+        if not file_bytes:
+            raise Exception("File bytes extraction failed")
+        return receipt_id, process_receipt_with_gemini(file_bytes), None
     except Exception as e:
-        logger.error(f"Failed to set status: {e}")
+        logger.error(f"Batch OCR failed for receipt {receipt_id}: {e}")
+        return receipt_id, None, e
 
+def process_receipt_batch(job_id: str):
+    """
+    Process every receipt of an OCRBatchJob (background task).
+    One DB session for the whole job, extraction in a bounded thread pool, and one
+    lease claim + one commit of ParsedData rows and progress per chunk of OCR_BATCH_SIZE.
+    Leases of receipts still being extracted are renewed every half lease.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+    from ..database import SessionLocal
+    db = SessionLocal()
+    renew_every = ocr_jobs.OCR_JOB_LEASE_SECONDS / 2
+    
     try:
-        # Load file bytes
-        file_path = receipt.storage_path or receipt.file_url
-        from ..services.storage import storage_service
-        file_bytes = storage_service.download_file(file_path)
+        job = db.query(models.OCRBatchJob).filter(models.OCRBatchJob.id == job_id).first()
+        if not job:
+            logger.error(f"Batch job {job_id} not found")
+            return
         
-        if not file_bytes and os.path.exists(file_path):
-             with open(file_path, "rb") as f:
-                 file_bytes = f.read()
-
-        if not file_bytes:
-             raise Exception("File bytes extraction failed")
-
-        extracted_data = process_receipt_with_gemini(file_bytes)
+        # PROCESSING receipts are included so a re-queued batch resumes the chunk a dead
+        # worker was holding; claim() skips any whose lease is still live.
+        receipts = db.query(models.Receipt).filter(
+            models.Receipt.batch_job_id == job_id,
+            models.Receipt.status.in_([models.ReceiptStatus.PENDING.value, models.ReceiptStatus.PROCESSING.value])
+        ).order_by(models.Receipt.created_at.asc()).all()
         
-        date_obj = None
-        if extracted_data.get("date"):
-            try:
-                date_obj = datetime.strptime(extracted_data["date"], "%Y-%m-%d").date()
-            except Exception:
-                pass
+        job.status = models.ReceiptStatus.PROCESSING.value
+        db.commit()
+        worker_id = ocr_jobs.new_worker_id()
+        logger.info(f"--- START BATCH OCR {job_id}: {len(receipts)} receipts ({worker_id}) ---")
         
-        parsed_data = models.ParsedData(
-            receipt_id=receipt.id,
-            vendor=extracted_data.get("vendor", "Comercio no detectado"),
-            vendor_nit=extracted_data.get("vendor_nit"),
-            date=date_obj,
-            amount=float(extracted_data.get("amount", 0.0)),
-            currency=extracted_data.get("currency", "COP"),
-            category=extracted_data.get("category", "📦 Otros"),
-            confidence_score=float(extracted_data.get("confidence_score", 0.0)),
-            items=json.dumps(extracted_data.get("items", []))
-        )
+        receipts_by_id = {r.id: r for r in receipts}
+        with ThreadPoolExecutor(max_workers=OCR_BATCH_WORKERS) as pool:
+            for start in range(0, len(receipts), OCR_BATCH_SIZE):
+                # Lease one chunk at a time: leases stay short and a crash only orphans this chunk
+                chunk = receipts[start:start + OCR_BATCH_SIZE]
+                claimed = ocr_jobs.claim(db, chunk, worker_id)
+                chunk = [r for r in chunk if r.id in claimed]
+                if not chunk:
+                    continue
+                
+                futures = {
+                    pool.submit(_extract_receipt, r.id, r.storage_path or r.file_url, r.file_url): r.id
+                    for r in chunk
+                }
+                pending = set(futures)
+                renewed_at = time.monotonic()
+                while pending:
+                    done, pending = wait(pending, timeout=renew_every, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        receipt_id, extracted_data, error = future.result()
+                        receipt = receipts_by_id[receipt_id]
+                        if extracted_data is None:
+                            ocr_jobs.fail(db, receipt, worker_id, error, retry=False)
+                            job.failed += 1
+                            continue
+                        if ocr_jobs.complete(db, receipt, worker_id, build_parsed_data(receipt_id, extracted_data)):
+                            job.processed += 1
+
+                    # Slow extractions (Gemini retries) must not outlive the lease and get reaped
+                    if pending and time.monotonic() - renewed_at >= renew_every:
+                        ocr_jobs.renew(db, [futures[f] for f in pending], worker_id)
+                        db.commit()
+                        renewed_at = time.monotonic()
+                
+                db.commit()
+                logger.info(f"Batch {job_id}: {job.processed + job.failed}/{job.total}")
         
-        db.add(parsed_data)
-        receipt.status = "PROCESSED" 
+        job.status = models.ReceiptStatus.COMPLETED.value
+        job.finished_at = datetime.utcnow()
         db.commit()
-        logger.info(f"Receipt {receipt_id} PROCESSED successfully")
-        
     except Exception as e:
-        logger.error(f"Critical error processing receipt {receipt_id}: {e}")
-        receipt.status = "FAILED"
-        db.commit()
+        logger.error(f"Critical error processing batch {job_id}: {e}")
+        db.rollback()
+        job = db.query(models.OCRBatchJob).filter(models.OCRBatchJob.id == job_id).first()
+        if job:
+            job.status = models.ReceiptStatus.FAILED.value
+            db.commit()
     finally:
         db.close()
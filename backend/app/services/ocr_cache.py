@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+class OCRResultCache:
+    """
+    Persistent, content-addressed cache for OCR extractions.
+    Entries live in the `ocr_cache` table so every gunicorn worker shares them.
+    Key: sha256(prompt_version + raw uploaded bytes).
+    Eviction: least recently accessed entries beyond `max_entries`.
+    """
+    def __init__(self, session_factory=None):
+        self.enabled = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"
+        self.max_entries = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "5000"))
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _session(self):
+        if self._session_factory is None:
+            from ..database import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    @staticmethod
+    def compute_version(prompt: str, model_names: list) -> str:
+        """Short fingerprint of the prompt + model chain. Changes whenever either changes."""
+        raw = prompt.strip() + "|" + ",".join(model_names)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def make_key(file_data: bytes, prompt_version: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(prompt_version.encode("utf-8"))
+        digest.update(file_data)
+        return digest.hexdigest()
+
+    def get(self, cache_key: str):
+        """Returns the cached extraction dict or None. Never raises."""
+        if not self.enabled:
+            return None
+
+        db = self._session()
+        try:
+            entry = db.query(models.OCRCacheEntry).filter(models.OCRCacheEntry.cache_key == cache_key).first()
+            if not entry:
+                self._count("misses")
+                return None
+
+            entry.hits = (entry.hits or 0) + 1
+            entry.last_accessed_at = datetime.utcnow()
+            db.commit()
+            self._count("hits")
+            return json.loads(entry.result)
+        except Exception as e:
+            logger.warning(f"OCR cache lookup failed: {e}")
+            db.rollback()
+            self._count("misses")
+            return None
+        finally:
+            db.close()
+
+    def set(self, cache_key: str, prompt_version: str, extracted_data: dict):
+        """Stores an extraction and trims the table back to `max_entries`. Never raises."""
+        if not self.enabled:
+            return
+
+        db = self._session()
+        try:
+            entry = db.query(models.OCRCacheEntry).filter(models.OCRCacheEntry.cache_key == cache_key).first()
+            if entry:
+                entry.result = json.dumps(extracted_data)
+                entry.last_accessed_at = datetime.utcnow()
+            else:
+                db.add(models.OCRCacheEntry(
+                    cache_key=cache_key,
+                    prompt_version=prompt_version,
+                    result=json.dumps(extracted_data)
+                ))
+            db.flush()
+            self._evict(db)
+            db.commit()
+        except Exception as e:
+            logger.warning(f"OCR cache store failed: {e}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def _evict(self, db):
+        total = db.query(models.OCRCacheEntry).count()
+        overflow = total - self.max_entries
+        if overflow <= 0:
+            return
+
+        stale_keys = [
+            row[0] for row in db.query(models.OCRCacheEntry.cache_key)
+            .order_by(models.OCRCacheEntry.last_accessed_at.asc())
+            .limit(overflow).all()
+        ]
+        db.query(models.OCRCacheEntry).filter(
+            models.OCRCacheEntry.cache_key.in_(stale_keys)
+        ).delete(synchronize_session=False)
+        self._count("evictions", len(stale_keys))
+
+    def invalidate(self, keep_version: str = None) -> int:
+        """
+        Drops cached extractions. With `keep_version`, only entries produced by
+        other prompt versions are removed (use after editing the prompt).
+        Returns the number of deleted rows.
+        """
+        db = self._session()
+        try:
+            query = db.query(models.OCRCacheEntry)
+            if keep_version:
+                query = query.filter(models.OCRCacheEntry.prompt_version != keep_version)
+            deleted = query.delete(synchronize_session=False)
+            db.commit()
+            logger.info(f"OCR cache invalidated {deleted} entries")
+            return deleted
+        finally:
+            db.close()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "max_entries": self.max_entries
+        }
+
+# Singleton instance
+ocr_cache = OCRResultCache()
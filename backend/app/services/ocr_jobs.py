@@ -0,0 +1,222 @@
+import os
+import uuid
+import socket
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# A worker owns a receipt for this long. Longer than the slowest OCR chunk
+# (Gemini timeouts + retries), short enough that a dead worker is noticed quickly.
+OCR_JOB_LEASE_SECONDS = int(os.getenv("OCR_JOB_LEASE_SECONDS", "300"))
+OCR_JOB_MAX_ATTEMPTS = int(os.getenv("OCR_JOB_MAX_ATTEMPTS", "3"))
+OCR_JOB_REAP_LIMIT = int(os.getenv("OCR_JOB_REAP_LIMIT", "500"))
+
+PENDING = models.ReceiptStatus.PENDING.value
+PROCESSING = models.ReceiptStatus.PROCESSING.value
+COMPLETED = models.ReceiptStatus.COMPLETED.value
+FAILED = models.ReceiptStatus.FAILED.value
+
+def new_worker_id() -> str:
+    """Unique per task invocation, so a re-delivered message on the same process never shares a lease."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def _ensure_jobs(db: Session, receipts: list):
+    """Creates the OCRJob row of every receipt that has none yet (receipt_id is unique)."""
+    ids = [r.id for r in receipts]
+    existing = {row[0] for row in db.query(models.OCRJob.receipt_id).filter(models.OCRJob.receipt_id.in_(ids))}
+    missing = [r for r in receipts if r.id not in existing]
+    if not missing:
+        return
+
+    try:
+        db.add_all([
+            models.OCRJob(receipt_id=r.id, company_id=r.company_id, status=PENDING, attempts=0)
+            for r in missing
+        ])
+        db.commit()
+    except IntegrityError:
+        # Another worker created them first, the claim below decides who runs them
+        db.rollback()
+
+def claim(db: Session, receipts: list, worker_id: str) -> set:
+    """
+    Leases the given receipts to `worker_id` with one conditional UPDATE.
+    Only PENDING jobs, or PROCESSING jobs whose lease expired, with attempts left
+    can be claimed; completed jobs and live leases of other workers are skipped.
+    Returns the ids of the receipts this worker now owns (committed).
+    """
+    if not receipts:
+        return set()
+
+    _ensure_jobs(db, receipts)
+    now = datetime.utcnow()
+    ids = [r.id for r in receipts]
+    Job = models.OCRJob
+
+    db.query(Job).filter(
+        Job.receipt_id.in_(ids),
+        Job.attempts < OCR_JOB_MAX_ATTEMPTS,
+        or_(
+            Job.status == PENDING,
+            and_(Job.status == PROCESSING, Job.lease_expires_at < now)
+        )
+    ).update({
+        Job.status: PROCESSING,
+        Job.worker_id: worker_id,
+        Job.lease_expires_at: now + timedelta(seconds=OCR_JOB_LEASE_SECONDS),
+        Job.attempts: Job.attempts + 1,
+        Job.updated_at: now
+    }, synchronize_session=False)
+
+    claimed = {
+        row[0] for row in db.query(Job.receipt_id).filter(
+            Job.receipt_id.in_(ids),
+            Job.worker_id == worker_id,
+            Job.status == PROCESSING
+        )
+    }
+    for receipt in receipts:
+        if receipt.id in claimed:
+            receipt.status = PROCESSING
+    db.commit()
+    return claimed
+
+def renew(db: Session, receipt_ids: list, worker_id: str) -> int:
+    """
+    Extends the lease of the given receipts, only where `worker_id` still holds it.
+    Workers call this while an extraction runs longer than half a lease, so the
+    reaper never hands a receipt that is still being read to another worker.
+    Returns how many leases were renewed. The caller commits.
+    """
+    if not receipt_ids:
+        return 0
+
+    now = datetime.utcnow()
+    Job = models.OCRJob
+    return db.query(Job).filter(
+        Job.receipt_id.in_(receipt_ids),
+        Job.worker_id == worker_id,
+        Job.status == PROCESSING
+    ).update({
+        Job.lease_expires_at: now + timedelta(seconds=OCR_JOB_LEASE_SECONDS),
+        Job.updated_at: now
+    }, synchronize_session=False)
+
+def _save_parsed_data(db: Session, parsed: models.ParsedData):
+    """Inserts the extraction, or overwrites the one left by an earlier attempt."""
+    existing = db.query(models.ParsedData).filter(models.ParsedData.receipt_id == parsed.receipt_id).first()
+    if existing is None:
+        db.add(parsed)
+        return
+
+    for column in models.ParsedData.__table__.columns.keys():
+        if column != "id":
+            setattr(existing, column, getattr(parsed, column))
+
+def complete(db: Session, receipt: models.Receipt, worker_id: str, parsed: models.ParsedData) -> bool:
+    """
+    Stores the extraction and marks the job COMPLETED, only if `worker_id` still
+    holds the lease. Returns False (nothing written) when the lease was lost to
+    another worker. The caller commits.
+    """
+    now = datetime.utcnow()
+    Job = models.OCRJob
+    updated = db.query(Job).filter(
+        Job.receipt_id == receipt.id,
+        Job.worker_id == worker_id,
+        Job.status == PROCESSING
+    ).update({
+        Job.status: COMPLETED,
+        Job.lease_expires_at: None,
+        Job.last_error: None,
+        Job.finished_at: now,
+        Job.updated_at: now
+    }, synchronize_session=False)
+
+    if not updated:
+        logger.warning(f"Lost OCR lease for receipt {receipt.id}, discarding result of {worker_id}")
+        return False
+
+    _save_parsed_data(db, parsed)
+    receipt.status = models.ReceiptStatus.PROCESSED.value
+    receipt.processed_at = now
+    return True
+
+def fail(db: Session, receipt: models.Receipt, worker_id: str, error, retry: bool = True) -> bool:
+    """
+    Releases the lease after a failed attempt and records the error. With `retry` and
+    attempts left the job goes back to PENDING, otherwise it is FAILED for good.
+    Returns True when the job should be retried. The caller commits.
+    """
+    job = db.query(models.OCRJob).filter(
+        models.OCRJob.receipt_id == receipt.id,
+        models.OCRJob.worker_id == worker_id,
+        models.OCRJob.status == PROCESSING
+    ).first()
+    if job is None:
+        return False
+
+    job.last_error = str(error)[:2000]
+    job.worker_id = None
+    job.lease_expires_at = None
+    if retry and job.attempts < OCR_JOB_MAX_ATTEMPTS:
+        job.status = PENDING
+        receipt.status = models.ReceiptStatus.PENDING.value
+        return True
+
+    job.status = FAILED
+    job.finished_at = datetime.utcnow()
+    receipt.status = models.ReceiptStatus.FAILED.value
+    return False
+
+def reap_expired(db: Session) -> list:
+    """
+    Finds jobs whose worker died (PROCESSING past lease_expires_at). Jobs with attempts
+    left go back to PENDING and their receipts are returned for re-queueing; the rest
+    are marked FAILED. Each job is released with a conditional UPDATE, so a worker
+    finishing at the same moment wins over the reaper.
+    """
+    now = datetime.utcnow()
+    Job = models.OCRJob
+    expired = db.query(Job).filter(
+        Job.status == PROCESSING,
+        Job.lease_expires_at < now
+    ).order_by(Job.lease_expires_at.asc()).limit(OCR_JOB_REAP_LIMIT).all()
+
+    requeue = []
+    for job in expired:
+        exhausted = job.attempts >= OCR_JOB_MAX_ATTEMPTS
+        released = db.query(Job).filter(
+            Job.id == job.id,
+            Job.status == PROCESSING,
+            Job.lease_expires_at < now
+        ).update({
+            Job.status: FAILED if exhausted else PENDING,
+            Job.worker_id: None,
+            Job.lease_expires_at: None,
+            Job.last_error: f"Lease of {job.worker_id} expired (attempt {job.attempts})",
+            Job.finished_at: now if exhausted else None,
+            Job.updated_at: now
+        }, synchronize_session=False)
+        if not released:
+            continue
+
+        receipt = db.query(models.Receipt).filter(models.Receipt.id == job.receipt_id).first()
+        if receipt is None:
+            continue
+        if exhausted:
+            receipt.status = models.ReceiptStatus.FAILED.value
+        else:
+            receipt.status = models.ReceiptStatus.PENDING.value
+            requeue.append(receipt)
+
+    db.commit()
+    if expired:
+        logger.warning(f"Reaped {len(expired)} expired OCR leases, {len(requeue)} re-queued")
+    return requeue
@@ -0,0 +1,225 @@
+import re
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Optional, List
+from pydantic import BaseModel, ValidationError, field_validator
+
+from .local_ocr import parse_amount, parse_date
+
+logger = logging.getLogger(__name__)
+
+def _to_float(value):
+    """Accepts numbers and model strings like "$ 150.000" or "150,000.00"."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    cleaned = re.sub(r"[^\d.,\-]", "", str(value))
+    if not cleaned:
+        return None
+    return parse_amount(cleaned)
+
+class ExtractedItem(BaseModel):
+    name: str
+    qty: float = 1.0
+    unit: Optional[str] = None
+    price: float = 0.0
+    total: float = 0.0
+
+    @field_validator("qty", mode="before")
+    @classmethod
+    def _quantity(cls, value):
+        # Prompt rule: quantity is 1 when not printed
+        return _to_float(value) if value is not None else 1.0
+
+    @field_validator("price", "total", mode="before")
+    @classmethod
+    def _number(cls, value):
+        return _to_float(value) if value is not None else 0.0
+
+class ReceiptExtraction(BaseModel):
+    """Contract of the OCR prompt. Every field is optional so a partial answer still validates."""
+    vendor: Optional[str] = None
+    vendor_nit: Optional[str] = None
+    date: Optional[str] = None # YYYY-MM-DD
+    amount: Optional[float] = None
+    currency: Optional[str] = None
+    category: Optional[str] = None
+    invoice_number: Optional[str] = None
+    confidence_score: Optional[float] = None
+    items: List[ExtractedItem] = []
+
+    @field_validator("amount", "confidence_score", mode="before")
+    @classmethod
+    def _number(cls, value):
+        return _to_float(value)
+
+    @field_validator("date", mode="before")
+    @classmethod
+    def _iso_date(cls, value):
+        if value in (None, ""):
+            return None
+        try:
+            return datetime.strptime(str(value), "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            parsed = parse_date(str(value))
+            if parsed is None:
+                raise ValueError(f"Unrecognized date {value!r}")
+            return parsed
+
+# Gemini response_schema (OpenAPI subset) mirroring ReceiptExtraction
+_NULLABLE_STRING = {"type": "string", "nullable": True}
+RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "vendor": _NULLABLE_STRING,
+        "vendor_nit": _NULLABLE_STRING,
+        "date": _NULLABLE_STRING,
+        "amount": {"type": "number", "nullable": True},
+        "currency": _NULLABLE_STRING,
+        "category": _NULLABLE_STRING,
+        "invoice_number": _NULLABLE_STRING,
+        "confidence_score": {"type": "number", "nullable": True},
+        "items": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "qty": {"type": "number"},
+                    "unit": _NULLABLE_STRING,
+                    "price": {"type": "number"},
+                    "total": {"type": "number"},
+                },
+                "required": ["name"],
+            },
+        },
+    },
+    "required": ["vendor", "date", "amount"],
+}
+
+GENERATION_CONFIG = {
+    "response_mime_type": "application/json",
+    "response_schema": RESPONSE_SCHEMA,
+}
+
+CORE_FIELDS = ("vendor", "amount", "date")
+
+class ExtractionStats:
+    """
+    Counts how model answers were turned into extractions. `rescued` responses
+    (JSON repaired or fields/items salvaged) used to fail and cost a paid retry.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.responses = 0
+        self.clean = 0
+        self.repaired_json = 0
+        self.salvaged = 0
+        self.rescued = 0
+        self.unusable = 0
+
+    def record(self, repaired: bool = False, salvaged: bool = False, unusable: bool = False):
+        with self._lock:
+            self.responses += 1
+            self.repaired_json += repaired
+            self.salvaged += salvaged
+            self.unusable += unusable
+            if unusable:
+                return
+            if repaired or salvaged:
+                self.rescued += 1
+            else:
+                self.clean += 1
+
+    def stats(self) -> dict:
+        return {
+            "responses": self.responses,
+            "clean": self.clean,
+            "repaired_json": self.repaired_json,
+            "salvaged": self.salvaged,
+            "unusable": self.unusable,
+            "retries_avoided": self.rescued,
+            "salvage_rate": (self.rescued / self.responses) if self.responses else 0.0
+        }
+
+# Singleton instance
+extraction_stats = ExtractionStats()
+
+def parse_json(response_text: str):
+    """
+    Returns (object, repaired). JSON mode normally answers clean JSON; markdown fences,
+    prose around the object and trailing commas are repaired instead of re-asking the model.
+    """
+    text = response_text.strip()
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+
+    if "```" in text:
+        text = text.split("```json")[1] if "```json" in text else text.split("```")[1]
+        text = text.split("```")[0]
+    start, end = text.find("{"), text.rfind("}")
+    if start != -1 and end > start:
+        text = text[start:end + 1]
+    text = re.sub(r",\s*([}\]])", r"\1", text)
+    return json.loads(text), True
+
+def validate_extraction(raw) -> tuple:
+    """
+    Validates a decoded answer against ReceiptExtraction. Malformed item lines and
+    fields are dropped rather than rejecting the whole answer.
+    Returns (extraction dict, list of dropped fields such as "date" or "items[2]").
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("Model answer is not a JSON object")
+
+    data = dict(raw)
+    dropped = []
+
+    items = data.get("items") or []
+    if not isinstance(items, list):
+        dropped.append("items")
+        items = []
+    valid_items = []
+    for index, item in enumerate(items):
+        try:
+            valid_items.append(ExtractedItem.model_validate(item))
+        except (ValidationError, ValueError):
+            dropped.append(f"items[{index}]")
+    data["items"] = valid_items
+
+    try:
+        extraction = ReceiptExtraction.model_validate(data)
+    except ValidationError as e:
+        bad_fields = {error["loc"][0] for error in e.errors() if error["loc"]}
+        dropped.extend(sorted(bad_fields))
+        extraction = ReceiptExtraction.model_validate({k: v for k, v in data.items() if k not in bad_fields})
+
+    # Absent fields stay absent so build_parsed_data applies its defaults
+    return extraction.model_dump(exclude_none=True), dropped
+
+def parse_extraction(response_text: str) -> dict:
+    """
+    `parse` callback for the Gemini client. Raises only when nothing usable is left
+    (no vendor, amount or date), which makes the client try the next attempt/model.
+    """
+    try:
+        raw, repaired = parse_json(response_text)
+        extraction, dropped = validate_extraction(raw)
+    except (ValueError, IndexError) as e:
+        extraction_stats.record(unusable=True)
+        raise ValueError(f"Unparseable OCR answer: {e}")
+
+    if all(extraction.get(field) is None for field in CORE_FIELDS):
+        extraction_stats.record(unusable=True)
+        raise ValueError("OCR answer has no vendor, amount or date")
+
+    if dropped:
+        logger.warning(f"Salvaged OCR answer, dropped: {', '.join(dropped)}")
+    extraction_stats.record(repaired=repaired, salvaged=bool(dropped))
+    return extraction
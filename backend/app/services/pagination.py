@@ -0,0 +1,116 @@
+import json
+import base64
+import logging
+from datetime import date, datetime
+from sqlalchemy import tuple_, text
+from sqlalchemy.orm import Query, Session
+from fastapi import HTTPException, Response
+
+logger = logging.getLogger(__name__)
+
+NEXT = "next"
+PREV = "prev"
+
+class Page:
+    def __init__(self, items: list, next_cursor: str = None, prev_cursor: str = None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+def _encode_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+def _decode_value(column, value):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+def encode_cursor(direction: str, values: list) -> str:
+    """Opaque cursor: base64url of [direction, key values]. Clients just echo it back."""
+    raw = json.dumps([direction, [_encode_value(v) for v in values]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, columns: list) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        direction, values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if direction not in (NEXT, PREV) or len(values) != len(columns):
+            raise ValueError("cursor shape")
+        return direction, [_decode_value(column, value) for column, value in zip(columns, values)]
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+
+def paginate(query: Query, columns: list, limit: int, cursor: str = None, descending: bool = True, skip: int = 0) -> Page:
+    """
+    Keyset pagination over `columns` (sort keys ending with a unique column, e.g.
+    (Purchase.date, Purchase.id)), all in the same direction. A page is one
+    row-value comparison plus LIMIT on the (company_id, key) index, so deep pages
+    cost the same as the first one. `descending` gives newest first.
+    `skip` without a cursor is the legacy OFFSET paging, still answered with a next cursor.
+    """
+    direction, values = decode_cursor(cursor, columns) if cursor else (NEXT, None)
+    keys = tuple_(*columns)
+    if skip and not cursor:
+        order = [c.desc() if descending else c.asc() for c in columns]
+        rows = query.order_by(*order).offset(skip).limit(limit + 1).all()
+        page = Page(rows[:limit])
+        if len(rows) > limit:
+            page.next_cursor = encode_cursor(NEXT, [getattr(rows[limit - 1], c.key) for c in columns])
+        return page
+
+    # A "prev" page walks the index the other way from the cursor, then is flipped back
+    forward = (direction == NEXT) == descending
+    if values is not None:
+        bound = tuple_(*values)
+        query = query.filter(keys < bound if forward else keys > bound)
+    order = [c.desc() if forward else c.asc() for c in columns]
+    rows = query.order_by(*order).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == PREV:
+        rows.reverse()
+    if not rows:
+        return Page([])
+
+    def key_of(row):
+        return [getattr(row, c.key) for c in columns]
+
+    # Following "next" from a "prev" page, or "prev" from a "next" page, always has rows
+    more_after = has_more if direction == NEXT else values is not None
+    more_before = has_more if direction == PREV else values is not None
+    return Page(
+        rows,
+        next_cursor=encode_cursor(NEXT, key_of(rows[-1])) if more_after else None,
+        prev_cursor=encode_cursor(PREV, key_of(rows[0])) if more_before else None
+    )
+
+def estimate_count(db: Session, query: Query) -> int:
+    """
+    Row count of the unpaginated query. On Postgres it is the planner estimate
+    (EXPLAIN, no scan), elsewhere an exact COUNT(*).
+    """
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        return query.order_by(None).count()
+    statement = query.order_by(None).statement.compile(bind, compile_kwargs={"literal_binds": True})
+    plan = db.execute(text(f"EXPLAIN (FORMAT JSON) {statement}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def set_page_headers(response: Response, page: Page, total: int = None):
+    """Cursors travel in headers so list endpoints keep returning a plain JSON array."""
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    if page.prev_cursor:
+        response.headers["X-Prev-Cursor"] = page.prev_cursor
+    if total is not None:
+        response.headers["X-Total-Count"] = str(total)
@@ -0,0 +1,131 @@
+import io
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pypdf import PdfReader
+
+logger = logging.getLogger(__name__)
+
+PDF_RASTER_WORKERS = int(os.getenv("PDF_RASTER_WORKERS", "2"))
+PDF_PAGE_CACHE_SIZE = int(os.getenv("PDF_PAGE_CACHE_SIZE", "64"))
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "10"))
+# Pages with fewer extractable characters than this are treated as scans
+PDF_MIN_TEXT_CHARS = int(os.getenv("PDF_MIN_TEXT_CHARS", "40"))
+
+def is_pdf(file_data: bytes) -> bool:
+    return file_data[:1024].lstrip().startswith(b"%PDF")
+
+def _render_pages(pdf_bytes: bytes, page_indexes: list) -> dict:
+    """
+    Process-pool worker. Returns {page_index: [image bytes, ...]}.
+    Scanned invoices embed each page as a single raster, so pulling the embedded
+    images out with pypdf gives us the page picture without a poppler dependency.
+    """
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    rendered = {}
+    for index in page_indexes:
+        images = []
+        try:
+            for image in reader.pages[index].images:
+                images.append(image.data)
+        except Exception as e:
+            logger.warning(f"Could not extract images from PDF page {index}: {e}")
+        rendered[index] = images
+    return rendered
+
+class PdfPage:
+    def __init__(self, index: int, text: str = "", images: list = None):
+        self.index = index
+        self.text = text
+        self.images = images or []
+
+    @property
+    def has_text(self) -> bool:
+        return len(self.text.strip()) >= PDF_MIN_TEXT_CHARS
+
+class PdfExtractor:
+    """
+    Splits a PDF into per-page text and images.
+    - Text layer first: digitally generated invoices never need a vision call.
+    - Only pages without text get their images extracted, in a process pool so
+      PDF parsing does not hold the GIL of the web/OCR worker.
+    - Extracted page images are kept in a small LRU keyed by (pdf sha256, page).
+    """
+    def __init__(self):
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._page_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=PDF_RASTER_WORKERS)
+            return self._pool
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            if key in self._page_cache:
+                self._page_cache.move_to_end(key)
+                return self._page_cache[key]
+        return None
+
+    def _cache_put(self, key, images: list):
+        with self._cache_lock:
+            self._page_cache[key] = images
+            self._page_cache.move_to_end(key)
+            while len(self._page_cache) > PDF_PAGE_CACHE_SIZE:
+                self._page_cache.popitem(last=False)
+
+    def extract(self, pdf_bytes: bytes) -> list:
+        """Returns a list of PdfPage (at most PDF_MAX_PAGES)."""
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        digest = hashlib.sha256(pdf_bytes).hexdigest()
+
+        pages = []
+        for index, page in enumerate(reader.pages[:PDF_MAX_PAGES]):
+            try:
+                text = page.extract_text() or ""
+            except Exception as e:
+                logger.warning(f"Text extraction failed on PDF page {index}: {e}")
+                text = ""
+            pages.append(PdfPage(index, text))
+
+        missing = []
+        for page in pages:
+            if page.has_text:
+                continue
+            cached = self._cache_get((digest, page.index))
+            if cached is not None:
+                page.images = cached
+            else:
+                missing.append(page.index)
+
+        if missing:
+            rendered = self._render(pdf_bytes, missing)
+            for page in pages:
+                if page.index in rendered:
+                    page.images = rendered[page.index]
+                    self._cache_put((digest, page.index), page.images)
+
+        return pages
+
+    def _render(self, pdf_bytes: bytes, page_indexes: list) -> dict:
+        # One task per worker (not per page) so the PDF bytes are pickled at most N times
+        workers = max(1, min(PDF_RASTER_WORKERS, len(page_indexes)))
+        chunks = [page_indexes[i::workers] for i in range(workers)]
+        rendered = {}
+        try:
+            pool = self._get_pool()
+            for result in pool.map(_render_pages, [pdf_bytes] * len(chunks), chunks):
+                rendered.update(result)
+        except Exception as e:
+            logger.warning(f"PDF process pool unavailable, rendering inline: {e}")
+            rendered = _render_pages(pdf_bytes, page_indexes)
+        return rendered
+
+# Singleton instance
+pdf_extractor = PdfExtractor()
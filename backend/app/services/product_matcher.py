@@ -0,0 +1,250 @@
+import os
+import time
+import logging
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..product_names import normalize_product_name
+from .cache_versions import CacheVersions
+
+logger = logging.getLogger(__name__)
+
+# Minimum trigram similarity (shared / union, as pg_trgm) for a fuzzy match
+PRODUCT_MATCH_THRESHOLD = float(os.getenv("PRODUCT_MATCH_THRESHOLD", "0.45"))
+# Bounds how stale another worker's index can be when changes are not published through
+# Redis (no REDIS_URL); this process invalidates on every Product write
+PRODUCT_INDEX_TTL_SECONDS = int(os.getenv("PRODUCT_INDEX_TTL_SECONDS", "30"))
+
+FUZZY = "fuzzy"
+CONFIRMED = "confirmed"
+
+def trigrams(key: str) -> set:
+    """Word trigrams padded like pg_trgm: "pollo" -> {"  p", " po", "pol", "oll", "llo", "lo "}."""
+    grams = set()
+    for word in key.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+class ProductIndex:
+    """Normalized names and a trigram inverted index over the products of one company."""
+    def __init__(self, products: list):
+        self.exact = {}
+        self.ids = []
+        self.sizes = []
+        self.postings = defaultdict(list)
+        for product_id, name in products:
+            key = normalize_product_name(name)
+            if not key:
+                continue
+            self.exact.setdefault(key, product_id)
+            grams = trigrams(key)
+            position = len(self.ids)
+            self.ids.append(product_id)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(position)
+        self.built_at = time.monotonic()
+        self.version = None # CacheVersions.current() when built
+
+    def best(self, key: str) -> tuple:
+        """(product_id, score) of the most similar product; only products sharing a trigram are scored."""
+        if key in self.exact:
+            return self.exact[key], 1.0
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        best_id, best_score = None, 0.0
+        for position, count in shared.items():
+            score = count / (len(grams) + self.sizes[position] - count)
+            if score > best_score:
+                best_id, best_score = self.ids[position], score
+        return best_id, best_score
+
+class ProductMatcher:
+    """
+    Maps free-text purchase item names to Product rows of the same company:
+    1. learned aliases (product_aliases), one query for the whole batch;
+    2. exact normalized name;
+    3. trigram similarity above PRODUCT_MATCH_THRESHOLD, learned as an alias.
+    The per-company index is cached in-process and rebuilt after Product writes (published
+    to other workers through `versions`) or the TTL. Built outside the lock.
+    """
+    def __init__(self, threshold: float = None, ttl_seconds: int = None, versions: CacheVersions = None):
+        self.threshold = PRODUCT_MATCH_THRESHOLD if threshold is None else threshold
+        self.ttl_seconds = PRODUCT_INDEX_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.versions = versions or CacheVersions("product_index")
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def invalidate(self, company_id: str = None, publish: bool = False):
+        with self._lock:
+            if company_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(company_id, None)
+        if publish:
+            self.versions.bump(company_id)
+
+    def index_for(self, db: Session, company_id: str) -> ProductIndex:
+        version = self.versions.current(company_id)
+        with self._lock:
+            index = self._indexes.get(company_id)
+        if index is not None and index.version == version and time.monotonic() - index.built_at < self.ttl_seconds:
+            return index
+
+        products = db.query(models.Product.id, models.Product.name).filter(
+            models.Product.company_id == company_id
+        ).order_by(models.Product.id).all()
+        index = ProductIndex(products)
+        index.version = version
+        with self._lock:
+            self._indexes[company_id] = index
+        return index
+
+    def match(self, db: Session, company_id: str, names: list) -> dict:
+        """
+        Returns {name: product_id or None} for the given item names. New fuzzy
+        matches are added to product_aliases in the caller's transaction.
+        """
+        keys = {name: normalize_product_name(name) for name in names}
+        wanted = {key for key in keys.values() if key}
+        if not wanted:
+            return {name: None for name in names}
+
+        resolved = dict(db.query(models.ProductAlias.alias_key, models.ProductAlias.product_id).filter(
+            models.ProductAlias.company_id == company_id,
+            models.ProductAlias.alias_key.in_(wanted)
+        ).all())
+
+        learned = {}
+        index = None
+        for key in wanted - set(resolved):
+            index = index or self.index_for(db, company_id)
+            product_id, score = index.best(key)
+            if product_id is None or score < self.threshold:
+                continue
+            resolved[key] = product_id
+            if score < 1.0:
+                learned[key] = (product_id, score)
+
+        for key, (product_id, score) in learned.items():
+            save_alias(db, company_id, key, product_id, source=FUZZY, score=score)
+        if learned:
+            logger.info(f"Learned {len(learned)} product aliases for company {company_id}")
+
+        return {name: resolved.get(key) for name, key in keys.items()}
+
+# Singleton instance
+product_matcher = ProductMatcher()
+
+def save_alias(db: Session, company_id: str, name_or_key: str, product_id: str, source: str = CONFIRMED, score: float = None):
+    """
+    Upserts an alias. A confirmed alias replaces whatever was there; a fuzzy one
+    never overwrites an existing alias. The caller commits.
+    """
+    key = normalize_product_name(name_or_key)
+    if not key:
+        return
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    stmt = insert(models.ProductAlias.__table__).values(
+        company_id=company_id, alias_key=key,
+        product_id=product_id, source=source, score=score
+    )
+    if source == CONFIRMED:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["company_id", "alias_key"],
+            set_={"product_id": product_id, "source": source, "score": score, "updated_at": datetime.utcnow()}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=["company_id", "alias_key"])
+    db.execute(stmt)
+
+def _item_unit_price(item: models.PurchaseItem) -> float:
+    if item.unit_price:
+        return item.unit_price
+    if item.total_price and item.quantity:
+        return item.total_price / item.quantity
+    return 0.0
+
+def apply_approved_purchases(db: Session, purchases: list) -> int:
+    """
+    Links the items of approved purchases to products and moves each product's
+    last_price to its most recent purchase price, one query per step for the
+    whole batch. An older purchase approved late never overwrites a newer price.
+    Returns the number of products updated. The caller commits.
+    """
+    purchases = [p for p in purchases if p.date]
+    if not purchases:
+        return 0
+    by_id = {p.id: p for p in purchases}
+    items = db.query(models.PurchaseItem).filter(models.PurchaseItem.purchase_id.in_(list(by_id))).all()
+
+    by_company = defaultdict(list)
+    for item in items:
+        by_company[by_id[item.purchase_id].company_id].append(item)
+
+    latest = {} # product_id -> (date, unit price)
+    for company_id, company_items in by_company.items():
+        matches = product_matcher.match(db, company_id, list({item.name for item in company_items}))
+        for item in company_items:
+            product_id = matches.get(item.name)
+            if not product_id:
+                continue
+            item.product_id = product_id
+            price = _item_unit_price(item)
+            day = by_id[item.purchase_id].date
+            if price > 0 and (product_id not in latest or day >= latest[product_id][0]):
+                latest[product_id] = (day, price)
+
+    if not latest:
+        return 0
+    updated = 0
+    for product in db.query(models.Product).filter(models.Product.id.in_(list(latest))).all():
+        day, price = latest[product.id]
+        if product.last_price_date is None or day >= product.last_price_date:
+            product.last_price = price
+            product.last_price_date = day
+            updated += 1
+    return updated
+
+def _invalidate_changed_products(session: Session, flush_context):
+    """
+    after_flush hook: product inserts, renames and deletes rebuild that company's index
+    on next use. Other workers are told after the commit, once they can read the change.
+    """
+    companies = {
+        obj.company_id for obj in list(session.new) + list(session.deleted)
+        if isinstance(obj, models.Product)
+    }
+    companies.update(
+        obj.company_id for obj in session.dirty
+        if isinstance(obj, models.Product) and inspect(obj).attrs.name.history.has_changes()
+    )
+    for company_id in companies:
+        product_matcher.invalidate(company_id)
+    if companies:
+        session.info.setdefault("product_index_changes", set()).update(companies)
+
+def _publish_changed_products(session: Session):
+    for company_id in session.info.pop("product_index_changes", ()):
+        # Also drops an index this worker rebuilt from the uncommitted state
+        product_matcher.invalidate(company_id, publish=True)
+
+def _discard_changed_products(session: Session, previous_transaction):
+    for company_id in session.info.pop("product_index_changes", ()):
+        product_matcher.invalidate(company_id)
+
+event.listen(Session, "after_flush", _invalidate_changed_products)
+event.listen(Session, "after_commit", _publish_changed_products)
+event.listen(Session, "after_soft_rollback", _discard_changed_products)
@@ -0,0 +1,137 @@
+import logging
+from sqlalchemy import DDL, event, func, text, literal_column, table, column
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..product_names import normalize_product_name
+
+logger = logging.getLogger(__name__)
+
+# Substring search over purchase item product keys, served by an index instead of a
+# full scan of purchase_items:
+# - Postgres: pg_trgm GIN index, which serves `product_key LIKE '%term%'` directly.
+# - SQLite: FTS5 table with the trigram tokenizer (SQLite >= 3.34), kept in sync by triggers.
+# Both need at least 3 characters; shorter terms fall back to a plain LIKE.
+
+FTS_TABLE = "purchase_items_fts"
+MIN_INDEXED_LENGTH = 3
+
+_POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS idx_purchase_items_product_key_trgm "
+    "ON purchase_items USING gin (product_key gin_trgm_ops)",
+]
+
+# External content table: the index stores no copy of the keys, rows are found by rowid
+_SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "product_key, content='purchase_items', content_rowid='rowid', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS purchase_items_fts_insert AFTER INSERT ON purchase_items BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, product_key) VALUES (new.rowid, new.product_key); END",
+    f"CREATE TRIGGER IF NOT EXISTS purchase_items_fts_delete AFTER DELETE ON purchase_items BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, product_key) VALUES ('delete', old.rowid, old.product_key); END",
+    f"CREATE TRIGGER IF NOT EXISTS purchase_items_fts_update AFTER UPDATE OF product_key ON purchase_items BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, product_key) VALUES ('delete', old.rowid, old.product_key); "
+    f"INSERT INTO {FTS_TABLE}(rowid, product_key) VALUES (new.rowid, new.product_key); END",
+]
+
+def ensure_search_index(bind):
+    """
+    Creates the search index of the connected database if it is missing; safe to run on
+    every start. The after_create hooks below only fire for a brand new purchase_items
+    table, this covers databases created before the index existed. A new SQLite FTS
+    table is filled from the existing rows.
+    """
+    dialect = bind.dialect.name
+    if dialect == "postgresql":
+        statements = _POSTGRES_DDL
+    elif dialect == "sqlite":
+        statements = _SQLITE_DDL
+    else:
+        return
+
+    with bind.begin() as conn:
+        fts_exists = dialect == "sqlite" and conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}
+        ).first() is not None
+        for statement in statements:
+            conn.execute(text(statement))
+        if dialect == "sqlite" and not fts_exists:
+            conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+            logger.info(f"Created {FTS_TABLE} and indexed existing purchase items")
+
+_items = models.PurchaseItem.__table__
+for statement in _POSTGRES_DDL:
+    event.listen(_items, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+for statement in _SQLITE_DDL:
+    event.listen(_items, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+# Triggers go away with the table, the FTS table has to be dropped explicitly
+event.listen(_items, "before_drop", DDL(f"DROP TABLE IF EXISTS {FTS_TABLE}").execute_if(dialect="sqlite"))
+
+def filter_items(db: Session, items_query, query: str):
+    """
+    Restricts a query that already involves PurchaseItem to the items whose product
+    key contains the normalized `query`, so "PECHUGA DE POLLO" also finds "Pechuga pollo kg".
+    Queries made only of units/connectors fall back to the raw item name.
+    """
+    term = normalize_product_name(query)
+    if not term:
+        return items_query.filter(func.lower(models.PurchaseItem.name).like(f"%{query.lower()}%"))
+    if len(term) < MIN_INDEXED_LENGTH or db.get_bind().dialect.name != "sqlite":
+        # Postgres: the trigram GIN index serves this LIKE. term is [a-z0-9 ] only, nothing to escape
+        return items_query.filter(models.PurchaseItem.product_key.like(f"%{term}%"))
+
+    # Joined (not `rowid IN (...)`) so SQLite drives the plan from the FTS match.
+    # A quoted FTS5 trigram query is a substring match
+    fts = table(FTS_TABLE, column("rowid"))
+    return items_query.join(
+        fts, fts.c.rowid == literal_column("purchase_items.rowid")
+    ).filter(
+        text(f"{FTS_TABLE} MATCH :product_term").bindparams(product_term=f'"{term}"')
+    )
+
+def price_trends(db: Session, company_id: str, query: str) -> list:
+    """Average unit price per purchase date of the items matching `query`."""
+    results = filter_items(db, db.query(
+        models.Purchase.date,
+        func.avg(models.PurchaseItem.unit_price).label('avg_price')
+    ).join(
+        models.PurchaseItem, models.Purchase.id == models.PurchaseItem.purchase_id
+    ), query).filter(
+        models.Purchase.company_id == company_id,
+        models.PurchaseItem.unit_price > 0 # Ignore zero prices
+    ).group_by(
+        models.Purchase.date
+    ).order_by(
+        models.Purchase.date.asc()
+    ).all()
+
+    return [
+        {"date": r.date.strftime("%Y-%m-%d"), "price": int(r.avg_price)}
+        for r in results
+    ]
+
+def backfill_product_keys(db: Session, batch_size: int = 1000) -> int:
+    """Fills product_key of items created before it existed. Commits per batch."""
+    updated, last_id = 0, ""
+    while True:
+        items = db.query(models.PurchaseItem).filter(
+            models.PurchaseItem.product_key == None,
+            models.PurchaseItem.id > last_id
+        ).order_by(models.PurchaseItem.id.asc()).limit(batch_size).all()
+        if not items:
+            break
+        for item in items:
+            item.product_key = normalize_product_name(item.name) or None
+            updated += item.product_key is not None
+        last_id = items[-1].id
+        db.commit()
+    logger.info(f"Backfilled product_key of {updated} purchase items")
+    return updated
+
+def rebuild_index(db: Session):
+    """Re-indexes the SQLite FTS table, e.g. after a VACUUM renumbered rowids. No-op on Postgres."""
+    if db.get_bind().dialect.name != "sqlite":
+        return
+    db.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    db.commit()
@@ -0,0 +1,323 @@
+import os
+import time
+import logging
+import threading
+import numpy as np
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..product_names import normalize_product_name
+from .cache_versions import CacheVersions
+
+logger = logging.getLogger(__name__)
+
+# Bounds how stale another worker's graph can be when changes are not published through
+# Redis (no REDIS_URL); this process patches its own graph on every commit
+RECIPE_COST_CACHE_TTL_SECONDS = int(os.getenv("RECIPE_COST_CACHE_TTL_SECONDS", "30"))
+
+class CostGraph:
+    """
+    Recipes x products of one company as a sparse matrix in COO form (one entry per
+    recipe item: recipe row, product column, quantity) plus the product price vector.
+    Recipe cost = quantities @ prices, computed for every recipe with one np.bincount.
+    """
+    def __init__(self, rows: list):
+        # rows: (recipe_id, recipe_name, sale_price, item_id, product_id, quantity, product_name, unit, last_price)
+        recipe_pos, product_pos = {}, {}
+        self.recipe_ids, self.recipe_names, sale_prices = [], [], []
+        self.product_ids, self.product_names, self.product_units, prices = [], [], [], []
+        self.item_ids, item_rows, item_cols, quantities = [], [], [], []
+
+        for recipe_id, recipe_name, sale_price, item_id, product_id, quantity, product_name, unit, last_price in rows:
+            if recipe_id not in recipe_pos:
+                recipe_pos[recipe_id] = len(self.recipe_ids)
+                self.recipe_ids.append(recipe_id)
+                self.recipe_names.append(recipe_name)
+                sale_prices.append(sale_price or 0.0)
+            if item_id is None:
+                continue
+            col = -1 # Item whose product is gone: costs 0, shown as "Unknown"
+            if product_name is not None:
+                if product_id not in product_pos:
+                    product_pos[product_id] = len(self.product_ids)
+                    self.product_ids.append(product_id)
+                    self.product_names.append(product_name)
+                    self.product_units.append(unit)
+                    prices.append(last_price or 0.0)
+                col = product_pos[product_id]
+            self.item_ids.append(item_id)
+            item_rows.append(recipe_pos[recipe_id])
+            item_cols.append(col)
+            quantities.append(quantity or 0.0)
+
+        self.product_pos = product_pos
+        self.sale_prices = np.array(sale_prices, dtype=float)
+        # Trailing 0.0 is the price of the missing product (column -1)
+        self.prices = np.array(prices + [0.0], dtype=float)
+        self.rows = np.array(item_rows, dtype=np.int64)
+        self.cols = np.array(item_cols, dtype=np.int64)
+        self.quantities = np.array(quantities, dtype=float)
+
+        self.item_costs = self.quantities * self.prices[self.cols]
+        self.costs = self._recipe_costs(self.item_costs)
+        self.margins = self._margins(self.costs)
+        self._output = None
+        self.built_at = time.monotonic()
+        self.version = None # CacheVersions.current() when loaded
+        # Serializes price patches with reads; the cache lock is never held while computing
+        self.lock = threading.Lock()
+
+    def _recipe_costs(self, item_costs):
+        return np.bincount(self.rows, weights=item_costs, minlength=len(self.recipe_ids))
+
+    def _margins(self, costs):
+        sale = self.sale_prices
+        margins = np.zeros_like(costs)
+        priced = sale > 0
+        margins[priced] = (sale[priced] - costs[priced]) / sale[priced] * 100
+        return margins
+
+    def update_prices(self, new_prices: dict) -> int:
+        """Patches product prices and recomputes only the recipes using them. Returns how many changed."""
+        cols = [self.product_pos[pid] for pid in new_prices if pid in self.product_pos]
+        if not cols:
+            return 0
+        for product_id, price in new_prices.items():
+            if product_id in self.product_pos:
+                self.prices[self.product_pos[product_id]] = price or 0.0
+
+        touched = np.isin(self.cols, cols)
+        self.item_costs[touched] = self.quantities[touched] * self.prices[self.cols[touched]]
+        affected = np.unique(self.rows[touched])
+        in_affected = np.isin(self.rows, affected)
+        costs = np.bincount(
+            self.rows[in_affected], weights=self.item_costs[in_affected], minlength=len(self.recipe_ids)
+        )
+        self.costs[affected] = costs[affected]
+        self.margins[affected] = self._margins(self.costs)[affected]
+        self._output = None
+        return len(affected)
+
+    def price_multipliers(self, shocks: list) -> np.ndarray:
+        """
+        Per-product multiplier for shocks like {"product_id": ..., "change_pct": 15} or
+        {"name": "pollo", "change_pct": 15} (every product whose normalized name contains it).
+        """
+        multipliers = np.ones_like(self.prices)
+        keys = [normalize_product_name(name) for name in self.product_names]
+        for shock in shocks:
+            factor = 1 + (shock.get("change_pct") or 0) / 100
+            if shock.get("product_id") in self.product_pos:
+                multipliers[self.product_pos[shock["product_id"]]] *= factor
+            term = normalize_product_name(shock.get("name") or "")
+            if term:
+                for col, key in enumerate(keys):
+                    if term in key:
+                        multipliers[col] *= factor
+        return multipliers
+
+    def simulate(self, shocks: list) -> tuple:
+        """(costs, margins) of every recipe under the given price shocks, cached values untouched."""
+        prices = self.prices * self.price_multipliers(shocks)
+        costs = self._recipe_costs(self.quantities * prices[self.cols])
+        return costs, self._margins(costs)
+
+    def recipes(self) -> list:
+        """RecipeOut-shaped dicts, items in load order. Built once per price change."""
+        if self._output is not None:
+            return self._output
+        items_by_recipe = [[] for _ in self.recipe_ids]
+        for i, item_id in enumerate(self.item_ids):
+            col = self.cols[i]
+            known = col >= 0
+            items_by_recipe[self.rows[i]].append({
+                "id": item_id,
+                "product_name": self.product_names[col] if known else "Unknown",
+                "quantity": float(self.quantities[i]),
+                "unit": (self.product_units[col] or "-") if known else "-",
+                "unit_price": float(self.prices[col]),
+                "total_cost": float(self.item_costs[i])
+            })
+        self._output = [
+            {
+                "id": recipe_id,
+                "name": self.recipe_names[r],
+                "sale_price": float(self.sale_prices[r]),
+                "total_cost": float(self.costs[r]),
+                "margin": float(self.margins[r]),
+                "items": items_by_recipe[r]
+            }
+            for r, recipe_id in enumerate(self.recipe_ids)
+        ]
+        return self._output
+
+class RecipeCostCache:
+    """
+    Per-company CostGraph cache. Committed Product.last_price changes patch the
+    cached graph (only affected recipes are recomputed); recipe, item or product
+    structure changes drop it so the next read reloads it with one query.
+    Every change is also published through `versions`, so other workers reload.
+    Graphs are loaded outside the cache lock, one load per company at a time.
+    """
+    def __init__(self, ttl_seconds: int = None, versions: CacheVersions = None):
+        self.ttl_seconds = RECIPE_COST_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.versions = versions or CacheVersions("recipe_costs")
+        self._lock = threading.Lock()
+        self._graphs = {}
+        self._loading = {} # company_id -> lock held while that company's graph loads
+        self._generation = 0 # Bumped by invalidate(): a load that raced with it is not cached
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self, company_id: str = None, publish: bool = False):
+        with self._lock:
+            if company_id is None:
+                self._graphs.clear()
+            else:
+                self._graphs.pop(company_id, None)
+            self._generation += 1
+        if publish:
+            self.versions.bump(company_id)
+
+    def _cached(self, company_id: str, version: tuple) -> CostGraph:
+        graph = self._graphs.get(company_id)
+        if graph is None or graph.version != version:
+            return None
+        if time.monotonic() - graph.built_at >= self.ttl_seconds:
+            return None
+        return graph
+
+    def graph(self, db: Session, company_id: str) -> CostGraph:
+        version = self.versions.current(company_id)
+        with self._lock:
+            graph = self._cached(company_id, version)
+            if graph is not None:
+                self.hits += 1
+                return graph
+            loading = self._loading.setdefault(company_id, threading.Lock())
+
+        with loading:
+            with self._lock:
+                # Loaded by a concurrent request while this one waited
+                graph = self._cached(company_id, version)
+                if graph is not None:
+                    self.hits += 1
+                    return graph
+                self.misses += 1
+                generation = self._generation
+
+            graph = CostGraph(load_rows(db, company_id))
+            graph.version = version
+            with self._lock:
+                if generation == self._generation:
+                    self._graphs[company_id] = graph
+        return graph
+
+    def update_prices(self, company_id: str, new_prices: dict):
+        version = self.versions.bump(company_id)
+        with self._lock:
+            graph = self._graphs.get(company_id)
+        if graph is None:
+            return
+        with graph.lock:
+            graph.update_prices(new_prices)
+            # The patch is this bump: keep the graph unless another worker changed the company meanwhile
+            if version is not None and graph.version is not None and graph.version[1] == version - 1:
+                graph.version = (graph.version[0], version)
+
+    def recipes(self, db: Session, company_id: str) -> list:
+        graph = self.graph(db, company_id)
+        with graph.lock:
+            return graph.recipes()
+
+    def simulate(self, db: Session, company_id: str, shocks: list) -> list:
+        """Current vs. shocked cost and margin of every recipe, e.g. chicken +15% across the menu."""
+        graph = self.graph(db, company_id)
+        with graph.lock:
+            costs, margins = graph.simulate(shocks)
+            return [
+                {
+                    "id": recipe_id,
+                    "name": graph.recipe_names[r],
+                    "sale_price": float(graph.sale_prices[r]),
+                    "total_cost": float(graph.costs[r]),
+                    "margin": float(graph.margins[r]),
+                    "simulated_cost": float(costs[r]),
+                    "simulated_margin": float(margins[r]),
+                    "cost_delta": float(costs[r] - graph.costs[r])
+                }
+                for r, recipe_id in enumerate(graph.recipe_ids)
+            ]
+
+# Singleton instance
+recipe_cost_cache = RecipeCostCache()
+
+def load_rows(db: Session, company_id: str) -> list:
+    """Every recipe with its items and their product prices, in one query."""
+    return db.query(
+        models.Recipe.id, models.Recipe.name, models.Recipe.sale_price,
+        models.RecipeItem.id, models.RecipeItem.product_id, models.RecipeItem.quantity,
+        models.Product.name, models.Product.unit, models.Product.last_price
+    ).outerjoin(
+        models.RecipeItem, models.RecipeItem.recipe_id == models.Recipe.id
+    ).outerjoin(
+        models.Product, models.Product.id == models.RecipeItem.product_id
+    ).filter(
+        models.Recipe.company_id == company_id
+    ).order_by(models.Recipe.created_at, models.Recipe.id, models.RecipeItem.id).all()
+
+def _track_cost_changes(session: Session, flush_context):
+    """
+    after_flush hook: collects price patches and structural changes per company.
+    They are applied to the cache on commit and discarded on rollback.
+    """
+    pending = session.info.setdefault("recipe_cost_changes", {"prices": {}, "companies": set()})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, models.Recipe):
+            pending["companies"].add(obj.company_id)
+        elif isinstance(obj, models.RecipeItem):
+            # RecipeItem has no company_id. Unknown recipe -> every graph is dropped
+            with session.no_autoflush:
+                recipe = session.get(models.Recipe, obj.recipe_id) if obj.recipe_id else None
+            pending["companies"].add(recipe.company_id if recipe is not None else None)
+        elif isinstance(obj, models.Product):
+            state = inspect(obj)
+            if obj in session.dirty and not state.attrs.name.history.has_changes() \
+                    and not state.attrs.unit.history.has_changes():
+                if state.attrs.last_price.history.has_changes():
+                    pending["prices"].setdefault(obj.company_id, {})[obj.id] = obj.last_price
+            else:
+                pending["companies"].add(obj.company_id)
+
+def _apply_cost_changes(session: Session):
+    pending = session.info.pop("recipe_cost_changes", None)
+    if not pending:
+        return
+    if None in pending["companies"]:
+        recipe_cost_cache.invalidate(publish=True)
+        return
+    for company_id in pending["companies"]:
+        recipe_cost_cache.invalidate(company_id, publish=True)
+    for company_id, new_prices in pending["prices"].items():
+        if company_id not in pending["companies"]:
+            recipe_cost_cache.update_prices(company_id, new_prices)
+
+def _discard_cost_changes(session: Session, previous_transaction):
+    """
+    The flushed changes were rolled back, so the cache still matches the database,
+    unless an outer transaction keeps some of them (savepoints): drop those graphs.
+    """
+    pending = session.info.pop("recipe_cost_changes", None)
+    if not pending:
+        return
+    companies = pending["companies"] | set(pending["prices"])
+    if None in companies:
+        recipe_cost_cache.invalidate(publish=True)
+        return
+    for company_id in companies:
+        recipe_cost_cache.invalidate(company_id, publish=True)
+
+event.listen(Session, "after_flush", _track_cost_changes)
+event.listen(Session, "after_commit", _apply_cost_changes)
+event.listen(Session, "after_soft_rollback", _discard_cost_changes)
@@ -1,5 +1,6 @@
 from fpdf import FPDF
 from datetime import datetime
+import io
 import os
 
 class CleanReport(FPDF):
@@ -13,13 +14,13 @@ class CleanReport(FPDF):
         self.set_font('Helvetica', 'I', 8)
         self.cell(0, 10, f'Generado por RestaurantPilot - {datetime.now().strftime("%d/%m/%Y %H:%M")}', align='C')
 
-def generate_clearance_act(data: dict, signature_uri: str) -> bytes:
+def generate_clearance_act(data: dict, signature_uri) -> bytes:
     """
     Generates a PDF clearance act for the daily closure using FPDF2.
     
     Args:
         data (dict): Dictionary containing closure details.
-        signature_uri (str): Path or URI to the signature image.
+        signature_uri (str | bytes): Path or URI to the signature image, or the image bytes.
         
     Returns:
         bytes: PDF content in bytes
@@ -111,9 +112,16 @@ def generate_clearance_act(data: dict, signature_uri: str) -> bytes:
     pdf.ln(5)
 
     # Signature Image
-    # Clean URI to Path
-    sig_path = signature_uri
-    if sig_path.startswith("file:///"):
+    if isinstance(signature_uri, (bytes, bytearray)):
+        # Uploaded signature passed straight through, no temp file on disk
+        x_center = (210 - 60) / 2 # A4 width approx 210mm
+        pdf.image(io.BytesIO(signature_uri), x=x_center, w=60)
+        pdf.ln(2)
+        sig_path = None
+    else:
+        # Clean URI to Path
+        sig_path = signature_uri
+    if sig_path and sig_path.startswith("file:///"):
         # file:///C:/path -> C:/path (Windows specific handling usually needs care)
         # On Windows standard: file:///C:/Users...
         # We can use os.path.abspath if it was passed clean, or strip prefix.
@@ -121,7 +129,9 @@ def generate_clearance_act(data: dict, signature_uri: str) -> bytes:
         sig_path = sig_path.replace("file:///", "").replace("file://", "")
     
     # Check existence
-    if os.path.exists(sig_path):
+    if sig_path is None:
+        pass
+    elif os.path.exists(sig_path):
         x_center = (210 - 60) / 2 # A4 width approx 210mm
         pdf.image(sig_path, x=x_center, w=60)
         pdf.ln(2)
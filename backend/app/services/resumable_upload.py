@@ -0,0 +1,96 @@
+import os
+import base64
+import logging
+from urllib.parse import urljoin
+import httpx
+
+from .storage_backends import read_chunks, UPLOAD_CHUNK_BYTES
+
+logger = logging.getLogger(__name__)
+
+TUS_VERSION = "1.0.0"
+# Times a chunk is resumed (HEAD for the server's offset, then PATCH the rest) before giving up
+UPLOAD_RESUME_RETRIES = int(os.getenv("UPLOAD_RESUME_RETRIES", "3"))
+
+def encode_metadata(values: dict) -> str:
+    """TUS Upload-Metadata: comma separated `key base64(value)` pairs."""
+    return ",".join(
+        f"{key} {base64.b64encode(value.encode('utf-8')).decode('ascii')}"
+        for key, value in values.items() if value is not None
+    )
+
+class ResumableUploader:
+    """
+    TUS 1.0 client, the protocol behind Supabase Storage resumable uploads.
+    The upload is created with one POST and filled with one PATCH per chunk read
+    from the stream, so at most two chunks are in memory. When a PATCH fails the
+    server is asked how much it kept (HEAD) and only the rest of the chunk is resent.
+    """
+    def __init__(self, session: httpx.Client, endpoint: str, headers: dict, chunk_size: int = None, retries: int = None):
+        self.session = session
+        self.endpoint = endpoint
+        self.headers = {**headers, "Tus-Resumable": TUS_VERSION}
+        self.chunk_size = chunk_size or UPLOAD_CHUNK_BYTES
+        self.retries = UPLOAD_RESUME_RETRIES if retries is None else retries
+        self.resumes = 0
+
+    def create(self, metadata: dict, size: int = None, upsert: bool = False) -> str:
+        headers = {**self.headers, "Upload-Metadata": encode_metadata(metadata)}
+        if size is None:
+            # Length sent with the last chunk
+            headers["Upload-Defer-Length"] = "1"
+        else:
+            headers["Upload-Length"] = str(size)
+        if upsert:
+            headers["x-upsert"] = "true"
+        response = self.session.post(self.endpoint, headers=headers)
+        response.raise_for_status()
+        return urljoin(self.endpoint, response.headers["Location"])
+
+    def offset(self, location: str) -> int:
+        response = self.session.head(location, headers=self.headers)
+        response.raise_for_status()
+        return int(response.headers["Upload-Offset"])
+
+    def _patch(self, location: str, offset: int, data: bytes, length: int = None) -> int:
+        headers = {**self.headers, "Upload-Offset": str(offset), "Content-Type": "application/offset+octet-stream"}
+        if length is not None:
+            headers["Upload-Length"] = str(length)
+        response = self.session.patch(location, headers=headers, content=data)
+        response.raise_for_status()
+        return int(response.headers["Upload-Offset"])
+
+    def send_chunk(self, location: str, offset: int, chunk: bytes, length: int = None) -> int:
+        """PATCHes `chunk` at `offset`, resuming from the server's offset on failure. Returns the new offset."""
+        end = offset + len(chunk)
+        sent = offset
+        for attempt in range(self.retries + 1):
+            try:
+                return self._patch(location, sent, chunk[sent - offset:], length)
+            except httpx.HTTPError as e:
+                if attempt == self.retries:
+                    raise
+                self.resumes += 1
+                logger.warning(f"Resumable upload chunk at {offset} failed ({e}), resuming")
+                sent = self.offset(location)
+                if not offset <= sent <= end:
+                    raise RuntimeError(f"Server offset {sent} outside the chunk being sent ({offset}-{end})")
+                if sent == end:
+                    return sent
+
+    def upload(self, stream, metadata: dict, size: int = None, first_chunk: bytes = b"", upsert: bool = False) -> int:
+        """
+        Sends `first_chunk` (already read by the caller) followed by the rest of the
+        stream. Returns the bytes uploaded.
+        """
+        location = self.create(metadata, size, upsert)
+        chunks = read_chunks(stream, self.chunk_size)
+        chunk = first_chunk or next(chunks, b"")
+        offset = 0
+        while chunk:
+            following = next(chunks, b"")
+            # With a deferred length, the last PATCH declares the total
+            length = offset + len(chunk) if size is None and not following else None
+            offset = self.send_chunk(location, offset, chunk, length)
+            chunk = following
+        return offset
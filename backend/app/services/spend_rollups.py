@@ -0,0 +1,219 @@
+import logging
+import calendar
+from datetime import datetime, date
+from sqlalchemy import event, select, func, case, literal, extract
+from sqlalchemy.orm import Session
+
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# Rollup key columns are NOT NULL (they form the primary key): missing category/provider is stored as ''
+NONE_KEY = ""
+
+REJECTED = models.PurchaseStatus.REJECTED.value
+
+_TRACKED_FIELDS = ("company_id", "date", "category", "provider_id", "amount", "status")
+
+def _key(company_id, day, category, provider_id):
+    return (company_id, day, category or NONE_KEY, provider_id or NONE_KEY)
+
+def _add(deltas: dict, values: dict, sign: int):
+    """Accumulates one purchase (+1) or its removal (-1) into `deltas`."""
+    if not values.get("company_id") or not values.get("date"):
+        return
+    key = _key(values["company_id"], values["date"], values.get("category"), values.get("provider_id"))
+    amount = (values.get("amount") or 0) * sign
+    rejected = values.get("status") == REJECTED
+    total, count, rejected_amount, rejected_count = deltas.get(key, (0.0, 0, 0.0, 0))
+    deltas[key] = (
+        total + amount,
+        count + sign,
+        rejected_amount + (amount if rejected else 0),
+        rejected_count + (sign if rejected else 0)
+    )
+
+def _current_values(purchase: models.Purchase) -> dict:
+    values = {field: getattr(purchase, field) for field in _TRACKED_FIELDS}
+    # Column default, applied at INSERT time
+    values["status"] = values["status"] or models.PurchaseStatus.DRAFT.value
+    return values
+
+def _track_purchase_changes(session: Session, flush_context, instances):
+    """
+    before_flush hook: turns every Purchase insert/update/delete in this flush into
+    rollup deltas, applied in the same transaction. Old values are read from the DB
+    (still unchanged before the flush), so partially loaded objects are handled too.
+    """
+    new = [obj for obj in session.new if isinstance(obj, models.Purchase)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, models.Purchase)]
+    dirty = [
+        obj for obj in session.dirty
+        if isinstance(obj, models.Purchase) and session.is_modified(obj, include_collections=False)
+    ]
+    if not (new or deleted or dirty):
+        return
+
+    deltas = {}
+    for purchase in new:
+        _add(deltas, _current_values(purchase), +1)
+
+    previous_ids = [p.id for p in deleted + dirty if p.id]
+    if previous_ids:
+        columns = [getattr(models.Purchase, field) for field in _TRACKED_FIELDS]
+        with session.no_autoflush:
+            rows = session.execute(
+                select(models.Purchase.id, *columns).where(models.Purchase.id.in_(previous_ids))
+            ).all()
+        previous = {row[0]: dict(zip(_TRACKED_FIELDS, row[1:])) for row in rows}
+        for purchase in deleted:
+            if purchase.id in previous:
+                _add(deltas, previous[purchase.id], -1)
+        for purchase in dirty:
+            if purchase.id in previous:
+                _add(deltas, previous[purchase.id], -1)
+                _add(deltas, _current_values(purchase), +1)
+
+    apply_deltas(session, deltas)
+
+def apply_deltas(session: Session, deltas: dict):
+    """Atomic `INSERT ... ON CONFLICT DO UPDATE SET x = x + delta` per touched rollup row."""
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+
+    table = models.SpendRollup.__table__
+    now = datetime.utcnow()
+    for (company_id, day, category, provider_id), (total, count, rejected_amount, rejected_count) in deltas.items():
+        if not (total or count or rejected_amount or rejected_count):
+            continue
+        stmt = insert(table).values(
+            company_id=company_id, day=day, category=category, provider_id=provider_id,
+            total_amount=total, purchase_count=count,
+            rejected_amount=rejected_amount, rejected_count=rejected_count,
+            updated_at=now
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["company_id", "day", "category", "provider_id"],
+            set_={
+                "total_amount": table.c.total_amount + stmt.excluded.total_amount,
+                "purchase_count": table.c.purchase_count + stmt.excluded.purchase_count,
+                "rejected_amount": table.c.rejected_amount + stmt.excluded.rejected_amount,
+                "rejected_count": table.c.rejected_count + stmt.excluded.rejected_count,
+                "updated_at": now
+            }
+        )
+        with session.no_autoflush:
+            session.execute(stmt)
+
+event.listen(Session, "before_flush", _track_purchase_changes)
+
+def window_start(months: int, today: date = None) -> date:
+    """First day of the month `months - 1` months before today's (months=1 -> this month)."""
+    today = today or date.today()
+    index = today.year * 12 + (today.month - 1) - (max(months, 1) - 1)
+    return date(index // 12, index % 12 + 1, 1)
+
+def provider_trends(db: Session, company_id: str, months: int, unknown_name: str = "Unknown") -> list:
+    """
+    Monthly spend per provider over the last `months` calendar months, pivoted as
+    [{"month": "Jan 2024", "<provider>": amount, ...}] in chronological order.
+    Buckets are computed in SQL over the rollup, bounded by an indexed (company_id, day) predicate.
+    """
+    year_col = extract("year", models.SpendRollup.day)
+    month_col = extract("month", models.SpendRollup.day)
+    provider_col = func.coalesce(models.Provider.name, unknown_name)
+    rows = db.query(
+        year_col, month_col, provider_col, func.sum(models.SpendRollup.total_amount)
+    ).outerjoin(
+        models.Provider, models.Provider.id == models.SpendRollup.provider_id
+    ).filter(
+        models.SpendRollup.company_id == company_id,
+        models.SpendRollup.day >= window_start(months),
+        models.SpendRollup.provider_id != NONE_KEY  # Only linked purchases
+    ).group_by(year_col, month_col, provider_col).order_by(year_col, month_col).all()
+
+    series = {}
+    for year, month, provider_name, amount in rows:
+        key = f"{calendar.month_abbr[int(month)]} {int(year)}" # e.g. "Jan 2024"
+        bucket = series.setdefault(key, {"month": key})
+        bucket[provider_name] = bucket.get(provider_name, 0) + (amount or 0)
+    return list(series.values())
+
+def _grouped_purchases(company_id: str = None):
+    """Source of truth: the rollup recomputed from raw purchases."""
+    amount = func.coalesce(models.Purchase.amount, 0)
+    is_rejected = models.Purchase.status == REJECTED
+    query = select(
+        models.Purchase.company_id,
+        models.Purchase.date,
+        func.coalesce(models.Purchase.category, literal(NONE_KEY)),
+        func.coalesce(models.Purchase.provider_id, literal(NONE_KEY)),
+        func.sum(amount),
+        func.count(models.Purchase.id),
+        func.sum(case((is_rejected, amount), else_=0)),
+        func.sum(case((is_rejected, 1), else_=0))
+    ).group_by(
+        models.Purchase.company_id,
+        models.Purchase.date,
+        func.coalesce(models.Purchase.category, literal(NONE_KEY)),
+        func.coalesce(models.Purchase.provider_id, literal(NONE_KEY))
+    )
+    if company_id:
+        query = query.where(models.Purchase.company_id == company_id)
+    return query
+
+def rebuild(db: Session, company_id: str = None) -> int:
+    """Backfill: replaces the rollup rows (of one company, or all) with a fresh GROUP BY. Commits."""
+    delete = db.query(models.SpendRollup)
+    if company_id:
+        delete = delete.filter(models.SpendRollup.company_id == company_id)
+    delete.delete(synchronize_session=False)
+
+    now = datetime.utcnow()
+    rows = [
+        {
+            "company_id": row[0], "day": row[1], "category": row[2], "provider_id": row[3],
+            "total_amount": row[4] or 0, "purchase_count": row[5],
+            "rejected_amount": row[6] or 0, "rejected_count": row[7] or 0,
+            "updated_at": now
+        }
+        for row in db.execute(_grouped_purchases(company_id))
+    ]
+    if rows:
+        db.execute(models.SpendRollup.__table__.insert(), rows)
+    db.commit()
+    logger.info(f"Rebuilt {len(rows)} spend rollup rows")
+    return len(rows)
+
+def check_consistency(db: Session, company_id: str = None, tolerance: float = 0.01) -> list:
+    """
+    Compares the rollup with the raw purchases. Returns one dict per mismatching key
+    (empty list when consistent). Rows that net to zero count as absent.
+    """
+    def as_map(rows):
+        return {
+            tuple(row[:4]): (float(row[4] or 0), int(row[5] or 0), float(row[6] or 0), int(row[7] or 0))
+            for row in rows if row[5] or row[4]
+        }
+
+    expected = as_map(db.execute(_grouped_purchases(company_id)))
+    query = db.query(
+        models.SpendRollup.company_id, models.SpendRollup.day,
+        models.SpendRollup.category, models.SpendRollup.provider_id,
+        models.SpendRollup.total_amount, models.SpendRollup.purchase_count,
+        models.SpendRollup.rejected_amount, models.SpendRollup.rejected_count
+    )
+    if company_id:
+        query = query.filter(models.SpendRollup.company_id == company_id)
+    actual = as_map(query.all())
+
+    mismatches = []
+    for key in sorted(set(expected) | set(actual), key=str):
+        want = expected.get(key, (0.0, 0, 0.0, 0))
+        got = actual.get(key, (0.0, 0, 0.0, 0))
+        if any(abs(w - g) > tolerance for w, g in zip(want, got)):
+            mismatches.append({"key": key, "expected": want, "actual": got})
+    return mismatches
@@ -1,201 +1,173 @@
 import os
 import time
-from datetime import datetime
-from supabase import create_client, Client, ClientOptions
+from supabase import create_client, Client
 from fastapi import UploadFile, HTTPException
 import logging
 from jose import jwt
+from .storage_pool import StorageClientPool
+from .storage_backends import StorageBackend, LocalStorageBackend, S3StorageBackend, UPLOAD_CHUNK_BYTES
+from .resumable_upload import ResumableUploader
 
 logger = logging.getLogger(__name__)
 
-class SupabaseStorageService:
+# supabase | s3 | local. Unset: supabase when SUPABASE_URL/SUPABASE_KEY are set, else local
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "")
+
+class SupabaseStorageService(StorageBackend):
+    name = "supabase"
+
     def __init__(self):
+        super().__init__()
         self.url = os.getenv("SUPABASE_URL")
         self.key = os.getenv("SUPABASE_KEY")
         
         if not self.url or not self.key:
             logger.warning("SUPABASE_URL or SUPABASE_KEY not set. Storage service will fail.")
             self.client = None
+            self.pool = None
         else:
             self.client: Client = create_client(self.url, self.key)
+            # System and user-scoped clients are reused and share one keep-alive connection pool
+            self.pool = StorageClientPool(self.url, self.key, jwt_secret=os.getenv("SUPABASE_JWT_SECRET"))
             
         self.bucket = "receipts"
 
-    def upload_file(self, file: UploadFile, company_id: str, file_type: str = "receipt", token: str = None) -> dict:
-        """
-        Uploads a file to Supabase Storage.
-        Structure: {company_id}/{year}/{month}/{timestamp}_{filename}
-        """
-        if not self.client:
-            # DEV MOCK: Return local/mock path if storage not configured
-            timestamp = int(time.time())
-            filename = "".join(c for c in file.filename if c.isalnum() or c in "._-")
-            mock_path = f"mock/{company_id}/{timestamp}_{filename}"
-            return {
-                "storage_path": mock_path,
-                "bucket": self.bucket,
-                "filename": filename,
-                "content_type": file.content_type,
-                "size": 0
-            }
-
-        # Determine which client to use (Anon/Service or User Scoped)
-        active_client = self.client
-        if token:
-            # DEV FIX: If using the fake frontend token, generate a REAL signed token for Supabase
-            if token == "fake-jwt-token-for-auth":
-                try:
-                    secret = os.getenv("SUPABASE_JWT_SECRET")
-                    if secret:
-                        payload = {
-                            "aud": "authenticated",
-                            "exp": int(time.time()) + 3600,
-                            "sub": "e9821814-c159-42b7-8742-167812035978",
-                            "email": "guide@reportpilot.com",
-                            "role": "authenticated"
-                        }
-                        token = jwt.encode(payload, secret, algorithm="HS256")
-                        logger.info("Generated dev JWT for Supabase storage")
-                except Exception as e:
-                    logger.error(f"Failed to sign dev token: {e}")
-
+    def _user_token(self, token: str) -> str:
+        # DEV FIX: If using the fake frontend token, generate a REAL signed token for Supabase
+        if token == "fake-jwt-token-for-auth":
             try:
-                # Create a temporary client with the user's token headers to bypass RLS via Auth
-                active_client = create_client(
-                    self.url, 
-                    self.key, 
-                    options=ClientOptions(headers={"Authorization": f"Bearer {token}"})
-                )
+                secret = os.getenv("SUPABASE_JWT_SECRET")
+                if secret:
+                    payload = {
+                        "aud": "authenticated",
+                        "exp": int(time.time()) + 3600,
+                        "sub": "e9821814-c159-42b7-8742-167812035978",
+                        "email": "guide@reportpilot.com",
+                        "role": "authenticated"
+                    }
+                    token = jwt.encode(payload, secret, algorithm="HS256")
+                    logger.info("Generated dev JWT for Supabase storage")
             except Exception as e:
-                logger.error(f"Failed to create scoped client: {e}")
-                # Fallback to default client
-                active_client = self.client
+                logger.error(f"Failed to sign dev token: {e}")
+        return token
 
+    def _user_client(self, token: str):
+        """Anon/Service client, or one scoped with the user's token headers to pass RLS (pooled per token)"""
+        if not token:
+            return self.client
         try:
-            # Generate path
-            now = datetime.now()
-            year = now.strftime("%Y")
-            month = now.strftime("%m")
-            timestamp = int(time.time())
-            
-            # Sanitize filename
-            filename = "".join(c for c in file.filename if c.isalnum() or c in "._-")
-            file_path = f"{company_id}/{year}/{month}/{timestamp}_{filename}"
-            
-            # Read file content
-            file_content = file.file.read()
-            
-            # Upload
-            active_client.storage.from_(self.bucket).upload(
-                file=file_content,
-                path=file_path,
-                file_options={"content-type": file.content_type}
-            )
-            
-            # Get public URL (or signed URL if private)
-            # For this implementation we assume private bucket and generate signed URLs on retrieval, 
-            # but for simplicity in MVP we might use public URL if bucket is public.
-            # Let's assume we want secure access:
-            
-            return {
-                "storage_path": file_path,
-                "bucket": self.bucket,
-                "filename": filename,
-                "content_type": file.content_type,
-                "size": len(file_content)
-            }
-            
+            return self.pool.user_client(token)
         except Exception as e:
-            logger.error(f"Failed to upload file to Supabase: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"File upload failed: {str(e)}")
+            logger.error(f"Failed to create scoped client: {e}")
+            # Fallback to default client
+            return self.client
 
-    def upload_bytes(self, file_content: bytes, filename: str, content_type: str, company_id: str) -> dict:
-        """Uploads raw bytes to Supabase Storage"""
+    def upload_file(self, file: UploadFile, company_id: str, file_type: str = "receipt", token: str = None) -> dict:
+        """
+        Streams a file to Supabase Storage.
+        Structure: {company_id}/{year}/{month}/{timestamp}_{random}_{filename}
+        """
         if not self.client:
-            # Return Mock if no client
-            return {"storage_path": f"local/{filename}", "file_url": f"/mock/{filename}"}
+            raise HTTPException(status_code=503, detail="Supabase storage is not configured")
+        return super().upload_file(file, company_id, file_type, token=token)
 
-        try:
-            # Generate path
-            now = datetime.now()
-            year = now.strftime("%Y")
-            month = now.strftime("%m")
-            timestamp = int(time.time())
-            
-            # Sanitize filename
-            safe_filename = "".join(c for c in filename if c.isalnum() or c in "._-")
-            file_path = f"{company_id}/{year}/{month}/{timestamp}_{safe_filename}"
-            
-            # Upload
-            self.client.storage.from_(self.bucket).upload(
+    def put_stream(self, path: str, stream, content_type: str, size: int = None, token: str = None) -> dict:
+        """
+        Files that fit in one chunk go up in a single request; larger ones through the
+        TUS resumable endpoint, one UPLOAD_CHUNK_BYTES PATCH at a time.
+        """
+        if not self.client:
+            raise RuntimeError("Supabase storage is not configured")
+        token = self._user_token(token) if token else None
+        with self._timed("put") as meter:
+            chunk = stream.read(UPLOAD_CHUNK_BYTES)
+            if len(chunk) < UPLOAD_CHUNK_BYTES:
+                self._user_client(token).storage.from_(self.bucket).upload(
+                    file=chunk,
+                    path=path,
+                    file_options={"content-type": content_type}
+                )
+                meter["bytes"] = len(chunk)
+            else:
+                uploader = ResumableUploader(
+                    self.pool.session(), f"{self.pool.storage_url}/upload/resumable", self.pool.headers(token)
+                )
+                meter["bytes"] = uploader.upload(
+                    stream,
+                    {"bucketName": self.bucket, "objectName": path, "contentType": content_type},
+                    size=size,
+                    first_chunk=chunk
+                )
+        return {
+            "storage_path": path,
+            "bucket": self.bucket,
+            "filename": os.path.basename(path),
+            "content_type": content_type,
+            "size": meter["bytes"]
+        }
+
+    def put_bytes(self, path: str, file_content: bytes, content_type: str) -> dict:
+        """Server-side write at an exact path (upsert), with the service_role client"""
+        client = self.get_system_client()
+        if client is None:
+            raise RuntimeError("Supabase storage is not configured")
+        with self._timed("put", len(file_content)):
+            client.storage.from_(self.bucket).upload(
                 file=file_content,
-                path=file_path,
-                file_options={"content-type": content_type}
+                path=path,
+                file_options={"content-type": content_type, "upsert": "true"}
             )
-            
-            return {
-                "storage_path": file_path,
-                "bucket": self.bucket,
-                "filename": safe_filename,
-                "content_type": content_type,
-                "size": len(file_content)
-            }
-        except Exception as e:
-            logger.error(f"Failed to upload bytes to Supabase: {str(e)}")
-            # Return mock on failure to avoid blocking flow
-            return {"storage_path": f"failed_upload/{filename}", "error": str(e)}
+        return {
+            "storage_path": path,
+            "bucket": self.bucket,
+            "filename": os.path.basename(path),
+            "content_type": content_type,
+            "size": len(file_content)
+        }
 
-    def get_system_client(self) -> Client:
-        """Creates a client with service_role privileges for background tasks"""
+    def get_system_client(self):
+        """Long-lived client with service_role privileges for background tasks (JWT re-signed before expiry)"""
         if not self.url or not self.key:
              return None
         
         try:
-            secret = os.getenv("SUPABASE_JWT_SECRET")
-            if not secret:
-                logger.error("SUPABASE_JWT_SECRET not set, cannot create system client")
-                return self.client
-
-            payload = {
-                "aud": "authenticated", 
-                "exp": int(time.time()) + 3600,
-                "sub": "system-worker",
-                "role": "service_role"
-            }
-            token = jwt.encode(payload, secret, algorithm="HS256")
-            
-            return create_client(
-                self.url,
-                self.key,
-                options=ClientOptions(headers={"Authorization": f"Bearer {token}"})
-            )
+            return self.pool.system_client()
         except Exception as e:
             logger.error(f"Failed to create system client: {e}")
             return self.client
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["pool"] = self.pool.stats() if self.pool else {}
+        return stats
             
     def get_file_url(self, file_path: str, expires_in: int = 3600) -> str:
         """Generates a signed URL for a file"""
         if not self.client:
             return ""
             
-        try:
-            response = self.client.storage.from_(self.bucket).create_signed_url(file_path, expires_in)
-            # Supabase returns dict usually {'signedURL': '...'}
-            if isinstance(response, dict) and "signedURL" in response:
-                return response["signedURL"]
-            return str(response)
-        except Exception as e:
-            logger.error(f"Failed to generate signed URL: {str(e)}")
-            return ""
+        # Server-written objects (exports) may be outside what RLS lets the anon key sign
+        for client in (self.client, self.get_system_client()):
+            try:
+                response = client.storage.from_(self.bucket).create_signed_url(file_path, expires_in)
+                # Supabase returns dict usually {'signedURL': '...'}
+                if isinstance(response, dict) and "signedURL" in response:
+                    return response["signedURL"]
+                return str(response)
+            except Exception as e:
+                logger.error(f"Failed to generate signed URL: {str(e)}")
+        return ""
 
     def download_file(self, file_path: str) -> bytes:
-        """Downloads a file from storage and returns bytes"""
-        if not self.client:
+        """Downloads a file from storage and returns bytes (service_role: callers already checked the tenant)"""
+        client = self.get_system_client()
+        if not client:
             return None
         try:
-            # Supabase Python client download
             # StorageObject.download returns bytes
-            content = self.client.storage.from_(self.bucket).download(file_path)
+            with self._timed("get") as meter:
+                content = client.storage.from_(self.bucket).download(file_path)
+                meter["bytes"] = len(content or b"")
             return content
         except Exception as e:
             logger.error(f"Failed to download file from Supabase: {str(e)}")
@@ -213,5 +185,20 @@ class SupabaseStorageService:
             logger.error(f"Failed to delete file: {str(e)}")
             return False
 
+def create_storage_service(backend: str = None) -> StorageBackend:
+    """Storage driver selected by STORAGE_BACKEND. Every file write in the app goes through it."""
+    backend = (backend or STORAGE_BACKEND).lower()
+    if not backend:
+        backend = "supabase" if os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY") else "local"
+        if backend == "local":
+            logger.warning("SUPABASE_URL or SUPABASE_KEY not set. Storing files on local disk.")
+    if backend == "supabase":
+        return SupabaseStorageService()
+    if backend == "s3":
+        return S3StorageBackend()
+    if backend == "local":
+        return LocalStorageBackend()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
 # Singleton instance
-storage_service = SupabaseStorageService()
+storage_service = create_storage_service()
@@ -0,0 +1,380 @@
+import io
+import os
+import time
+import uuid
+import hashlib
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+from fastapi import UploadFile, HTTPException
+
+logger = logging.getLogger(__name__)
+
+# Local driver: files live under this directory, served by the /uploads static mount
+STORAGE_LOCAL_ROOT = os.getenv("STORAGE_LOCAL_ROOT", "uploads/files")
+STORAGE_LOCAL_URL_PREFIX = os.getenv("STORAGE_LOCAL_URL_PREFIX", "/uploads/files")
+# S3-compatible driver (AWS S3, MinIO, R2...): S3_ENDPOINT_URL empty means AWS
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "")
+S3_BUCKET = os.getenv("S3_BUCKET", "receipts")
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID", "")
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY", "")
+# Uploads are rejected with 413 as soon as they pass this many bytes
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+# Closure and tour signatures are embedded in the clearance PDF, so they are read back into memory
+SIGNATURE_MAX_BYTES = int(os.getenv("SIGNATURE_MAX_BYTES", str(2 * 1024 * 1024)))
+# Bytes per storage request when streaming. Supabase resumable uploads require exactly 6MB,
+# S3 multipart parts must be at least 5MB
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(6 * 1024 * 1024)))
+SNIFF_BYTES = 2048
+
+# Leading bytes of the formats receipts come in
+MIME_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"%PDF-", "application/pdf"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"PK\x03\x04", "application/zip"),
+)
+HEIF_BRANDS = (b"heic", b"heix", b"heim", b"heis", b"mif1", b"msf1")
+
+def safe_filename(filename: str) -> str:
+    return "".join(c for c in (filename or "") if c.isalnum() or c in "._-") or "file"
+
+def make_key(company_id: str, filename: str) -> str:
+    """Object key: {company_id}/{year}/{month}/{timestamp}_{random}_{filename}."""
+    now = datetime.now()
+    return f"{company_id}/{now.strftime('%Y')}/{now.strftime('%m')}/{int(time.time())}_{uuid.uuid4().hex[:8]}_{safe_filename(filename)}"
+
+def sniff_mime(head: bytes) -> str:
+    """MIME type from the first bytes of a file, or None when the format is not recognised."""
+    for signature, mime in MIME_SIGNATURES:
+        if head.startswith(signature):
+            return mime
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp" and head[8:12] in HEIF_BRANDS:
+        return "image/heic"
+    return None
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=413, detail=f"File too large (max {max_bytes} bytes)")
+
+class UploadStream:
+    """
+    File-like reader over an upload (UploadFile.file, a zip member...) that hashes,
+    counts and sniffs what passes through it, so drivers can send it to storage chunk
+    by chunk in a single pass. Raises UploadTooLarge as soon as `max_bytes` is passed,
+    or up front when the declared size is already over.
+    """
+    def __init__(self, source, declared_type: str = None, max_bytes: int = None, size: int = None):
+        self.source = source
+        self.declared_type = declared_type
+        self.max_bytes = UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+        if size is not None and size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._head = None
+        self._pending = b""
+        self._sniffed = None
+
+    def _pull(self, n: int) -> bytes:
+        data = self.source.read(n)
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(self.max_bytes)
+        self._hash.update(data)
+        return data
+
+    def _peek(self):
+        if self._head is None:
+            self._head = self._pending = self._pull(SNIFF_BYTES)
+            self._sniffed = sniff_mime(self._head)
+
+    def read(self, n: int = -1) -> bytes:
+        """Up to n bytes (everything left if n < 0); short only at the end of the stream."""
+        self._peek()
+        take = len(self._pending) if n < 0 else min(n, len(self._pending))
+        out = bytearray(self._pending[:take])
+        self._pending = self._pending[take:]
+        while n < 0 or len(out) < n:
+            data = self._pull(UPLOAD_CHUNK_BYTES if n < 0 else n - len(out))
+            if not data:
+                break
+            out += data
+        return bytes(out)
+
+    @property
+    def content_type(self) -> str:
+        """Sniffed type, falling back to what the client declared."""
+        self._peek()
+        return self._sniffed or self.declared_type or "application/octet-stream"
+
+    def summary(self) -> dict:
+        """Size, sha256 and type of what has been read so far (the whole file once drained)."""
+        return {"size": self.size, "sha256": self._hash.hexdigest(), "content_type": self.content_type}
+
+def read_chunks(stream, chunk_size: int = None):
+    chunk_size = chunk_size or UPLOAD_CHUNK_BYTES
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+class StorageBackend(ABC):
+    """
+    What the app needs from object storage. Drivers must implement put_bytes, put_stream,
+    download_file, get_file_url and delete_file (a driver missing one cannot be
+    instantiated); uploads share the key layout and per-operation timing stats
+    (GET /health/storage) so backends can be compared.
+    """
+    name = "base"
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._ops = {}
+
+    @contextmanager
+    def _timed(self, op: str, size: int = 0):
+        """Times one operation; set meter["bytes"] inside the block when the size is only known after."""
+        meter = {"bytes": size}
+        started = time.perf_counter()
+        try:
+            yield meter
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._stats_lock:
+                count, total_bytes, seconds = self._ops.get(op, (0, 0, 0.0))
+                self._ops[op] = (count + 1, total_bytes + meter["bytes"], seconds + elapsed)
+
+    @abstractmethod
+    def put_bytes(self, path: str, file_content: bytes, content_type: str) -> dict:
+        """Writes `file_content` at exactly `path`, replacing any previous object."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_stream(self, path: str, stream, content_type: str, size: int = None, token: str = None) -> dict:
+        """
+        Writes a file-like object at `path` reading UPLOAD_CHUNK_BYTES at a time.
+        `size` is the declared length when known; `token` is the end user's JWT for
+        drivers that enforce per-user access.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def download_file(self, file_path: str) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_file_url(self, file_path: str, expires_in: int = 3600) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_file(self, file_path: str) -> bool:
+        raise NotImplementedError
+
+    def upload_bytes(self, file_content: bytes, filename: str, content_type: str, company_id: str) -> dict:
+        """Stores bytes under a new company-scoped key. Never raises: errors come back in the dict."""
+        path = make_key(company_id, filename)
+        try:
+            return self.put_bytes(path, file_content, content_type)
+        except Exception as e:
+            logger.error(f"Failed to upload bytes to {self.name} storage: {e}")
+            return {"storage_path": None, "error": str(e)}
+
+    def upload_stream(self, source, filename: str, content_type: str, company_id: str,
+                      size: int = None, max_bytes: int = None, token: str = None) -> dict:
+        """
+        Streams a file-like object under a new company-scoped key. The result also has
+        the sha256, size and sniffed content_type. Storage errors come back in the dict;
+        an upload over `max_bytes` (default UPLOAD_MAX_BYTES) raises UploadTooLarge.
+        """
+        stream = UploadStream(source, content_type, max_bytes=max_bytes, size=size)
+        path = make_key(company_id, filename)
+        try:
+            stored = self.put_stream(path, stream, stream.content_type, size=size, token=token)
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Failed to stream upload to {self.name} storage: {e}")
+            return {"storage_path": None, "error": str(e)}
+        return {**stored, **stream.summary()}
+
+    def upload_file(self, file: UploadFile, company_id: str, file_type: str = "receipt", token: str = None) -> dict:
+        stored = self.upload_stream(file.file, file.filename, file.content_type, company_id,
+                                    size=getattr(file, "size", None), token=token)
+        if stored.get("storage_path") is None:
+            raise HTTPException(status_code=500, detail=f"File upload failed: {stored['error']}")
+        return stored
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            ops = {
+                op: {
+                    "count": count,
+                    "bytes": total_bytes,
+                    "avg_ms": (seconds / count * 1000) if count else 0.0,
+                    "mb_per_s": (total_bytes / seconds / 1e6) if seconds else 0.0
+                }
+                for op, (count, total_bytes, seconds) in self._ops.items()
+            }
+        return {"backend": self.name, "operations": ops}
+
+class LocalStorageBackend(StorageBackend):
+    """Files on local disk under `root`. For development, tests and single-host deployments."""
+    name = "local"
+
+    def __init__(self, root: str = None, url_prefix: str = None):
+        super().__init__()
+        self.root = os.path.abspath(root or STORAGE_LOCAL_ROOT)
+        self.url_prefix = (url_prefix if url_prefix is not None else STORAGE_LOCAL_URL_PREFIX).rstrip("/")
+        self.bucket = self.root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, file_path: str) -> str:
+        full = os.path.abspath(os.path.join(self.root, file_path))
+        if os.path.commonpath([full, self.root]) != self.root:
+            raise ValueError(f"Path escapes storage root: {file_path}")
+        return full
+
+    def put_bytes(self, path: str, file_content: bytes, content_type: str) -> dict:
+        return self.put_stream(path, io.BytesIO(file_content), content_type)
+
+    def put_stream(self, path: str, stream, content_type: str, size: int = None, token: str = None) -> dict:
+        with self._timed("put") as meter:
+            full = self._path(path)
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            # Write-then-rename: readers never see a half-written file
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(full), prefix=".tmp_")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in read_chunks(stream):
+                        f.write(chunk)
+                        meter["bytes"] += len(chunk)
+                os.replace(tmp, full)
+            except Exception:
+                os.unlink(tmp)
+                raise
+        return {
+            "storage_path": path,
+            "bucket": self.bucket,
+            "filename": os.path.basename(path),
+            "content_type": content_type,
+            "size": meter["bytes"],
+            "file_url": f"{self.url_prefix}/{path}"
+        }
+
+    def download_file(self, file_path: str) -> bytes:
+        try:
+            with self._timed("get") as meter, open(self._path(file_path), "rb") as f:
+                content = f.read()
+                meter["bytes"] = len(content)
+            return content
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read local file {file_path}: {e}")
+            return None
+
+    def get_file_url(self, file_path: str, expires_in: int = 3600) -> str:
+        return f"{self.url_prefix}/{file_path}"
+
+    def delete_file(self, file_path: str) -> bool:
+        try:
+            os.remove(self._path(file_path))
+            return True
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to delete local file {file_path}: {e}")
+            return False
+
+class S3StorageBackend(StorageBackend):
+    """S3-compatible object storage (AWS S3, MinIO, Cloudflare R2) through boto3."""
+    name = "s3"
+
+    def __init__(self, bucket: str = None, endpoint_url: str = None, region: str = None,
+                 access_key_id: str = None, secret_access_key: str = None, client=None):
+        super().__init__()
+        self.bucket = bucket or S3_BUCKET
+        if client is None:
+            import boto3
+            from botocore.config import Config
+            client = boto3.client(
+                "s3",
+                endpoint_url=(endpoint_url if endpoint_url is not None else S3_ENDPOINT_URL) or None,
+                region_name=region or S3_REGION,
+                aws_access_key_id=access_key_id or S3_ACCESS_KEY_ID or None,
+                aws_secret_access_key=secret_access_key or S3_SECRET_ACCESS_KEY or None,
+                # Path-style addressing works with MinIO and any custom endpoint
+                config=Config(s3={"addressing_style": "path"}, retries={"max_attempts": 3})
+            )
+        self.client = client
+
+    def put_bytes(self, path: str, file_content: bytes, content_type: str) -> dict:
+        return self.put_stream(path, io.BytesIO(file_content), content_type)
+
+    def put_stream(self, path: str, stream, content_type: str, size: int = None, token: str = None) -> dict:
+        """One PUT for small files, otherwise a multipart upload of UPLOAD_CHUNK_BYTES parts."""
+        content_type = content_type or "application/octet-stream"
+        with self._timed("put") as meter:
+            chunk = stream.read(UPLOAD_CHUNK_BYTES)
+            if len(chunk) < UPLOAD_CHUNK_BYTES:
+                self.client.put_object(Bucket=self.bucket, Key=path, Body=chunk, ContentType=content_type)
+                meter["bytes"] = len(chunk)
+            else:
+                upload_id = self.client.create_multipart_upload(
+                    Bucket=self.bucket, Key=path, ContentType=content_type
+                )["UploadId"]
+                parts = []
+                try:
+                    # Each part is retried by botocore on its own, a failure does not restart the file
+                    while chunk:
+                        number = len(parts) + 1
+                        part = self.client.upload_part(Bucket=self.bucket, Key=path, UploadId=upload_id,
+                                                       PartNumber=number, Body=chunk)
+                        parts.append({"ETag": part["ETag"], "PartNumber": number})
+                        meter["bytes"] += len(chunk)
+                        chunk = stream.read(UPLOAD_CHUNK_BYTES)
+                    self.client.complete_multipart_upload(Bucket=self.bucket, Key=path, UploadId=upload_id,
+                                                          MultipartUpload={"Parts": parts})
+                except Exception:
+                    self.client.abort_multipart_upload(Bucket=self.bucket, Key=path, UploadId=upload_id)
+                    raise
+        return {
+            "storage_path": path,
+            "bucket": self.bucket,
+            "filename": os.path.basename(path),
+            "content_type": content_type,
+            "size": meter["bytes"]
+        }
+
+    def download_file(self, file_path: str) -> bytes:
+        try:
+            with self._timed("get") as meter:
+                content = self.client.get_object(Bucket=self.bucket, Key=file_path)["Body"].read()
+                meter["bytes"] = len(content)
+            return content
+        except Exception as e:
+            logger.error(f"Failed to download file from S3: {e}")
+            return None
+
+    def get_file_url(self, file_path: str, expires_in: int = 3600) -> str:
+        try:
+            return self.client.generate_presigned_url(
+                "get_object", Params={"Bucket": self.bucket, "Key": file_path}, ExpiresIn=expires_in
+            )
+        except Exception as e:
+            logger.error(f"Failed to generate presigned URL: {e}")
+            return ""
+
+    def delete_file(self, file_path: str) -> bool:
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=file_path)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to delete file from S3: {e}")
+            return False
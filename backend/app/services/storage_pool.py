@@ -0,0 +1,162 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import httpx
+from jose import jwt
+from storage3 import SyncStorageClient
+from storage3.utils import SyncClient
+
+logger = logging.getLogger(__name__)
+
+STORAGE_POOL_MAX_CONNECTIONS = int(os.getenv("STORAGE_POOL_MAX_CONNECTIONS", "20"))
+STORAGE_POOL_KEEPALIVE_SECONDS = int(os.getenv("STORAGE_POOL_KEEPALIVE_SECONDS", "60"))
+STORAGE_POOL_TIMEOUT_SECONDS = int(os.getenv("STORAGE_POOL_TIMEOUT_SECONDS", "20"))
+# User-scoped clients kept around for repeat uploads with the same token
+STORAGE_USER_CLIENTS_MAX = int(os.getenv("STORAGE_USER_CLIENTS_MAX", "256"))
+SYSTEM_TOKEN_TTL_SECONDS = int(os.getenv("SYSTEM_TOKEN_TTL_SECONDS", "3600"))
+# The system JWT is re-signed this long before it expires
+SYSTEM_TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("SYSTEM_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+
+class StorageHandle:
+    """The part of a supabase Client callers use: `handle.storage.from_(bucket)`."""
+    def __init__(self, storage: SyncStorageClient):
+        self.storage = storage
+
+class _PooledStorageClient(SyncStorageClient):
+    """storage3 client whose httpx session sends through the pool's shared transport."""
+    def __init__(self, url: str, headers: dict, transport: httpx.BaseTransport, event_hooks: dict, timeout: int):
+        self._transport = transport
+        self._event_hooks = event_hooks
+        super().__init__(url, headers, timeout)
+
+    def _create_session(self, base_url, headers, timeout, verify=True, proxy=None):
+        # Never closed: closing an httpx client would close the shared transport
+        return SyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            follow_redirects=True,
+            transport=self._transport,
+            event_hooks=self._event_hooks
+        )
+
+class StorageClientPool:
+    """
+    Supabase Storage clients over one keep-alive HTTP connection pool:
+    - a long-lived system (service_role) client whose JWT is re-signed before it expires;
+    - an LRU of user-scoped clients keyed by token hash.
+    Clients differ only in their auth headers; the TCP/TLS connections are shared.
+    """
+    def __init__(self, url: str, key: str, jwt_secret: str = None, transport: httpx.BaseTransport = None,
+                 max_user_clients: int = None):
+        self.storage_url = f"{url.rstrip('/')}/storage/v1"
+        self.key = key
+        self.jwt_secret = jwt_secret
+        self.max_user_clients = STORAGE_USER_CLIENTS_MAX if max_user_clients is None else max_user_clients
+        self.transport = transport or httpx.HTTPTransport(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=STORAGE_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=STORAGE_POOL_MAX_CONNECTIONS,
+                keepalive_expiry=STORAGE_POOL_KEEPALIVE_SECONDS
+            )
+        )
+        self._event_hooks = {"request": [self._trace_request]}
+        self._lock = threading.Lock()
+        self._system = None
+        self._system_expires_at = 0
+        self._session = None
+        self._user_clients = OrderedDict()
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.system_token_refreshes = 0
+        self.user_client_hits = 0
+        self.user_client_misses = 0
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self._count("connections_opened")
+        elif event_name == "connection.start_tls.complete":
+            self._count("tls_handshakes")
+
+    def _trace_request(self, request: httpx.Request):
+        self._count("requests")
+        request.extensions["trace"] = self._trace
+
+    def headers(self, token: str = None) -> dict:
+        return {"apiKey": self.key, "Authorization": f"Bearer {token or self.key}"}
+
+    def _client(self, token: str) -> StorageHandle:
+        return StorageHandle(_PooledStorageClient(
+            self.storage_url, self.headers(token), self.transport, self._event_hooks, STORAGE_POOL_TIMEOUT_SECONDS
+        ))
+
+    def session(self) -> httpx.Client:
+        """Plain httpx client on the shared transport, for endpoints storage3 does not wrap (resumable uploads)."""
+        with self._lock:
+            if self._session is None:
+                self._session = httpx.Client(
+                    transport=self.transport,
+                    event_hooks=self._event_hooks,
+                    timeout=STORAGE_POOL_TIMEOUT_SECONDS
+                )
+            return self._session
+
+    def default_client(self) -> StorageHandle:
+        return self._client(self.key)
+
+    def system_client(self) -> StorageHandle:
+        """Service-role client for background tasks. Falls back to the API key without a JWT secret."""
+        with self._lock:
+            if self._system is not None and time.time() < self._system_expires_at - SYSTEM_TOKEN_REFRESH_MARGIN_SECONDS:
+                return self._system
+            if not self.jwt_secret:
+                logger.error("SUPABASE_JWT_SECRET not set, system client uses the API key")
+                self._system, self._system_expires_at = self.default_client(), float("inf")
+                return self._system
+            expires_at = int(time.time()) + SYSTEM_TOKEN_TTL_SECONDS
+            token = jwt.encode({
+                "aud": "authenticated",
+                "exp": expires_at,
+                "sub": "system-worker",
+                "role": "service_role"
+            }, self.jwt_secret, algorithm="HS256")
+            self._system, self._system_expires_at = self._client(token), expires_at
+            self.system_token_refreshes += 1
+            return self._system
+
+    def user_client(self, token: str) -> StorageHandle:
+        key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        with self._lock:
+            client = self._user_clients.get(key)
+            if client is not None:
+                self._user_clients.move_to_end(key)
+                self.user_client_hits += 1
+                return client
+            self.user_client_misses += 1
+            client = self._client(token)
+            self._user_clients[key] = client
+            while len(self._user_clients) > self.max_user_clients:
+                self._user_clients.popitem(last=False)
+            return client
+
+    def stats(self) -> dict:
+        reused = max(self.requests - self.connections_opened, 0)
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "tls_handshakes": self.tls_handshakes,
+            "connection_reuse_rate": (reused / self.requests) if self.requests else 0.0,
+            "system_token_refreshes": self.system_token_refreshes,
+            "user_clients": len(self._user_clients),
+            "user_client_hits": self.user_client_hits,
+            "user_client_misses": self.user_client_misses
+        }
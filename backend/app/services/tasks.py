@@ -1,16 +1,154 @@
 from sqlalchemy.orm import Session
 from ..database import SessionLocal
 from .. import models
-from .ocr import process_receipt_with_gemini
 from .storage import storage_service
+from . import spend_rollups  # workers write purchases too: keep rollups in sync
+from ..celery_app import celery_app, CELERY_ENABLED, REDIS_URL
+from celery.exceptions import Ignore
 import logging
 from datetime import datetime
 import zipfile
 import io
 import os
+import time
 
 logger = logging.getLogger(__name__)
 
+# Per-company fairness: at most this many tasks of one company run at once across all
+# workers. Extra tasks are re-queued behind other companies' work instead of hogging workers.
+COMPANY_MAX_INFLIGHT = int(os.getenv("CELERY_COMPANY_MAX_INFLIGHT", "2"))
+FAIRNESS_REQUEUE_SECONDS = int(os.getenv("CELERY_FAIRNESS_REQUEUE_SECONDS", "5"))
+# A slot is a lease: if the worker holding it dies, the slot frees itself after this long
+COMPANY_SLOT_LEASE_SECONDS = int(os.getenv("CELERY_COMPANY_SLOT_LEASE_SECONDS", "3600"))
+JOB_OWNER_TTL = 7 * 24 * 3600
+
+_redis = None
+
+def get_redis():
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(REDIS_URL)
+    return _redis
+
+def acquire_company_slot(company_id: str, task_id: str) -> bool:
+    """
+    Company slots are a sorted set of task id -> lease deadline. Expired leases (crashed
+    workers) are dropped first; the task then takes a slot if it ranks within the limit.
+    Add-then-rank keeps concurrent acquirers from overshooting without a Lua script.
+    """
+    key = f"celery:inflight:{company_id}"
+    r = get_redis()
+    now = time.time()
+    r.zremrangebyscore(key, "-inf", now)
+    r.zadd(key, {task_id: now + COMPANY_SLOT_LEASE_SECONDS})
+    if r.zrank(key, task_id) >= COMPANY_MAX_INFLIGHT:
+        r.zrem(key, task_id)
+        return False
+    # Every lease ends before this, so the key never outlives the work it tracks
+    r.expire(key, COMPANY_SLOT_LEASE_SECONDS)
+    return True
+
+def release_company_slot(company_id: str, task_id: str):
+    get_redis().zrem(f"celery:inflight:{company_id}", task_id)
+
+def remember_job_owner(job_id: str, company_id: str):
+    get_redis().set(f"celery:job:{job_id}:company", company_id, ex=JOB_OWNER_TTL)
+
+def get_job_owner(job_id: str) -> str:
+    owner = get_redis().get(f"celery:job:{job_id}:company")
+    return owner.decode() if owner else None
+
+def dispatch(task, background_tasks, fallback, *args, company_id: str = None) -> str:
+    """
+    Sends work to the Celery queue when a broker is configured, else runs `fallback`
+    in FastAPI BackgroundTasks. Returns the Celery job id (None for local runs).
+    """
+    if CELERY_ENABLED:
+        try:
+            result = task.apply_async(args=list(args), kwargs={"company_id": company_id})
+            if company_id:
+                remember_job_owner(result.id, company_id)
+            return result.id
+        except Exception as e:
+            logger.error(f"Could not enqueue {task.name}, running in-process: {e}")
+
+    background_tasks.add_task(fallback, *args)
+    return None
+
+def run_fairly(task, company_id: str, func, *args):
+    """
+    Runs func(*args) inside a company slot. At the company's limit the task is published
+    again under the same id, so GET /jobs/{job_id} keeps following it. This is not a
+    Celery retry: waiting for a slot must not use up the task's max_retries, which are
+    kept for real failures (the republished message carries the current retry count).
+    """
+    if not company_id:
+        return func(*args)
+
+    task_id = task.request.id
+    if not acquire_company_slot(company_id, task_id):
+        logger.info(f"Company {company_id} at fairness limit, requeueing {task.name} in {FAIRNESS_REQUEUE_SECONDS}s")
+        task.signature_from_request(countdown=FAIRNESS_REQUEUE_SECONDS).apply_async()
+        raise Ignore()
+    try:
+        return func(*args)
+    finally:
+        release_company_slot(company_id, task_id)
+
+TASK_RETRY_OPTIONS = dict(
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    retry_backoff_max=300,
+    retry_jitter=True,
+    max_retries=3
+)
+
+@celery_app.task(**TASK_RETRY_OPTIONS)
+def process_receipt_task(self, receipt_id: str, company_id: str = None):
+    from .ocr import process_receipt
+    return run_fairly(self, company_id, lambda rid: process_receipt(rid, raise_errors=True), receipt_id)
+
+@celery_app.task(**TASK_RETRY_OPTIONS)
+def process_receipt_batch_task(self, job_id: str, company_id: str = None):
+    from .ocr import process_receipt_batch
+    return run_fairly(self, company_id, process_receipt_batch, job_id)
+
+@celery_app.task
+def reap_ocr_leases_task():
+    """
+    Periodic (celery beat): re-queues receipts whose OCR worker died mid-job.
+    Batch receipts are resumed through their batch so its progress counters keep moving.
+    """
+    from . import ocr_jobs
+    db: Session = SessionLocal()
+    try:
+        receipts = ocr_jobs.reap_expired(db)
+        batches = {r.batch_job_id: r.company_id for r in receipts if r.batch_job_id}
+        for batch_job_id, company_id in batches.items():
+            process_receipt_batch_task.apply_async(args=[batch_job_id], kwargs={"company_id": company_id})
+        for receipt in receipts:
+            if not receipt.batch_job_id:
+                process_receipt_task.apply_async(args=[receipt.id], kwargs={"company_id": receipt.company_id})
+        return {"requeued": len(receipts), "batches": len(batches)}
+    finally:
+        db.close()
+
+@celery_app.task(**TASK_RETRY_OPTIONS)
+def process_purchase_task(self, purchase_id: str, company_id: str = None):
+    from .purchase_processor import process_purchase
+    return run_fairly(self, company_id, process_purchase, purchase_id)
+
+@celery_app.task(**TASK_RETRY_OPTIONS)
+def sync_purchase_task(self, sync_data: dict, company_id: str = None):
+    from .google_sheets_service import google_sheets_service
+    return google_sheets_service.sync_purchase(sync_data)
+
+@celery_app.task(**TASK_RETRY_OPTIONS)
+def export_receipts_zip_task(self, month: int, year: int, status_filter: str = None, company_id: str = None):
+    return export_receipts_zip(company_id, month, year, status_filter=status_filter)
+
 import csv
 
 def export_receipts_zip(company_id: str, month: int, year: int, user_id: str = None, status_filter: str = None):
@@ -50,8 +188,6 @@ def export_receipts_zip(company_id: str, month: int, year: int, user_id: str = N
         csv_writer.writerow(["Fecha", "Proveedor", "Categoría", "Monto", "Impuesto", "Archivo"])
 
         with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            system_client = storage_service.get_system_client()
-            
             for report in reports:
                 # 1. Determine Filename
                 ext = ".bin"
@@ -79,36 +215,27 @@ def export_receipts_zip(company_id: str, month: int, year: int, user_id: str = N
                 if not report.source_file_path:
                     continue
                     
-                try:
-                    file_data = system_client.storage.from_(storage_service.bucket).download(report.source_file_path)
+                file_data = storage_service.download_file(report.source_file_path)
+                if file_data:
                     zip_file.writestr(filename, file_data)
-                except Exception as e:
-                    logger.error(f"Failed to zip report {report.id}: {e}")
+                else:
+                    logger.error(f"Failed to zip report {report.id}: download failed")
                     # Write error text file instead
-                    zip_file.writestr(f"ERROR_{filename}.txt", f"Could not download file: {str(e)}")
+                    zip_file.writestr(f"ERROR_{filename}.txt", f"Could not download file: {report.source_file_path}")
 
             # Add CSV to Zip
             zip_file.writestr("Indice_Gastos.csv", csv_buffer.getvalue().encode('utf-8-sig')) # BOM for Excel
         
         zip_buffer.seek(0)
         
-        # Upload Zip
+        # Upload Zip (fixed path: re-exporting a month replaces it)
         zip_filename = f"exports/{company_id}/{year}_{month}_audit.zip"
-        # Since UploadFile expects a file-like object with more attrs, we might need a workaround or use Supabase-py upload directly
-        # storage_service.upload_file expects FastAPI UploadFile. 
-        # let's use system_client directly for bytes upload
+        storage_service.put_bytes(zip_filename, zip_buffer.getvalue(), "application/zip")
         
-        system_client.storage.from_(storage_service.bucket).upload(
-            zip_filename, 
-            zip_buffer.getvalue(),
-            {"content-type": "application/zip", "upsert": "true"}
-        )
+        # Signed (or backend-served) URL, valid 1 hour
+        download_url = storage_service.get_file_url(zip_filename, 3600)
         
-        # Get Public URL (or signed URL)
-        # Using public URL for simplicity if bucket is public, else create_signed_url
-        res = system_client.storage.from_(storage_service.bucket).create_signed_url(zip_filename, 3600) # 1 hour
-        
-        return {"status": "success", "download_url": res["signedURL"]}
+        return {"status": "success", "download_url": download_url}
         
     except Exception as e:
         logger.error(f"Export task failed: {e}")
@@ -116,83 +243,3 @@ def export_receipts_zip(company_id: str, month: int, year: int, user_id: str = N
     finally:
         db.close()
 
-
-def process_receipt_async(receipt_id: str, file_content: bytes = None):
-    """
-    Celery task to process receipt OCR asynchronously.
-    """
-    db: Session = SessionLocal()
-    try:
-        receipt = db.query(models.Receipt).filter(models.Receipt.id == receipt_id).first()
-        if not receipt:
-            logger.error(f"Receipt {receipt_id} not found")
-            return
-
-        logger.info(f"Starting async OCR for receipt {receipt_id}")
-        
-        # If file_content is passed (small files), use it.
-        # Otherwise, download from storage using storage_path.
-        # For simplicity in this step, we assume bytes might be passed or we need to download.
-        # Since passing bytes to Celery (Redis) is bad for large files, let's download if not present.
-        
-        data_to_process = file_content
-        
-        if not data_to_process and receipt.storage_path:
-            # Download from Supabase
-            # Use system client to bypass RLS in background task
-            try:
-                system_client = storage_service.get_system_client()
-                data_to_process = system_client.storage.from_(storage_service.bucket).download(receipt.storage_path)
-            except Exception as e:
-                logger.error(f"Failed to download from storage: {e}")
-                raise e
-
-        if not data_to_process:
-             raise ValueError("No file content available for processing")
-
-        # Update status to PROCESSING (if not already)
-        receipt.status = models.ReceiptStatus.PROCESSING.value
-        db.commit()
-
-        # Perform OCR
-        extracted_data = process_receipt_with_gemini(data_to_process)
-        
-        # Parse date
-        date_obj = None
-        if extracted_data.get("date"):
-            try:
-                date_obj = datetime.strptime(extracted_data["date"], "%Y-%m-%d").date()
-            except:
-                pass
-
-        # Save Results
-        parsed = models.ParsedData(
-            receipt_id=receipt.id,
-            vendor=extracted_data.get("vendor"),
-            date=date_obj,
-            amount=float(extracted_data.get("amount") or 0),
-            currency=extracted_data.get("currency"),
-            category=extracted_data.get("category"),
-            confidence_score=float(extracted_data.get("confidence_score") or 0)
-        )
-        db.add(parsed)
-        
-        receipt.status = models.ReceiptStatus.COMPLETED.value
-        receipt.processed_at = datetime.utcnow()
-        db.commit()
-        
-        logger.info(f"Successfully processed receipt {receipt_id}")
-        
-        return {"status": "success", "receipt_id": receipt_id}
-
-    except Exception as e:
-        logger.error(f"Task failed: {e}")
-        if receipt:
-            receipt.status = models.ReceiptStatus.FAILED.value
-            db.commit()
-        if receipt:
-            receipt.status = models.ReceiptStatus.FAILED.value
-            db.commit()
-            
-    finally:
-        db.close()
@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Share entries between gunicorn workers through Redis, on by default when REDIS_URL is set;
+# local copies then only live TENANT_CACHE_LOCAL_TTL_SECONDS so an invalidation in one worker
+# reaches the others quickly
+TENANT_CACHE_REDIS = os.getenv("TENANT_CACHE_REDIS", "true" if os.getenv("REDIS_URL") else "false").lower() == "true"
+# Without Redis each worker's copy is all there is, so it must not outlive a membership change for long
+TENANT_CACHE_TTL_SECONDS = int(os.getenv("TENANT_CACHE_TTL_SECONDS", "300" if TENANT_CACHE_REDIS else "15"))
+TENANT_CACHE_MAX_ENTRIES = int(os.getenv("TENANT_CACHE_MAX_ENTRIES", "10000"))
+TENANT_CACHE_LOCAL_TTL_SECONDS = int(os.getenv("TENANT_CACHE_LOCAL_TTL_SECONDS", "5"))
+
+# Columns of users kept per entry: enough to resolve the tenant and rebuild the User row
+FIELDS = ("id", "email", "full_name", "company_id", "role", "is_active")
+
+class TenantCache:
+    """
+    user id -> {company_id, role, is_active, ...} for users already linked to a company,
+    so auth dependencies skip the users/companies SELECTs on every request.
+    In-process TTL + LRU, optionally backed by Redis. Entries are dropped with
+    `invalidate(user_id)` wherever membership, role or active state changes.
+    """
+    def __init__(self, ttl_seconds: int = None, max_entries: int = None, redis_client=None):
+        self.ttl_seconds = TENANT_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_entries = TENANT_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self._redis = redis_client
+        self._use_redis = redis_client is not None or TENANT_CACHE_REDIS
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.roundtrips_saved = 0
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def _get_redis(self):
+        if self._redis is None:
+            import redis
+            from ..celery_app import REDIS_URL
+            self._redis = redis.Redis.from_url(REDIS_URL)
+        return self._redis
+
+    @staticmethod
+    def _redis_key(user_id: str) -> str:
+        return f"tenant:user:{user_id}"
+
+    def _local_ttl(self) -> int:
+        return min(self.ttl_seconds, TENANT_CACHE_LOCAL_TTL_SECONDS) if self._use_redis else self.ttl_seconds
+
+    def _store_local(self, user_id: str, entry: dict):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self._local_ttl(), entry)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, user_id: str, roundtrips: int = 1) -> dict:
+        """
+        Cached entry or None. `roundtrips` is what the caller would have spent on a
+        miss and is added to `roundtrips_saved` on a hit.
+        """
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is not None and cached[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                entry = cached[1]
+            else:
+                entry = None
+                if cached is not None:
+                    del self._entries[user_id]
+
+        if entry is None and self._use_redis:
+            try:
+                raw = self._get_redis().get(self._redis_key(user_id))
+                if raw:
+                    entry = json.loads(raw)
+                    self._store_local(user_id, entry)
+            except Exception as e:
+                logger.warning(f"Tenant cache Redis lookup failed: {e}")
+
+        if entry is None:
+            self._count("misses")
+            return None
+        with self._lock:
+            self.hits += 1
+            self.roundtrips_saved += roundtrips
+        return entry
+
+    def set(self, user) -> dict:
+        """Caches a users row (ORM object). Users without a company are not cached."""
+        if not user.company_id:
+            return None
+        entry = {field: getattr(user, field) for field in FIELDS}
+        self._store_local(user.id, entry)
+        if self._use_redis:
+            try:
+                self._get_redis().set(self._redis_key(user.id), json.dumps(entry), ex=self.ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Tenant cache Redis write failed: {e}")
+        return entry
+
+    def invalidate(self, user_id: str = None):
+        """Drops one user (or everyone). Call after committing a membership change."""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+            self.invalidations += 1
+        if self._use_redis and user_id is not None:
+            try:
+                self._get_redis().delete(self._redis_key(user_id))
+            except Exception as e:
+                logger.warning(f"Tenant cache Redis invalidation failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "db_roundtrips_saved": self.roundtrips_saved,
+            "entries": len(self._entries),
+            "redis": self._use_redis
+        }
+
+# Singleton instance
+tenant_cache = TenantCache()
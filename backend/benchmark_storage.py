@@ -0,0 +1,54 @@
+"""
+Benchmark for the storage backends in services/storage_backends.py and services/storage.py.
+
+Writes, reads and deletes the same set of objects on each backend and prints the
+per-operation latency and throughput, so e.g. local disk, MinIO and Supabase can
+be compared with the same workload.
+
+Usage:
+    python benchmark_storage.py                          # local disk, 200 x 256 KB
+    python benchmark_storage.py local s3 supabase        # each backend configured via env (S3_*, SUPABASE_*)
+    BENCH_OBJECTS=50 BENCH_OBJECT_KB=4096 python benchmark_storage.py s3
+"""
+import os
+import sys
+import time
+import tempfile
+
+from app.services.storage import create_storage_service
+from app.services.storage_backends import LocalStorageBackend
+
+OBJECTS = int(os.getenv("BENCH_OBJECTS", "200"))
+OBJECT_KB = int(os.getenv("BENCH_OBJECT_KB", "256"))
+
+def run(name: str):
+    backend = LocalStorageBackend(root=tempfile.mkdtemp(prefix="bench_storage_")) if name == "local" \
+        else create_storage_service(name)
+    payload = os.urandom(OBJECT_KB * 1024)
+    paths = [f"benchmark/{i:05d}.bin" for i in range(OBJECTS)]
+
+    timings = {}
+    started = time.perf_counter()
+    for path in paths:
+        backend.put_bytes(path, payload, "application/octet-stream")
+    timings["put"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for path in paths:
+        assert backend.download_file(path) == payload, f"{name}: read back mismatch at {path}"
+    timings["get"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for path in paths:
+        backend.delete_file(path)
+    timings["delete"] = time.perf_counter() - started
+
+    total_mb = OBJECTS * OBJECT_KB / 1024
+    for op, seconds in timings.items():
+        throughput = f"{total_mb / seconds:8.1f} MB/s" if op != "delete" else " " * 13
+        print(f"{name:<10}{op:<8}{seconds / OBJECTS * 1000:9.2f} ms/op {throughput}")
+
+if __name__ == "__main__":
+    print(f"{OBJECTS} objects x {OBJECT_KB} KB")
+    for name in sys.argv[1:] or ["local"]:
+        run(name)
@@ -9,18 +9,66 @@ commands = [
     "ALTER TABLE reports ADD COLUMN IF NOT EXISTS vendor VARCHAR;",
     "ALTER TABLE reports ADD COLUMN IF NOT EXISTS amount FLOAT;",
     "ALTER TABLE reports ADD COLUMN IF NOT EXISTS currency VARCHAR;",
-    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS category VARCHAR;"
+    "ALTER TABLE reports ADD COLUMN IF NOT EXISTS category VARCHAR;",
+    # Near-duplicate receipt detection
+    "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS phash VARCHAR;",
+    "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS duplicate_of_id VARCHAR REFERENCES receipts(id);",
+    "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS duplicate_distance INTEGER;",
+    "CREATE INDEX IF NOT EXISTS idx_receipt_company_phash ON receipts (company_id, phash);",
+    "ALTER TABLE purchases ADD COLUMN IF NOT EXISTS duplicate_distance INTEGER;",
+    # Batch OCR uploads (ocr_batch_jobs itself is created by create_all)
+    "ALTER TABLE receipts ADD COLUMN IF NOT EXISTS batch_job_id VARCHAR REFERENCES ocr_batch_jobs(id);",
+    "CREATE INDEX IF NOT EXISTS ix_receipts_batch_job_id ON receipts (batch_job_id);",
+    # Tiered OCR
+    "ALTER TABLE parsed_data ADD COLUMN IF NOT EXISTS ocr_tier VARCHAR;",
+    # Idempotent OCR jobs (ocr_jobs itself is created by create_all). Old retries could leave
+    # several extractions per receipt: keep the most confident one (ids are random UUIDs, so
+    # they only break ties) before enforcing uniqueness.
+    """DELETE FROM parsed_data p USING parsed_data q
+       WHERE p.receipt_id = q.receipt_id
+         AND (COALESCE(p.confidence_score, 0) < COALESCE(q.confidence_score, 0)
+              OR (COALESCE(p.confidence_score, 0) = COALESCE(q.confidence_score, 0) AND p.id < q.id));""",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_parsed_data_receipt ON parsed_data (receipt_id);",
+    # Dashboard aggregates filter and sort by created_at
+    "CREATE INDEX IF NOT EXISTS idx_purchase_company_created ON purchases (company_id, created_at);",
+    # Per-tour budgets read by /reports/admin/summary
+    "ALTER TABLE category_budgets ADD COLUMN IF NOT EXISTS tour_id VARCHAR;",
+    "CREATE INDEX IF NOT EXISTS ix_category_budgets_tour_id ON category_budgets (tour_id);",
+    # Indexed product search for /price-trends (product_key is backfilled below)
+    "ALTER TABLE purchase_items ADD COLUMN IF NOT EXISTS product_key VARCHAR;",
+    "CREATE INDEX IF NOT EXISTS ix_purchase_items_product_key ON purchase_items (product_key);",
+    # Item -> product matching on approval (product_aliases itself is created by create_all)
+    "ALTER TABLE purchase_items ADD COLUMN IF NOT EXISTS product_id VARCHAR REFERENCES products(id);",
+    "CREATE INDEX IF NOT EXISTS ix_purchase_items_product_id ON purchase_items (product_id);",
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS last_price_date DATE;",
+    # Keyset pagination of /providers
+    "CREATE INDEX IF NOT EXISTS idx_provider_company_name ON providers (company_id, name);"
 ]
 
-with engine.connect() as conn:
-    for cmd in commands:
-        try:
-            print(f"Executing: {cmd}")
+# One transaction per command: on Postgres a failed statement aborts its transaction,
+# which would silently skip every command after it.
+for cmd in commands:
+    try:
+        print(f"Executing: {cmd}")
+        with engine.begin() as conn:
             conn.execute(text(cmd))
-            print("OK")
-        except Exception as e:
-            print(f"Error executing {cmd}: {e}")
-            
-    conn.commit()
+        print("OK")
+    except Exception as e:
+        print(f"Error executing {cmd}: {e}")
+
+from sqlalchemy.orm import Session
+from app.services.product_search import backfill_product_keys, ensure_search_index
+# pg_trgm index (Postgres) or FTS5 table and triggers (SQLite) over product_key
+ensure_search_index(engine)
+with Session(engine) as db:
+    print(f"Backfilled product_key of {backfill_product_keys(db)} purchase items")
+
+# Dashboards read spend_rollups: fill it on first deploy, or repair it if writes were missed
+from app.services import spend_rollups
+with Session(engine) as db:
+    drift = spend_rollups.check_consistency(db)
+    if drift:
+        print(f"{len(drift)} spend rollup rows out of date, rebuilding")
+        print(f"Rebuilt {spend_rollups.rebuild(db)} spend rollup rows")
 
 print("Migration completed.")
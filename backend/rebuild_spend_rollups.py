@@ -0,0 +1,32 @@
+"""
+Backfill / verify the spend_rollups table.
+
+    python rebuild_spend_rollups.py                  # rebuild every company from purchases
+    python rebuild_spend_rollups.py --company <id>   # rebuild one company
+    python rebuild_spend_rollups.py --check          # only report mismatches (exit code 1 if any)
+"""
+import sys
+import argparse
+from app.database import SessionLocal, engine, Base
+from app import models
+from app.services import spend_rollups
+
+parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument("--company", help="Limit to one company id")
+parser.add_argument("--check", action="store_true", help="Compare rollups with purchases without rewriting them")
+args = parser.parse_args()
+
+Base.metadata.create_all(bind=engine, tables=[models.SpendRollup.__table__])
+db = SessionLocal()
+try:
+    if args.check:
+        mismatches = spend_rollups.check_consistency(db, company_id=args.company)
+        for m in mismatches:
+            print(f"MISMATCH {m['key']}: expected {m['expected']}, rollup has {m['actual']}")
+        print(f"{len(mismatches)} mismatching rollup rows")
+        sys.exit(1 if mismatches else 0)
+
+    rows = spend_rollups.rebuild(db, company_id=args.company)
+    print(f"Rebuilt {rows} spend rollup rows")
+finally:
+    db.close()
@@ -2,6 +2,7 @@ import pytest
 import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
 from fastapi.testclient import TestClient
 from jose import jwt
 from datetime import datetime
@@ -17,6 +18,7 @@ os.environ["SUPABASE_KEY"] = "fake-key"
 from app.database import Base, get_db
 from app.main import app
 from app.auth import get_current_user
+from app.services.tenant_cache import tenant_cache
 from app.models import User, Company, Receipt, Report # Explicit import to register models
 
 # Create file-based engine for debugging persistence
@@ -25,6 +27,8 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engin
 
 @pytest.fixture(scope="function")
 def test_db():
+    # Each test recreates the users: cached memberships of the last test are stale
+    tenant_cache.invalidate()
     Base.metadata.create_all(bind=engine)
     db = TestingSessionLocal()
     try:
@@ -33,6 +37,20 @@ def test_db():
         db.close()
         Base.metadata.drop_all(bind=engine)
 
+@pytest.fixture
+def memory_session_factory():
+    # One in-memory database per test, shared by every session the factory opens
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+@pytest.fixture
+def db(memory_session_factory):
+    session = memory_session_factory()
+    yield session
+    session.close()
+
 @pytest.fixture(scope="function")
 def client(test_db):
     def override_get_db():
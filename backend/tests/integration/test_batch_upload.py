@@ -0,0 +1,145 @@
+from unittest.mock import patch
+import io
+import time
+import zipfile
+import pytest
+from app import models
+from app.services import ocr
+
+@pytest.fixture
+def mock_storage():
+    with patch("app.services.storage.storage_service.upload_stream") as upload_stream:
+        upload_stream.side_effect = lambda source, filename, content_type, company_id, size=None: (
+            {"storage_path": f"{company_id}/{filename}", "size": len(source.read())}
+        )
+        yield upload_stream
+
+def make_zip(entries: dict) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        for name, content in entries.items():
+            archive.writestr(name, content)
+    return buf.getvalue()
+
+def test_batch_upload_creates_job_and_receipts(client, auth_headers, test_db, mock_storage):
+    files = [
+        ("files", ("a.jpg", b"image-a", "image/jpeg")),
+        ("files", ("month.zip", make_zip({"b.png": b"image-b", "notes.txt": b"skip", "sub/c.pdf": b"%PDF"}), "application/zip")),
+    ]
+    with patch("app.routers.receipts.ocr.process_receipt_batch") as batch_task:
+        response = client.post("/receipts/upload-batch", headers=auth_headers, files=files)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total"] == 3
+    assert len(data["receipt_ids"]) == 3
+    batch_task.assert_called_once_with(data["id"])
+
+    receipts = test_db.query(models.Receipt).filter(models.Receipt.batch_job_id == data["id"]).all()
+    assert sorted(r.filename for r in receipts) == ["a.jpg", "b.png", "c.pdf"]
+
+    progress = client.get(f"/receipts/batch/{data['id']}", headers=auth_headers)
+    assert progress.status_code == 200
+    assert progress.json()["status"] == "PENDING"
+
+def png_bytes(color) -> bytes:
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (64, 64), "white")
+    ImageDraw.Draw(image).rectangle((8, 8, 40, 56), fill=color)
+    buf = io.BytesIO()
+    image.save(buf, "PNG")
+    return buf.getvalue()
+
+def test_batch_upload_flags_duplicates_within_the_batch(client, auth_headers, test_db, mock_storage):
+    photo = png_bytes("black")
+    files = [("files", ("month.zip", make_zip({"a.png": photo, "again/a.png": photo, "b.png": png_bytes("white")}), "application/zip"))]
+    with patch("app.routers.receipts.ocr.process_receipt_batch"):
+        response = client.post("/receipts/upload-batch", headers=auth_headers, files=files)
+
+    assert response.status_code == 200
+    first, second, third = [
+        test_db.query(models.Receipt).filter(models.Receipt.id == receipt_id).one()
+        for receipt_id in response.json()["receipt_ids"]
+    ]
+    assert (second.duplicate_of_id, second.duplicate_distance) == (first.id, 0)
+    assert first.duplicate_of_id is None and third.duplicate_of_id is None
+
+def test_batch_upload_counts_files_before_uploading(client, auth_headers, test_db, mock_storage):
+    files = [("files", ("month.zip", make_zip({f"{i}.jpg": b"x" for i in range(3)}), "application/zip"))]
+    with patch("app.routers.receipts.BATCH_MAX_FILES", 2):
+        response = client.post("/receipts/upload-batch", headers=auth_headers, files=files)
+
+    assert response.status_code == 400
+    mock_storage.assert_not_called()
+
+def test_batch_upload_storage_error_rolls_back_the_batch(client, auth_headers, test_db, mock_storage):
+    stored = {"a.jpg": {"storage_path": "c1/a.jpg"}, "b.jpg": {"storage_path": None, "error": "bucket unavailable"}}
+    mock_storage.side_effect = lambda source, filename, content_type, company_id, size=None: stored[filename]
+    files = [("files", ("a.jpg", b"image-a", "image/jpeg")), ("files", ("b.jpg", b"image-b", "image/jpeg"))]
+    with patch("app.services.storage.storage_service.delete_file") as delete_file:
+        response = client.post("/receipts/upload-batch", headers=auth_headers, files=files)
+
+    assert response.status_code == 500
+    assert "bucket unavailable" in response.json()["detail"]
+    delete_file.assert_called_once_with("c1/a.jpg")
+    assert test_db.query(models.Receipt).count() == 0
+    assert test_db.query(models.OCRBatchJob).count() == 0
+
+def test_single_upload_rejects_oversize_before_decoding(client, auth_headers, test_db, mock_storage):
+    files = {"file": ("huge.png", png_bytes("black"), "image/png")}
+    with patch("app.services.storage_backends.UPLOAD_MAX_BYTES", 100), \
+         patch("app.services.image_hash.compute_dhash") as compute_dhash:
+        response = client.post("/receipts/upload", headers=auth_headers, files=files)
+
+    assert response.status_code == 413
+    compute_dhash.assert_not_called()
+    mock_storage.assert_not_called()
+    assert test_db.query(models.Receipt).count() == 0
+
+def test_process_receipt_batch_bulk_inserts_results(test_db):
+    job = models.OCRBatchJob(company_id="c1", total=3)
+    test_db.add(job)
+    test_db.flush()
+    for i in range(3):
+        test_db.add(models.Receipt(id=f"r{i}", company_id="c1", storage_path=f"c1/r{i}.jpg", batch_job_id=job.id, status="PENDING"))
+    test_db.commit()
+
+    def fake_load(path, local_path=None):
+        return None if path.endswith("r2.jpg") else b"bytes"
+
+    with patch("app.database.SessionLocal", return_value=test_db), \
+         patch.object(test_db, "close"), \
+         patch.object(ocr, "load_receipt_bytes", side_effect=fake_load), \
+         patch.object(ocr, "process_receipt_with_gemini", return_value={"vendor": "Exito", "amount": 100, "date": "2024-01-05"}), \
+         patch.object(ocr, "OCR_BATCH_SIZE", 2):
+        ocr.process_receipt_batch(job.id)
+
+    test_db.refresh(job)
+    assert job.status == "COMPLETED"
+    assert (job.processed, job.failed) == (2, 1)
+    assert test_db.query(models.ParsedData).count() == 2
+    assert test_db.query(models.Receipt).filter(models.Receipt.id == "r2").first().status == "FAILED"
+
+def test_process_receipt_batch_renews_leases_of_slow_extractions(test_db):
+    job = models.OCRBatchJob(company_id="c1", total=1)
+    test_db.add(job)
+    test_db.flush()
+    test_db.add(models.Receipt(id="slow", company_id="c1", storage_path="c1/slow.jpg", batch_job_id=job.id, status="PENDING"))
+    test_db.commit()
+
+    def slow_ocr(data):
+        time.sleep(0.35)
+        return {"vendor": "Exito", "amount": 100, "date": "2024-01-05"}
+
+    with patch("app.database.SessionLocal", return_value=test_db), \
+         patch.object(test_db, "close"), \
+         patch.object(ocr, "load_receipt_bytes", return_value=b"bytes"), \
+         patch.object(ocr, "process_receipt_with_gemini", side_effect=slow_ocr), \
+         patch.object(ocr.ocr_jobs, "OCR_JOB_LEASE_SECONDS", 0.2), \
+         patch.object(ocr.ocr_jobs, "renew", wraps=ocr.ocr_jobs.renew) as renew:
+        ocr.process_receipt_batch(job.id)
+
+    assert renew.call_count >= 2
+    assert all(call.args[1] == ["slow"] for call in renew.call_args_list)
+    test_db.refresh(job)
+    assert (job.status, job.processed) == ("COMPLETED", 1)
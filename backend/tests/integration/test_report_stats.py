@@ -0,0 +1,115 @@
+from datetime import date, datetime
+from app import models
+from app.routers import reports
+
+def add_purchase(db, amount, category, created_at, client_name=None, company_id="c1"):
+    db.add(models.Purchase(
+        company_id=company_id, date=created_at.date(), amount=amount, category=category,
+        client_name=client_name, created_at=created_at
+    ))
+
+def test_dashboard_stats_aggregates_in_sql(test_db):
+    add_purchase(test_db, 100, "Carnes", datetime(2024, 1, 10), "Ana")
+    add_purchase(test_db, 50, "Carnes", datetime(2024, 2, 3), "Ana")
+    add_purchase(test_db, 30, None, datetime(2024, 2, 20))
+    add_purchase(test_db, None, "Aseo", datetime(2024, 2, 21), "Luis")
+    add_purchase(test_db, 500, "ANTICIPO_RECIBIDO", datetime(2024, 2, 22), "Ana")
+    add_purchase(test_db, 70, "RECAUDO_CLIENTE", datetime(2024, 2, 23))
+    add_purchase(test_db, 999, "Carnes", datetime(2024, 2, 23), company_id="c2")
+    test_db.commit()
+
+    stats = reports.get_dashboard_stats(start_date=None, end_date=None, db=test_db, company_id="c1")
+
+    assert stats["total_reports"] == 6
+    assert (stats["total_spent"], stats["total_advances"], stats["total_collections"]) == (180, 500, 70)
+    assert stats["monthly_stats"] == [{"month": "Jan", "total": 100}, {"month": "Feb", "total": 80}]
+    assert sorted(stats["category_stats"], key=lambda c: c["name"]) == [
+        {"name": "Aseo", "value": 0}, {"name": "Carnes", "value": 150}, {"name": "Uncategorized", "value": 30}
+    ]
+    assert stats["client_stats"][0] == {"name": "Ana", "value": 150}
+    assert [r["amount"] for r in stats["recent_activity"]] == [70, 500, 0, 30, 50]
+
+def test_dashboard_stats_date_window(test_db):
+    add_purchase(test_db, 100, "Carnes", datetime(2024, 1, 10))
+    add_purchase(test_db, 50, "Carnes", datetime(2024, 2, 3))
+    test_db.commit()
+
+    stats = reports.get_dashboard_stats(
+        start_date=date(2024, 2, 1), end_date=date(2024, 2, 28), db=test_db, company_id="c1"
+    )
+    assert stats["total_reports"] == 1
+    assert stats["total_spent"] == 50
+    assert stats["active_tour"] is None
+
+def count_queries(db, func):
+    from sqlalchemy import event
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        result = func()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    return result, len(statements)
+
+def add_tour(db, tour_id, budget=None):
+    day = datetime(2024, 3, 1)
+    db.add(models.Purchase(company_id="c1", tour_id=tour_id, date=day.date(), month=3, year=2024,
+                           amount=200, category="Carnes", client_name=f"Client {tour_id}"))
+    db.add(models.Purchase(company_id="c1", tour_id=tour_id, date=day.date(), month=3, year=2024,
+                           amount=30, category=None))
+    db.add(models.Purchase(company_id="c1", tour_id=tour_id, date=day.date(), month=3, year=2024,
+                           amount=100, category="RECAUDO_CLIENTE"))
+    if budget:
+        db.add(models.CategoryBudget(company_id="c1", tour_id=tour_id, category="TOTAL", budget_amount=budget))
+
+def test_admin_summary_totals_per_tour(test_db):
+    add_tour(test_db, "T1", budget=1000)
+    add_tour(test_db, "T2")
+    test_db.commit()
+
+    summary = reports.get_admin_summary(month=3, year=2024, db=test_db, company_id="c1")
+
+    assert [t["tour_id"] for t in summary] == ["T1", "T2"]
+    assert summary[0] == {
+        "tour_id": "T1",
+        "client_name": "Client T1",
+        "total_advances": 1000,
+        "total_collections": 100,
+        "total_expenses": 230,
+        "balance": 870,
+        "categories": {"Carnes": 200, "📦 Otros": 30}
+    }
+    assert summary[1]["balance"] == -130
+
+def test_admin_summary_query_count_is_constant(test_db):
+    add_tour(test_db, "T1", budget=1000)
+    test_db.commit()
+    _, one_tour = count_queries(test_db, lambda: reports.get_admin_summary(month=None, year=None, db=test_db, company_id="c1"))
+
+    for i in range(2, 12):
+        add_tour(test_db, f"T{i}", budget=500)
+    test_db.commit()
+    summary, many_tours = count_queries(test_db, lambda: reports.get_admin_summary(month=None, year=None, db=test_db, company_id="c1"))
+
+    assert len(summary) == 11
+    assert many_tours == one_tour == 2
+
+def test_purchases_dashboard_names_unlinked_providers_by_vendor(test_db):
+    from types import SimpleNamespace
+    from app.routers import purchases
+    test_db.add(models.Provider(id="p1", company_id="c1", name="MacPollo"))
+    test_db.add(models.Purchase(company_id="c1", date=date(2024, 1, 5), amount=100, provider_id="p1"))
+    test_db.add(models.Purchase(company_id="c1", date=date(2024, 1, 6), amount=40, vendor="Tienda Don Jose"))
+    test_db.add(models.Purchase(company_id="c1", date=date(2024, 1, 7), amount=25, vendor="Tienda Don Jose"))
+    test_db.add(models.Purchase(company_id="c1", date=date(2024, 1, 8), amount=10))
+    test_db.commit()
+
+    stats = purchases.get_dashboard_stats(
+        start_date=None, end_date=None, db=test_db, current_user=SimpleNamespace(company_id="c1")
+    )
+    assert stats["client_stats"] == [
+        {"name": "MacPollo", "value": 100}, {"name": "Tienda Don Jose", "value": 65}, {"name": "Otros", "value": 10}
+    ]
+    assert stats["total_spent"] == 175
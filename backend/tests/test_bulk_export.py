@@ -0,0 +1,65 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from sqlalchemy import event
+from app import models
+from app.services import bulk_export
+import pytest
+
+@pytest.fixture
+def session_factory(memory_session_factory):
+    db = memory_session_factory()
+    db.add(models.Provider(id="prov", company_id="c1", name="MacPollo"))
+    for i in range(5):
+        purchase = models.Purchase(
+            id=f"p{i}", company_id="c1", date=date(2024, 1, 1 + i), amount=100 * i,
+            status="APPROVED" if i % 2 else "REJECTED", category="Carnes" if i < 3 else "Aseo",
+            provider_id="prov" if i == 0 else None, created_at=datetime(2024, 1, 1 + i, 12)
+        )
+        purchase.items = [models.PurchaseItem(id=f"p{i}-{n}", name=f"Item {n}", unit_price=n) for n in range(i % 3)]
+        db.add(purchase)
+    db.add(models.Purchase(id="other", company_id="c2", date=date(2024, 1, 1), amount=1))
+    db.commit()
+    db.close()
+    return memory_session_factory
+
+def test_ndjson_nests_items_and_provider(session_factory):
+    body = "".join(bulk_export.stream_ndjson(bulk_export.purchase_filters("c1"), session_factory, chunk_size=2))
+    rows = [json.loads(line) for line in body.splitlines()]
+
+    assert [r["id"] for r in rows] == ["p0", "p1", "p2", "p3", "p4"]
+    assert rows[0]["provider_name"] == "MacPollo" and rows[0]["items"] == []
+    assert rows[2]["date"] == "2024-01-03"
+    assert [item["item_name"] for item in rows[2]["items"]] == ["Item 0", "Item 1"]
+
+def test_csv_has_one_row_per_item(session_factory):
+    body = "".join(bulk_export.stream_csv(bulk_export.purchase_filters("c1"), session_factory, chunk_size=2))
+    rows = list(csv.DictReader(io.StringIO(body)))
+
+    # p0: no items -> 1 row, p1: 1, p2: 2, p3: 1 (no items), p4: 1
+    assert [r["id"] for r in rows] == ["p0", "p1", "p2", "p2", "p3", "p4"]
+    assert rows[2]["item_id"] == "p2-0" and rows[0]["item_id"] == ""
+
+def test_filters_are_pushed_down(session_factory):
+    filters = bulk_export.purchase_filters(
+        "c1", start_date=date(2024, 1, 2), statuses=["APPROVED"], categories=["Carnes"]
+    )
+    body = "".join(bulk_export.stream_ndjson(filters, session_factory))
+    assert [json.loads(line)["id"] for line in body.splitlines()] == ["p1"]
+
+    assert "".join(bulk_export.stream_csv(bulk_export.purchase_filters("nobody"), session_factory)).startswith("id,date")
+
+def test_two_queries_per_chunk(session_factory):
+    db = session_factory()
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.get_bind(), "before_cursor_execute", listener)
+    try:
+        chunks = list(bulk_export.iter_chunks(db, bulk_export.purchase_filters("c1"), chunk_size=2))
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", listener)
+        db.close()
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    # One streaming purchase query plus one item query per chunk
+    assert len(statements) == 1 + len(chunks)
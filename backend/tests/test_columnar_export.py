@@ -0,0 +1,95 @@
+import io
+import json
+import zipfile
+from datetime import date, datetime
+from app import models
+from app.services import bulk_export, columnar_export
+import pyarrow.parquet as pq
+from unittest.mock import patch
+from app.services.storage_backends import LocalStorageBackend
+import pytest
+
+@pytest.fixture
+def session_factory(memory_session_factory):
+    db = memory_session_factory()
+    db.add(models.Provider(id="prov", company_id="c1", name="MacPollo"))
+    for i in range(6):
+        purchase = models.Purchase(
+            id=f"p{i}", company_id="c1", date=date(2024, 1 + i // 3, 1 + i), amount=100 * i,
+            provider_id="prov" if i == 0 else None, created_at=datetime(2024, 1, 1, 12)
+        )
+        purchase.items = [models.PurchaseItem(id=f"p{i}-{n}", name=f"Item {n}", unit_price=n) for n in range(i % 3)]
+        db.add(purchase)
+    db.add(models.Purchase(id="other", company_id="c2", date=date(2024, 1, 1), amount=1))
+    db.commit()
+    db.close()
+    return memory_session_factory
+
+def test_partitions_by_month_with_manifest(session_factory, tmp_path):
+    db = session_factory()
+    manifest = columnar_export.write_dataset(db, bulk_export.purchase_filters("c1"), str(tmp_path), chunk_size=2)
+    db.close()
+
+    assert manifest["schema_version"] == columnar_export.SCHEMA_VERSION
+    counts = {(p["dataset"], p["month"]): p["rows"] for p in manifest["partitions"]}
+    # Jan: p0 (0 items), p1 (1), p2 (2); Feb: p3 (0), p4 (1), p5 (2)
+    assert counts == {
+        ("purchases", "2024-01"): 3, ("purchases", "2024-02"): 3,
+        ("items", "2024-01"): 3, ("items", "2024-02"): 3,
+    }
+    assert json.loads((tmp_path / "_manifest.json").read_text()) == manifest
+
+    january = pq.read_table(tmp_path / "purchases" / "month=2024-01" / "part-0.parquet")
+    assert january.column("id").to_pylist() == ["p0", "p1", "p2"]
+    assert january.column("provider_name").to_pylist() == ["MacPollo", None, None]
+    assert january.schema.metadata[b"schema_version"] == str(columnar_export.SCHEMA_VERSION).encode()
+
+    items = pq.read_table(tmp_path / "items").to_pylist()
+    assert sorted(row["item_id"] for row in items) == ["p1-0", "p2-0", "p2-1", "p4-0", "p5-0", "p5-1"]
+    assert {row["month"] for row in items} == {"2024-01", "2024-02"}
+
+def test_stream_zip_contains_dataset(session_factory):
+    body = b"".join(columnar_export.stream_zip(bulk_export.purchase_filters("c1", start_date=date(2024, 2, 1)), session_factory))
+    archive = zipfile.ZipFile(io.BytesIO(body))
+
+    assert sorted(archive.namelist()) == [
+        "_manifest.json",
+        "items/month=2024-02/part-0.parquet",
+        "purchases/month=2024-02/part-0.parquet",
+    ]
+    table = pq.read_table(io.BytesIO(archive.read("purchases/month=2024-02/part-0.parquet")))
+    assert table.column("id").to_pylist() == ["p3", "p4", "p5"]
+
+def test_empty_export_has_manifest_only(session_factory):
+    body = b"".join(columnar_export.stream_zip(bulk_export.purchase_filters("nobody"), session_factory))
+    archive = zipfile.ZipFile(io.BytesIO(body))
+    assert archive.namelist() == ["_manifest.json"]
+    assert json.loads(archive.read("_manifest.json"))["partitions"] == []
+
+def test_whole_month_window():
+    assert columnar_export.is_whole_month_window(None, None)
+    assert columnar_export.is_whole_month_window(date(2024, 1, 1), date(2024, 2, 29))
+    assert not columnar_export.is_whole_month_window(date(2024, 1, 15), None)
+    assert not columnar_export.is_whole_month_window(None, date(2024, 2, 28))
+
+def test_storage_export_merges_manifest_by_month(session_factory, tmp_path):
+    storage = LocalStorageBackend(root=str(tmp_path))
+    prefix = f"exports/c1/parquet/v{columnar_export.SCHEMA_VERSION}"
+    db = session_factory()
+    with patch("app.services.storage.storage_service", storage):
+        columnar_export.export_to_storage(db, "c1", bulk_export.purchase_filters("c1"))
+
+        # February loses its purchases, then only February is re-exported
+        db.query(models.PurchaseItem).filter(models.PurchaseItem.purchase_id.in_(["p3", "p4", "p5"])).delete()
+        db.query(models.Purchase).filter(models.Purchase.id.in_(["p3", "p4", "p5"])).delete()
+        db.commit()
+        february = dict(start_date=date(2024, 2, 1), end_date=date(2024, 2, 29))
+        result = columnar_export.export_to_storage(db, "c1", bulk_export.purchase_filters("c1", **february), **february)
+    db.close()
+
+    stored = json.loads(storage.download_file(f"{prefix}/_manifest.json"))
+    assert stored == result["manifest"]
+    # January is untouched, February's stale partitions are gone
+    assert {(p["dataset"], p["month"]) for p in stored["partitions"]} == {("purchases", "2024-01"), ("items", "2024-01")}
+    assert storage.download_file(f"{prefix}/purchases/month=2024-01/part-0.parquet")
+    assert storage.download_file(f"{prefix}/purchases/month=2024-02/part-0.parquet") is None
@@ -0,0 +1,62 @@
+from unittest.mock import patch, MagicMock, AsyncMock
+from app.services.gemini_client import GeminiOCRClient, CircuitBreaker, AllModelsFailed
+import json
+import pytest
+
+@pytest.fixture
+def client():
+    c = GeminiOCRClient()
+    c.failure_threshold = 2
+    c.cooldown = 60
+    yield c
+
+def make_models(behaviours):
+    """behaviours: model_name -> AsyncMock for generate_content_async"""
+    def factory(name):
+        model = MagicMock()
+        model.generate_content_async = behaviours[name]
+        return model
+    return factory
+
+def test_falls_back_and_reuses_model_instances(client):
+    behaviours = {
+        "m1": AsyncMock(side_effect=Exception("503 unavailable")),
+        "m2": AsyncMock(return_value=MagicMock(text='{"amount": 10}')),
+    }
+    with patch("app.services.gemini_client.genai.GenerativeModel", side_effect=make_models(behaviours)) as model_cls:
+        for _ in range(3):
+            result, model_name = client.generate_sync(["m1", "m2"], ["prompt"], parse=json.loads, retries=0)
+            assert result == {"amount": 10}
+            assert model_name == "m2"
+
+    # m1 opened after 2 failures and was skipped on the 3rd receipt
+    assert behaviours["m1"].await_count == 2
+    assert client.breaker("m1").state == "open"
+    # One GenerativeModel per model name, not per attempt
+    assert model_cls.call_count == 2
+    assert client.stats()["models"]["m2"]["latency"]["count"] == 3
+
+def test_rate_limit_opens_breaker_immediately(client):
+    behaviours = {"m1": AsyncMock(side_effect=Exception("429 Resource has been exhausted"))}
+    with patch("app.services.gemini_client.genai.GenerativeModel", side_effect=make_models(behaviours)):
+        with pytest.raises(AllModelsFailed):
+            client.generate_sync(["m1"], ["prompt"], retries=1)
+    assert behaviours["m1"].await_count == 1
+    assert client.breaker("m1").state == "open"
+
+def test_breaker_half_open_allows_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0)
+    breaker.record_failure()
+    assert breaker.state == "half_open"
+    assert breaker.allow_request() is True
+    assert breaker.allow_request() is False
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+def test_generation_config_is_forwarded(client):
+    behaviours = {"m1": AsyncMock(return_value=MagicMock(text='{"amount": 10}'))}
+    config = {"response_mime_type": "application/json"}
+    with patch("app.services.gemini_client.genai.GenerativeModel", side_effect=make_models(behaviours)):
+        client.generate_sync(["m1"], ["prompt"], parse=json.loads, retries=0, generation_config=config)
+
+    assert behaviours["m1"].await_args.kwargs["generation_config"] == config
@@ -0,0 +1,72 @@
+import io
+import random
+from PIL import Image, ImageDraw
+from app import models
+from app.services.image_hash import compute_dhash, hamming_distance, BKTree, DuplicateImageIndex
+
+def make_receipt_image(seed: int, size=(600, 900), fmt="JPEG", quality=90) -> bytes:
+    rng = random.Random(seed)
+    img = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(img)
+    for _ in range(40):
+        x, y = rng.randint(0, size[0] - 100), rng.randint(0, size[1] - 20)
+        draw.rectangle([x, y, x + rng.randint(20, 100), y + 12], fill="black")
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, quality=quality)
+    return buf.getvalue()
+
+def test_dhash_survives_recompression_and_resize():
+    original = make_receipt_image(1)
+    resized = Image.open(io.BytesIO(original)).resize((300, 450))
+    buf = io.BytesIO()
+    resized.save(buf, format="JPEG", quality=60)
+
+    a = int(compute_dhash(original), 16)
+    b = int(compute_dhash(buf.getvalue()), 16)
+    c = int(compute_dhash(make_receipt_image(2)), 16)
+
+    assert hamming_distance(a, b) <= 6
+    assert hamming_distance(a, c) > 6
+
+def test_dhash_non_image_returns_none():
+    assert compute_dhash(b"%PDF-1.4 not an image") is None
+
+def test_bktree_nearest_within_radius():
+    tree = BKTree()
+    tree.add(0b0000, "r1")
+    tree.add(0b1111, "r2")
+    tree.add(0b0111, "r3")
+
+    assert tree.find_nearest(0b0001, 1) == ("r1", 1)
+    assert tree.find_nearest(0b1110, 1) == ("r2", 1)
+    assert BKTree().find_nearest(0, 5) is None
+
+def test_duplicate_index_is_company_scoped(db):
+
+    phash = compute_dhash(make_receipt_image(3))
+    db.add(models.Receipt(id="rA", company_id="cA", phash=phash))
+    db.add(models.Receipt(id="rB", company_id="cB", phash=phash))
+    db.commit()
+
+    index = DuplicateImageIndex()
+    assert index.find_duplicate(db, "cA", phash) == ("rA", 0)
+    assert index.find_duplicate(db, "cC", phash) is None
+
+    # Rows inserted after the first load are picked up incrementally
+    other = compute_dhash(make_receipt_image(4))
+    db.add(models.Receipt(id="rA2", company_id="cA", phash=other))
+    db.commit()
+    assert index.find_duplicate(db, "cA", other) == ("rA2", 0)
+
+def test_duplicate_index_sees_receipts_committed_after_a_sync_with_older_created_at(db):
+    from datetime import datetime, timedelta
+    index = DuplicateImageIndex()
+    assert index.find_duplicate(db, "cA", compute_dhash(make_receipt_image(5))) is None
+
+    # Inserted by another worker before this sync, committed after it
+    phash = compute_dhash(make_receipt_image(6))
+    db.add(models.Receipt(id="late", company_id="cA", phash=phash, created_at=datetime.utcnow() - timedelta(seconds=30)))
+    db.commit()
+    assert index.find_duplicate(db, "cA", phash) == ("late", 0)
+    assert index.find_duplicate(db, "cA", phash) == ("late", 0)
+    assert index._entries["cA"]["tree"].size == 1
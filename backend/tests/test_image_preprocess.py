@@ -0,0 +1,35 @@
+import io
+from PIL import Image
+from app.services.image_preprocess import preprocess_image
+import pytest
+
+def encode(img, fmt="JPEG", **kwargs) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, **kwargs)
+    return buf.getvalue()
+
+def test_large_jpeg_is_downscaled_and_grayscale():
+    original = encode(Image.new("RGB", (4000, 3000), (200, 180, 160)))
+    prepared = preprocess_image(original, max_size=1024, grayscale=True)
+
+    assert max(prepared.size) == 1024
+    assert prepared.mime_type == "image/jpeg"
+    out = Image.open(io.BytesIO(prepared.data))
+    assert out.mode == "L"
+
+def test_exif_orientation_is_applied():
+    img = Image.new("RGB", (400, 200), "white")
+    exif = img.getexif()
+    exif[0x0112] = 6 # Rotated 90 CW
+    prepared = preprocess_image(encode(img, exif=exif), max_size=1024, grayscale=False)
+
+    assert prepared.size == (200, 400)
+
+def test_webp_output_format():
+    prepared = preprocess_image(encode(Image.new("RGB", (300, 300)), "PNG"), output_format="WEBP", grayscale=False)
+    assert prepared.mime_type == "image/webp"
+    assert Image.open(io.BytesIO(prepared.data)).format == "WEBP"
+
+def test_non_image_raises():
+    with pytest.raises(Exception):
+        preprocess_image(b"not an image")
@@ -0,0 +1,148 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, ec
+from jose import jwt, jwk, JWTError
+from app.services.jwt_verifier import JWTVerifier, JWKSClient, VerifiedTokenCache
+import pytest
+
+def make_key(kid, algorithm):
+    private = rsa.generate_private_key(public_exponent=65537, key_size=2048) if algorithm == "RS256" \
+        else ec.generate_private_key(ec.SECP256R1())
+    pem = private.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    public = jwk.construct(pem, algorithm).public_key().to_dict()
+    public.update(kid=kid, alg=algorithm)
+    return pem, public
+
+@pytest.fixture
+def jwks_server():
+    """Local stand-in for https://<project>.supabase.co/auth/v1/.well-known/jwks.json."""
+    state = {"keys": [], "requests": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state["requests"] += 1
+            body = json.dumps({"keys": state["keys"]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state["url"] = f"http://127.0.0.1:{server.server_port}/jwks.json"
+    yield state
+    server.shutdown()
+
+def claims(**extra):
+    return dict({"sub": "u1", "email": "u1@example.com", "exp": int(time.time()) + 3600}, **extra)
+
+def test_hs256_is_verified_once_per_token():
+    verifier = JWTVerifier("secret")
+    token = jwt.encode(claims(), "secret", algorithm="HS256")
+    assert verifier.verify(token)["sub"] == "u1"
+    assert verifier.verify(token)["sub"] == "u1"
+    assert (verifier.cache.hits, verifier.cache.misses) == (1, 1)
+
+    with pytest.raises(JWTError):
+        verifier.verify(jwt.encode(claims(), "wrong", algorithm="HS256"))
+    assert len(verifier.cache._entries) == 1
+
+def test_cache_respects_exp_and_size():
+    cache = VerifiedTokenCache(max_entries=2, max_ttl_seconds=300)
+    cache.set("expired", {"exp": time.time() - 1})
+    assert cache.get("expired") is None
+    cache.set("soon", {"exp": time.time() + 0.05})
+    time.sleep(0.1)
+    assert cache.get("soon") is None
+
+    for token in ("a", "b", "c"):
+        cache.set(token, {"sub": token})
+    assert cache.get("a") is None and cache.get("c") == {"sub": "c"}
+
+def test_asymmetric_keys_from_jwks(jwks_server):
+    rsa_pem, rsa_public = make_key("rsa-1", "RS256")
+    ec_pem, ec_public = make_key("ec-1", "ES256")
+    jwks_server["keys"] = [rsa_public, ec_public]
+    verifier = JWTVerifier("secret", jwks_client=JWKSClient(jwks_server["url"], refresh_seconds=600, min_refresh_seconds=0))
+
+    rsa_token = jwt.encode(claims(), rsa_pem, algorithm="RS256", headers={"kid": "rsa-1"})
+    ec_token = jwt.encode(claims(sub="u2"), ec_pem, algorithm="ES256", headers={"kid": "ec-1"})
+    assert verifier.verify(rsa_token)["sub"] == "u1"
+    assert verifier.verify(ec_token)["sub"] == "u2"
+    assert jwks_server["requests"] == 1
+
+    # An HS256 token naming a JWKS kid is checked against the secret, never a public key
+    forged = jwt.encode(claims(), "secret-guess", algorithm="HS256", headers={"kid": "rsa-1"})
+    with pytest.raises(JWTError):
+        verifier.verify(forged)
+
+def test_unknown_kid_refreshes_jwks(jwks_server):
+    old_pem, old_public = make_key("old", "RS256")
+    new_pem, new_public = make_key("new", "RS256")
+    jwks_server["keys"] = [old_public]
+    client = JWKSClient(jwks_server["url"], refresh_seconds=600, min_refresh_seconds=0)
+    verifier = JWTVerifier("", jwks_client=client)
+    verifier.verify(jwt.encode(claims(), old_pem, algorithm="RS256", headers={"kid": "old"}))
+
+    # Key rotation: the new kid is not cached yet. The request does not wait for the
+    # JWKS; a background refresh picks the key up for the next one
+    jwks_server["keys"] = [old_public, new_public]
+    new_token = jwt.encode(claims(sub="u3"), new_pem, algorithm="RS256", headers={"kid": "new"})
+    with pytest.raises(JWTError):
+        verifier.verify(new_token)
+    client._refresh_thread.join(timeout=5)
+    assert verifier.verify(new_token)["sub"] == "u3"
+    assert client.refreshes == 2
+
+def test_unknown_kid_refresh_is_rate_limited(jwks_server):
+    pem, public = make_key("k1", "RS256")
+    jwks_server["keys"] = [public]
+    client = JWKSClient(jwks_server["url"], refresh_seconds=600, min_refresh_seconds=60)
+    verifier = JWTVerifier("", jwks_client=client)
+    for i in range(5):
+        with pytest.raises(JWTError):
+            verifier.verify(jwt.encode(claims(n=i), pem, algorithm="RS256", headers={"kid": "missing"}))
+    assert jwks_server["requests"] == 1
+
+def test_failed_refresh_keeps_previous_keys(jwks_server):
+    pem, public = make_key("k1", "RS256")
+    jwks_server["keys"] = [public]
+    client = JWKSClient(jwks_server["url"], refresh_seconds=0, min_refresh_seconds=0)
+    client.refresh()
+    client.url = "http://127.0.0.1:1/unreachable"
+    token = jwt.encode(claims(), pem, algorithm="RS256", headers={"kid": "k1"})
+    assert JWTVerifier("", jwks_client=client).verify(token)["sub"] == "u1"
+    client._refresh_thread.join(timeout=5)
+    assert client.refresh_errors >= 1
+    assert client.get_key("k1") == public
+
+def test_stale_keys_are_refreshed_without_blocking(jwks_server, monkeypatch):
+    pem, public = make_key("k1", "RS256")
+    jwks_server["keys"] = [public]
+    client = JWKSClient(jwks_server["url"], refresh_seconds=0, min_refresh_seconds=0)
+    client.refresh()
+
+    fetched = threading.Event()
+    release = threading.Event()
+    original_fetch = client._fetch
+    def slow_fetch():
+        fetched.set()
+        release.wait(timeout=5)
+        return original_fetch()
+    monkeypatch.setattr(client, "_fetch", slow_fetch)
+
+    token = jwt.encode(claims(), pem, algorithm="RS256", headers={"kid": "k1"})
+    verifier = JWTVerifier("", jwks_client=client)
+    # The refresh hangs, verification keeps serving the loaded key meanwhile
+    assert verifier.verify(token)["sub"] == "u1"
+    assert fetched.wait(timeout=5)
+    assert verifier.verify_signature(token)["sub"] == "u1"
+    release.set()
+    client._refresh_thread.join(timeout=5)
+    assert client.refreshes == 2
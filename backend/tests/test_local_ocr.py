@@ -0,0 +1,107 @@
+from unittest.mock import patch, MagicMock
+from app.services import local_ocr, ocr
+from app.services.local_ocr import parse_receipt_text, parse_amount, parse_items
+import pytest
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    cache = MagicMock()
+    cache.get.return_value = None
+    with patch.object(ocr, "ocr_cache", cache):
+        yield cache
+
+THERMAL_RECEIPT = """
+SUPERMERCADO LA 14 S.A.
+NIT: 890.300.346-1
+FACTURA ELECTRONICA DE VENTA No. SETP-99012
+Fecha: 15/03/2024 12:31
+PECHUGA POLLO KG      2   36.000
+SUBTOTAL              30.252
+IVA                    5.748
+TOTAL A PAGAR    $    36.000
+"""
+
+def test_parse_amount_formats():
+    assert parse_amount("150.000") == 150000
+    assert parse_amount("150.000,50") == 150000.5
+    assert parse_amount("150,000.00") == 150000
+    assert parse_amount("12.50") == 12.5
+
+def test_parse_colombian_receipt():
+    result = parse_receipt_text(THERMAL_RECEIPT, text_confidence=0.9)
+
+    assert result["vendor"] == "SUPERMERCADO LA 14 S.A."
+    assert result["vendor_nit"] == "890300346-1"
+    assert result["invoice_number"] == "SETP-99012"
+    assert result["date"] == "2024-03-15"
+    assert result["amount"] == 36000
+    assert result["confidence_score"] == 0.9
+    assert result["items"] == [{"name": "PECHUGA POLLO KG", "qty": 2.0, "unit": "kg", "price": 18000.0, "total": 36000}]
+
+def test_parse_items_formats():
+    items = parse_items("ARROZ DIANA 500G  3 x 2.500  7.500\nPAN TAJADO   $4.200\nSUBTOTAL 11.700\nCAMBIO 300")
+    assert [(i["name"], i["qty"], i["price"], i["total"]) for i in items] == [
+        ("ARROZ DIANA 500G", 3.0, 2500.0, 7500),
+        ("PAN TAJADO", 1.0, 4200.0, 4200),
+    ]
+
+def test_item_names_containing_keywords_are_kept():
+    items = parse_items(
+        "ACEITE DE OLIVA 500ML  18.900\nCAJA HUEVOS X30  14.500\nPASTEL POLLO  2  7.000\n"
+        "MANITAS CERDO  10.000\nBASE GRAVABLE  10.000\nIVA 19%  1.900\nTEL. 555 1234\nCAJA: 01"
+    )
+    assert [i["name"] for i in items] == ["ACEITE DE OLIVA 500ML", "CAJA HUEVOS X30", "PASTEL POLLO", "MANITAS CERDO"]
+
+def test_low_confidence_escalates_to_gemini():
+    weak = parse_receipt_text("ilegible", 0.3)
+    weak["ocr_tier"] = "local"
+    with patch.object(local_ocr, "extract_locally", return_value=weak), \
+         patch.object(ocr, "_extract_with_models", return_value={"vendor": "Exito", "ocr_tier": "gemini"}) as models_call:
+        result = ocr.process_receipt_with_gemini(b"image-bytes")
+
+    models_call.assert_called_once()
+    assert result["ocr_tier"] == "gemini"
+
+def test_confident_local_result_skips_gemini():
+    strong = parse_receipt_text(THERMAL_RECEIPT, 0.95)
+    strong["ocr_tier"] = "local"
+    with patch.object(local_ocr, "extract_locally", return_value=strong), \
+         patch.object(ocr, "_extract_with_models") as models_call:
+        result = ocr.process_receipt_with_gemini(b"image-bytes")
+
+    models_call.assert_not_called()
+    assert result["ocr_tier"] == "local"
+
+def test_local_result_used_when_gemini_is_down():
+    partial = parse_receipt_text("TOTAL 20.000", 0.9)
+    partial["ocr_tier"] = "local"
+    with patch.object(local_ocr, "extract_locally", return_value=partial), \
+         patch.object(ocr, "_extract_with_models", return_value=ocr.fallback_extraction()):
+        result = ocr.process_receipt_with_gemini(b"image-bytes")
+
+    assert result["ocr_tier"] == "local"
+    assert result["amount"] == 20000
+
+def test_confident_fields_without_matching_items_escalate():
+    no_items = parse_receipt_text(THERMAL_RECEIPT.replace("PECHUGA POLLO KG      2   36.000\n", ""), 0.95)
+    no_items["ocr_tier"] = "local"
+    assert no_items["confidence_score"] >= local_ocr.OCR_LOCAL_MIN_CONFIDENCE
+    with patch.object(local_ocr, "extract_locally", return_value=no_items), \
+         patch.object(ocr, "_extract_with_models", return_value={"vendor": "La 14", "items": [{"name": "x"}], "ocr_tier": "gemini"}) as models_call:
+        result = ocr.process_receipt_with_gemini(b"image-bytes")
+
+    models_call.assert_called_once()
+    assert result["ocr_tier"] == "gemini"
+
+def test_cache_is_checked_before_local_ocr(empty_cache):
+    empty_cache.get.return_value = {"vendor": "cached", "ocr_tier": "local"}
+    with patch.object(local_ocr, "extract_locally") as local_call:
+        assert ocr.process_receipt_with_gemini(b"image-bytes")["vendor"] == "cached"
+    local_call.assert_not_called()
+
+def test_confident_local_result_is_cached(empty_cache):
+    strong = parse_receipt_text(THERMAL_RECEIPT, 0.95)
+    strong["ocr_tier"] = "local"
+    with patch.object(local_ocr, "extract_locally", return_value=strong):
+        ocr.process_receipt_with_gemini(b"image-bytes")
+    empty_cache.set.assert_called_once_with(empty_cache.make_key.return_value, ocr.OCR_PROMPT_VERSION, strong)
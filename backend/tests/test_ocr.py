@@ -1,9 +1,20 @@
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from app.services.ocr import process_receipt_with_gemini
+from app.services.gemini_client import gemini_client
+from app.services.ocr_cache import ocr_cache
 import json
+import pytest
+
+@pytest.fixture(autouse=True)
+def fresh_ocr_client(monkeypatch):
+    # Model instances are reused across calls, so drop the ones built by other tests
+    gemini_client.reset()
+    monkeypatch.setattr(ocr_cache, "enabled", False)
+    yield
+    gemini_client.reset()
 
 @patch('app.services.ocr.genai.GenerativeModel')
-@patch('app.services.ocr.Image.open')
+@patch('app.services.image_preprocess.Image.open')
 def test_ocr_extraction_success(mock_img_open, mock_model_cls):
     # Mock Image
     mock_img_open.return_value = MagicMock()
@@ -23,7 +34,7 @@ def test_ocr_extraction_success(mock_img_open, mock_model_cls):
     ```
     '''
     mock_model = mock_model_cls.return_value
-    mock_model.generate_content.return_value = mock_response
+    mock_model.generate_content_async = AsyncMock(return_value=mock_response)
     
     # Input fake bytes
     result = process_receipt_with_gemini(b"fake_image_bytes")
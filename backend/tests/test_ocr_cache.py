@@ -0,0 +1,60 @@
+from unittest.mock import patch, MagicMock, AsyncMock
+from app.services.ocr_cache import OCRResultCache
+from app.services.gemini_client import gemini_client
+import pytest
+
+@pytest.fixture
+def cache(memory_session_factory):
+    c = OCRResultCache(session_factory=memory_session_factory)
+    c.enabled = True
+    return c
+
+def test_cache_hit_and_miss(cache):
+    key = cache.make_key(b"receipt-bytes", "v1")
+    assert cache.get(key) is None
+
+    cache.set(key, "v1", {"vendor": "Exito", "amount": 1000})
+    assert cache.get(key) == {"vendor": "Exito", "amount": 1000}
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+def test_key_depends_on_prompt_version(cache):
+    assert cache.make_key(b"same", "v1") != cache.make_key(b"same", "v2")
+    assert cache.compute_version("prompt A", ["m1"]) != cache.compute_version("prompt B", ["m1"])
+
+def test_lru_eviction(cache):
+    cache.max_entries = 2
+    keys = [cache.make_key(bytes([i]), "v1") for i in range(3)]
+    cache.set(keys[0], "v1", {"n": 0})
+    cache.set(keys[1], "v1", {"n": 1})
+    cache.get(keys[0]) # keys[1] is now least recently used
+    cache.set(keys[2], "v1", {"n": 2})
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == {"n": 0}
+    assert cache.stats()["evictions"] == 1
+
+def test_invalidate_old_prompt_versions(cache):
+    cache.set(cache.make_key(b"a", "old"), "old", {"n": 1})
+    cache.set(cache.make_key(b"b", "new"), "new", {"n": 2})
+
+    assert cache.invalidate(keep_version="new") == 1
+    assert cache.get(cache.make_key(b"b", "new")) == {"n": 2}
+
+@patch('app.services.ocr.genai.GenerativeModel')
+@patch('app.services.image_preprocess.Image.open')
+def test_process_receipt_short_circuits_on_cache_hit(mock_img_open, mock_model_cls, cache):
+    from app.services import ocr
+    mock_img_open.return_value = MagicMock()
+    gemini_client.reset()
+    mock_model_cls.return_value.generate_content_async = AsyncMock(return_value=MagicMock(text='{"vendor": "D1", "amount": 5000}'))
+
+    with patch.object(ocr, "ocr_cache", cache):
+        first = ocr.process_receipt_with_gemini(b"duplicate-upload")
+        second = ocr.process_receipt_with_gemini(b"duplicate-upload")
+
+    assert first == second == {"vendor": "D1", "amount": 5000, "items": [], "ocr_tier": "gemini"}
+    assert mock_model_cls.return_value.generate_content_async.await_count == 1
+    gemini_client.reset()
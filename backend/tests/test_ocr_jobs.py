@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+from app import models
+from app.services import ocr_jobs
+import pytest
+
+@pytest.fixture
+def receipt(db):
+    r = models.Receipt(id="r1", company_id="c1", status="PENDING")
+    db.add(r)
+    db.commit()
+    return r
+
+def parsed(amount):
+    return models.ParsedData(receipt_id="r1", vendor="Exito", amount=amount)
+
+def get_job(db):
+    db.expire_all()
+    return db.query(models.OCRJob).filter(models.OCRJob.receipt_id == "r1").one()
+
+def expire_lease(db):
+    job = get_job(db)
+    job.lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.commit()
+
+def test_live_lease_cannot_be_claimed_twice(db, receipt):
+    assert ocr_jobs.claim(db, [receipt], "w1") == {"r1"}
+    assert ocr_jobs.claim(db, [receipt], "w2") == set()
+
+    job = get_job(db)
+    assert (job.status, job.worker_id, job.attempts) == ("PROCESSING", "w1", 1)
+    assert receipt.status == "PROCESSING"
+
+def test_completed_job_is_not_processed_again(db, receipt):
+    ocr_jobs.claim(db, [receipt], "w1")
+    assert ocr_jobs.complete(db, receipt, "w1", parsed(100))
+    db.commit()
+
+    assert ocr_jobs.claim(db, [receipt], "w2") == set()
+    assert receipt.status == "PROCESSED"
+    assert db.query(models.ParsedData).count() == 1
+
+def test_expired_lease_is_reclaimed_and_result_never_duplicated(db, receipt):
+    ocr_jobs.claim(db, [receipt], "w1")
+    expire_lease(db)
+
+    assert ocr_jobs.claim(db, [receipt], "w2") == {"r1"}
+    assert ocr_jobs.complete(db, receipt, "w2", parsed(200))
+    db.commit()
+
+    # The first worker wakes up late: its lease is gone, nothing is written
+    assert not ocr_jobs.complete(db, receipt, "w1", parsed(100))
+    db.rollback()
+
+    rows = db.query(models.ParsedData).all()
+    assert [r.amount for r in rows] == [200]
+    assert get_job(db).attempts == 2
+
+def test_retry_overwrites_earlier_parsed_data(db, receipt):
+    db.add(parsed(100))
+    db.commit()
+
+    ocr_jobs.claim(db, [receipt], "w1")
+    assert ocr_jobs.complete(db, receipt, "w1", parsed(300))
+    db.commit()
+
+    rows = db.query(models.ParsedData).all()
+    assert [r.amount for r in rows] == [300]
+
+def test_fail_requeues_until_attempts_run_out(db, receipt, monkeypatch):
+    monkeypatch.setattr(ocr_jobs, "OCR_JOB_MAX_ATTEMPTS", 2)
+
+    ocr_jobs.claim(db, [receipt], "w1")
+    assert ocr_jobs.fail(db, receipt, "w1", ValueError("timeout"))
+    db.commit()
+    job = get_job(db)
+    assert (job.status, job.last_error, job.worker_id) == ("PENDING", "timeout", None)
+    assert receipt.status == "PENDING"
+
+    ocr_jobs.claim(db, [receipt], "w2")
+    assert not ocr_jobs.fail(db, receipt, "w2", ValueError("timeout"))
+    db.commit()
+    assert get_job(db).status == "FAILED"
+    assert receipt.status == "FAILED"
+    assert ocr_jobs.claim(db, [receipt], "w3") == set()
+
+def test_reaper_requeues_expired_leases(db, receipt, monkeypatch):
+    monkeypatch.setattr(ocr_jobs, "OCR_JOB_MAX_ATTEMPTS", 2)
+
+    ocr_jobs.claim(db, [receipt], "w1")
+    assert ocr_jobs.reap_expired(db) == []
+
+    expire_lease(db)
+    assert [r.id for r in ocr_jobs.reap_expired(db)] == ["r1"]
+    job = get_job(db)
+    assert (job.status, job.worker_id) == ("PENDING", None)
+    assert "w1" in job.last_error
+
+    # Second crash uses up the last attempt
+    ocr_jobs.claim(db, [receipt], "w2")
+    expire_lease(db)
+    assert ocr_jobs.reap_expired(db) == []
+    assert get_job(db).status == "FAILED"
+    assert db.query(models.Receipt).filter(models.Receipt.id == "r1").one().status == "FAILED"
+
+def test_renew_extends_only_leases_still_held(db, receipt):
+    ocr_jobs.claim(db, [receipt], "w1")
+    expire_lease(db)
+
+    assert ocr_jobs.renew(db, ["r1"], "w2") == 0
+    assert ocr_jobs.renew(db, ["r1"], "w1") == 1
+    db.commit()
+    assert get_job(db).lease_expires_at > datetime.utcnow()
+    assert ocr_jobs.reap_expired(db) == []
+
+    ocr_jobs.complete(db, receipt, "w1", parsed(10))
+    db.commit()
+    assert ocr_jobs.renew(db, ["r1"], "w1") == 0
@@ -0,0 +1,57 @@
+from app.services.ocr_schema import parse_extraction, ExtractionStats
+from app.services import ocr_schema
+import json
+import pytest
+
+@pytest.fixture(autouse=True)
+def fresh_stats(monkeypatch):
+    stats = ExtractionStats()
+    monkeypatch.setattr(ocr_schema, "extraction_stats", stats)
+    yield stats
+
+def test_clean_json_mode_answer(fresh_stats):
+    result = parse_extraction(json.dumps({
+        "vendor": "Exito", "date": "2024-03-15", "amount": 150000, "currency": "COP",
+        "items": [{"name": "Arroz", "qty": 2, "price": 5000, "total": 10000}]
+    }))
+
+    assert result["vendor"] == "Exito"
+    assert result["items"] == [{"name": "Arroz", "qty": 2.0, "price": 5000.0, "total": 10000.0}]
+    assert fresh_stats.stats()["clean"] == 1
+    assert fresh_stats.stats()["retries_avoided"] == 0
+
+def test_fenced_answer_with_trailing_comma_is_repaired(fresh_stats):
+    result = parse_extraction('Aquí está:\n```json\n{"vendor": "D1", "amount": 5000,}\n```')
+
+    assert result == {"vendor": "D1", "amount": 5000.0, "items": []}
+    assert fresh_stats.stats()["repaired_json"] == 1
+    assert fresh_stats.stats()["retries_avoided"] == 1
+
+def test_malformed_item_and_field_are_salvaged(fresh_stats):
+    result = parse_extraction(json.dumps({
+        "vendor": "Carnes El Toro",
+        "date": "ayer",
+        "amount": "$ 150.000",
+        "items": [
+            {"name": "Lomo", "qty": "1,5", "price": 40000, "total": 60000},
+            {"qty": 1, "price": "n/a"},
+            {"name": "Costilla", "total": 90000}
+        ]
+    }))
+
+    assert result["vendor"] == "Carnes El Toro"
+    assert result["amount"] == 150000
+    assert "date" not in result
+    assert [item["name"] for item in result["items"]] == ["Lomo", "Costilla"]
+    assert result["items"][0]["qty"] == 1.5
+    assert result["items"][1]["qty"] == 1.0
+    assert fresh_stats.stats()["salvaged"] == 1
+
+def test_date_in_local_format_is_normalized():
+    assert parse_extraction('{"vendor": "X", "date": "15/03/2024"}')["date"] == "2024-03-15"
+
+@pytest.mark.parametrize("answer", ["not json at all", "[1, 2]", '{"currency": "COP", "items": []}'])
+def test_unusable_answers_raise(answer, fresh_stats):
+    with pytest.raises(ValueError):
+        parse_extraction(answer)
+    assert fresh_stats.stats()["unusable"] == 1
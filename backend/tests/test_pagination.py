@@ -0,0 +1,79 @@
+from datetime import date, datetime, timedelta
+from fastapi import HTTPException, Response
+from app import models
+from app.services import pagination
+from app.routers import reports
+import pytest
+
+@pytest.fixture
+def db(db):
+    # Several purchases share a date, so the id tiebreak matters
+    for i in range(11):
+        db.add(models.Purchase(
+            id=f"p{i:02d}", company_id="c1", date=date(2024, 1, 1) + timedelta(days=i // 3), amount=i,
+            created_at=datetime(2024, 1, 1) + timedelta(hours=i)
+        ))
+    db.add(models.Purchase(id="other", company_id="c2", date=date(2024, 1, 1), amount=0))
+    db.commit()
+    return db
+
+def company_query(db):
+    return db.query(models.Purchase).filter(models.Purchase.company_id == "c1")
+
+KEYS = [models.Purchase.date, models.Purchase.id]
+
+def expected(db):
+    return [p.id for p in company_query(db).order_by(models.Purchase.date.desc(), models.Purchase.id.desc())]
+
+def test_next_and_prev_cursors_walk_every_row_once(db):
+    pages, cursor = [], None
+    while True:
+        page = pagination.paginate(company_query(db), KEYS, 4, cursor)
+        pages.append(page)
+        if not page.next_cursor:
+            break
+        cursor = page.next_cursor
+
+    assert [p.id for page in pages for p in page.items] == expected(db)
+    assert [len(page.items) for page in pages] == [4, 4, 3]
+    assert pages[0].prev_cursor is None
+
+    # Back from the last page gives the middle page again
+    back = pagination.paginate(company_query(db), KEYS, 4, pages[-1].prev_cursor)
+    assert [p.id for p in back.items] == [p.id for p in pages[1].items]
+    assert back.next_cursor and back.prev_cursor
+    first = pagination.paginate(company_query(db), KEYS, 4, back.prev_cursor)
+    assert [p.id for p in first.items] == [p.id for p in pages[0].items]
+    assert first.prev_cursor is None
+
+def test_ascending_keys_and_legacy_skip(db):
+    page = pagination.paginate(company_query(db), KEYS, 5, descending=False)
+    assert [p.id for p in page.items] == expected(db)[::-1][:5]
+
+    legacy = pagination.paginate(company_query(db), KEYS, 4, skip=4)
+    assert [p.id for p in legacy.items] == expected(db)[4:8]
+    resumed = pagination.paginate(company_query(db), KEYS, 4, legacy.next_cursor)
+    assert [p.id for p in resumed.items] == expected(db)[8:]
+
+def test_invalid_cursor_is_a_400(db):
+    with pytest.raises(HTTPException) as error:
+        pagination.paginate(company_query(db), KEYS, 4, "not-a-cursor")
+    assert error.value.status_code == 400
+
+def list_transactions(db, cursor=None, include_total=False):
+    response = Response()
+    items = reports.list_admin_transactions(
+        response=response, month=None, year=None, limit=10, skip=0, cursor=cursor,
+        include_total=include_total, db=db, company_id="c1"
+    )
+    return [p.id for p in items], response.headers
+
+def test_admin_transactions_cursor_headers(db):
+    ids, headers = list_transactions(db, include_total=True)
+    assert ids == [f"p{i:02d}" for i in range(10, 0, -1)]
+    assert headers["X-Total-Count"] == "11"
+    assert "X-Prev-Cursor" not in headers
+
+    ids, headers = list_transactions(db, cursor=headers["X-Next-Cursor"])
+    assert ids == ["p00"]
+    assert "X-Next-Cursor" not in headers and "X-Prev-Cursor" in headers
@@ -0,0 +1,68 @@
+from unittest.mock import patch
+import io
+from fpdf import FPDF
+from PIL import Image
+from app.services.pdf_extract import PdfExtractor, is_pdf
+from app.services import ocr
+
+def make_text_pdf() -> bytes:
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Helvetica", size=12)
+    for line in ["DISTRIBUIDORA CARNES SAS", "NIT 900123456-7", "Factura FE-1001", "Fecha 2024-03-15", "LOMO DE RES KG  5  150000", "TOTAL 150000"]:
+        pdf.cell(0, 10, line, new_x="LMARGIN", new_y="NEXT")
+    return bytes(pdf.output())
+
+def make_scanned_pdf() -> bytes:
+    img = Image.new("RGB", (300, 400), "white")
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG")
+    buf.seek(0)
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.image(buf, x=0, y=0, w=100)
+    return bytes(pdf.output())
+
+def test_text_layer_skips_rasterization():
+    extractor = PdfExtractor()
+    with patch.object(extractor, "_render") as render:
+        pages = extractor.extract(make_text_pdf())
+    assert is_pdf(make_text_pdf())
+    assert pages[0].has_text
+    assert "NIT 900123456-7" in pages[0].text
+    render.assert_not_called()
+
+def test_scanned_page_images_are_extracted_and_cached():
+    extractor = PdfExtractor()
+    pdf_bytes = make_scanned_pdf()
+    pages = extractor.extract(pdf_bytes)
+    assert not pages[0].has_text
+    assert len(pages[0].images) == 1
+
+    with patch.object(extractor, "_render") as render:
+        again = extractor.extract(pdf_bytes)
+    render.assert_not_called()
+    assert again[0].images == pages[0].images
+
+def test_text_pdf_served_by_rules_without_model_call():
+    with patch.object(ocr.gemini_client, "generate_sync") as generate, \
+         patch.object(ocr.ocr_cache, "enabled", False):
+        result = ocr.process_receipt_with_gemini(make_text_pdf())
+
+    generate.assert_not_called()
+    assert result["ocr_tier"] == "pdf_text"
+    assert result["items"][0]["name"] == "LOMO DE RES KG" and result["items"][0]["qty"] == 5
+    assert result["vendor_nit"] == "900123456-7"
+    assert result["amount"] == 150000
+    assert result["date"] == "2024-03-15"
+
+def test_text_pdf_uses_text_prompt():
+    with patch.object(ocr.gemini_client, "generate_sync", return_value=({"vendor": "Carnes", "amount": 150000}, "m1")) as generate, \
+         patch.object(ocr.ocr_cache, "enabled", False), \
+         patch.object(ocr.local_ocr, "OCR_LOCAL_ENABLED", False):
+        result = ocr.process_receipt_with_gemini(make_text_pdf())
+
+    assert result["amount"] == 150000
+    contents = generate.call_args.args[1]
+    assert contents[0] == ocr.OCR_TEXT_PROMPT
+    assert "TOTAL 150000" in contents[1]
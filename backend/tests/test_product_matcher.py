@@ -0,0 +1,114 @@
+from datetime import date
+from app import models
+from app.services import product_matcher
+from app.services.product_matcher import ProductMatcher, ProductIndex
+from app.services.cache_versions import CacheVersions
+import pytest
+
+@pytest.fixture
+def db(db):
+    db.add_all([
+        models.Product(id="chicken", company_id="c1", name="Pechuga de pollo", last_price=10),
+        models.Product(id="rice", company_id="c1", name="Arroz blanco", last_price=2),
+        models.Product(id="other-rice", company_id="c2", name="Arroz blanco", last_price=3),
+    ])
+    db.commit()
+    product_matcher.product_matcher.invalidate()
+    return db
+
+def aliases(db):
+    return {
+        (a.company_id, a.alias_key): (a.product_id, a.source)
+        for a in db.query(models.ProductAlias).all()
+    }
+
+def approve(db, day, company_id="c1", **items):
+    purchase = models.Purchase(company_id=company_id, date=day, amount=0, status="APPROVED")
+    purchase.items = [models.PurchaseItem(name=name, unit_price=price) for name, price in items.items()]
+    db.add(purchase)
+    db.commit()
+    return purchase
+
+def test_index_scores_only_candidates_sharing_trigrams():
+    index = ProductIndex([("a", "Pechuga de pollo"), ("b", "Arroz blanco"), ("c", "KG")])
+    assert index.best("pechuga pollo") == ("a", 1.0)
+    product_id, score = index.best("pechga polo")
+    assert product_id == "a" and 0.45 < score < 1
+    assert index.best("detergente") == (None, 0.0)
+
+def test_match_exact_fuzzy_and_learns_aliases(db):
+    matcher = ProductMatcher(threshold=0.45)
+    result = matcher.match(db, "c1", ["PECHUGA POLLO KG", "Arroz blanko", "Detergente", "x 2"])
+    assert result == {"PECHUGA POLLO KG": "chicken", "Arroz blanko": "rice", "Detergente": None, "x 2": None}
+    # Only the fuzzy match is learned; exact names are already O(1) in the index
+    assert aliases(db) == {("c1", "arroz blanko"): ("rice", "fuzzy")}
+
+def test_confirmed_alias_wins_over_similarity(db):
+    product_matcher.save_alias(db, "c1", "Arroz Blanko", "chicken", source=product_matcher.FUZZY)
+    product_matcher.save_alias(db, "c1", "Arroz Blanko", "rice")
+    product_matcher.save_alias(db, "c1", "Arroz Blanko", "chicken", source=product_matcher.FUZZY)
+    db.commit()
+    assert aliases(db) == {("c1", "arroz blanko"): ("rice", "confirmed")}
+
+    product_matcher.save_alias(db, "c1", "Especial de la casa", "chicken")
+    db.commit()
+    assert ProductMatcher().match(db, "c1", ["ESPECIAL CASA"]) == {"ESPECIAL CASA": "chicken"}
+
+def test_index_is_cached_and_rebuilt_after_product_changes(db):
+    matcher = product_matcher.product_matcher
+    assert matcher.match(db, "c1", ["Tomate chonto"]) == {"Tomate chonto": None}
+    cached = matcher.index_for(db, "c1")
+    assert matcher.index_for(db, "c1") is cached
+
+    # Price updates keep the index, new products rebuild it
+    db.query(models.Product).filter(models.Product.id == "rice").one().last_price = 5
+    db.commit()
+    assert matcher.index_for(db, "c1") is cached
+    db.add(models.Product(id="tomato", company_id="c1", name="Tomate chonto"))
+    db.commit()
+    assert matcher.match(db, "c1", ["Tomate chonto"]) == {"Tomate chonto": "tomato"}
+
+def test_approved_purchases_update_last_price_in_batch(db):
+    newer = approve(db, date(2024, 3, 2), **{"Pechuga pollo": 12, "Arroz blanco": 0})
+    older = approve(db, date(2024, 3, 1), **{"PECHUGA DE POLLO": 11})
+    newer.items[1].total_price, newer.items[1].quantity = 9, 3
+    other_company = approve(db, date(2024, 3, 1), company_id="c2", **{"Arroz blanco": 4})
+
+    assert product_matcher.apply_approved_purchases(db, [newer, older, other_company]) == 3
+    db.commit()
+
+    prices = {p.id: (p.last_price, p.last_price_date) for p in db.query(models.Product).all()}
+    assert prices == {
+        "chicken": (12, date(2024, 3, 2)),
+        "rice": (3, date(2024, 3, 2)),
+        "other-rice": (4, date(2024, 3, 1)),
+    }
+    assert [item.product_id for item in older.items] == ["chicken"]
+
+    # An old purchase approved late leaves the newer price alone
+    late = approve(db, date(2024, 2, 1), **{"Pechuga de pollo": 99})
+    assert product_matcher.apply_approved_purchases(db, [late]) == 0
+    assert db.query(models.Product).filter(models.Product.id == "chicken").one().last_price == 12
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+    def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+    def incr(self, key):
+        self.data[key] = self.data.get(key, 0) + 1
+        return self.data[key]
+
+def test_committed_product_changes_reach_other_workers(db, monkeypatch):
+    versions = CacheVersions("product_index", redis_client=FakeRedis())
+    other_worker = ProductMatcher(ttl_seconds=300, versions=versions)
+    monkeypatch.setattr(product_matcher.product_matcher, "versions", versions)
+    index = other_worker.index_for(db, "c1")
+    assert other_worker.index_for(db, "c1") is index
+
+    db.add(models.Product(id="beans", company_id="c1", name="Frijol rojo"))
+    db.flush()
+    # Not committed yet: nothing is published
+    assert other_worker.index_for(db, "c1") is index
+    db.commit()
+    assert other_worker.match(db, "c1", ["FRIJOL ROJO"]) == {"FRIJOL ROJO": "beans"}
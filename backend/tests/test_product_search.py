@@ -0,0 +1,87 @@
+from datetime import date
+from sqlalchemy import text
+from app import models
+from app.services import product_search
+from app.product_names import normalize_product_name
+import pytest
+
+def add_purchase(db, day, company_id="c1", **items):
+    purchase = models.Purchase(company_id=company_id, date=day, amount=0)
+    purchase.items = [models.PurchaseItem(name=name, unit_price=price) for name, price in items.items()]
+    db.add(purchase)
+    db.commit()
+    return purchase
+
+def test_normalize_product_name():
+    assert normalize_product_name("Pechuga pollo kg") == "pechuga pollo"
+    assert normalize_product_name("PECHUGA DE POLLO") == "pechuga pollo"
+    assert normalize_product_name("Azúcar x 500g") == "azucar"
+    assert normalize_product_name("Leche 1.5 Lt") == "leche"
+    assert normalize_product_name("KG") == ""
+    assert normalize_product_name(None) == ""
+
+def test_product_key_filled_on_insert(db):
+    purchase = add_purchase(db, date(2024, 1, 1), **{"Pechuga DE Pollo kg": 100})
+    assert purchase.items[0].product_key == "pechuga pollo"
+
+def test_price_trends_group_name_variants(db):
+    add_purchase(db, date(2024, 1, 1), **{"Pechuga pollo kg": 100, "Arroz": 10})
+    add_purchase(db, date(2024, 1, 2), **{"PECHUGA DE POLLO": 120, "Muslo de pollo": 80})
+    add_purchase(db, date(2024, 1, 2), company_id="c2", **{"Pechuga pollo": 999})
+
+    assert product_search.price_trends(db, "c1", "pechuga de pollo") == [
+        {"date": "2024-01-01", "price": 100},
+        {"date": "2024-01-02", "price": 120},
+    ]
+    # Substring of the key, served by the FTS index
+    assert product_search.price_trends(db, "c1", "pollo") == [
+        {"date": "2024-01-01", "price": 100},
+        {"date": "2024-01-02", "price": 100},
+    ]
+
+def test_index_follows_updates_and_deletes(db):
+    purchase = add_purchase(db, date(2024, 1, 1), **{"Arroz": 10})
+    item = purchase.items[0]
+    item.product_key = "arroz integral"
+    db.commit()
+    assert product_search.price_trends(db, "c1", "integral") == [{"date": "2024-01-01", "price": 10}]
+
+    db.delete(purchase)
+    db.commit()
+    assert product_search.price_trends(db, "c1", "arroz") == []
+    count = db.execute(text("SELECT count(*) FROM purchase_items_fts WHERE purchase_items_fts MATCH '\"arroz\"'")).scalar()
+    assert count == 0
+
+def test_short_and_unit_only_queries_fall_back_to_like(db):
+    add_purchase(db, date(2024, 1, 1), **{"Té verde": 5, "Kg": 7})
+    assert product_search.price_trends(db, "c1", "te") == [{"date": "2024-01-01", "price": 5}]
+    assert product_search.price_trends(db, "c1", "kg") == [{"date": "2024-01-01", "price": 7}]
+
+def test_backfill_product_keys(db):
+    add_purchase(db, date(2024, 1, 1), **{"Pechuga de pollo": 100, "Arroz": 10})
+    db.query(models.PurchaseItem).update({models.PurchaseItem.product_key: None})
+    db.commit()
+    assert product_search.price_trends(db, "c1", "pollo") == []
+
+    assert product_search.backfill_product_keys(db, batch_size=1) == 2
+    assert product_search.price_trends(db, "c1", "pollo") == [{"date": "2024-01-01", "price": 100}]
+
+def test_renamed_item_moves_to_its_new_key(db):
+    purchase = add_purchase(db, date(2024, 1, 1), **{"Arroz": 10})
+    purchase.items[0].name = "Lentejas kg"
+    db.commit()
+    assert purchase.items[0].product_key == "lentejas"
+    assert product_search.price_trends(db, "c1", "arroz") == []
+    assert product_search.price_trends(db, "c1", "lentejas") == [{"date": "2024-01-01", "price": 10}]
+
+def test_ensure_search_index_covers_tables_created_without_it(db):
+    add_purchase(db, date(2024, 1, 1), **{"Pechuga de pollo": 100})
+    # A database whose purchase_items predates the index
+    db.execute(text("DROP TABLE purchase_items_fts"))
+    db.commit()
+
+    product_search.ensure_search_index(db.get_bind())
+    product_search.ensure_search_index(db.get_bind())
+    assert product_search.price_trends(db, "c1", "pollo") == [{"date": "2024-01-01", "price": 100}]
+    add_purchase(db, date(2024, 1, 2), **{"Muslo de pollo": 80})
+    assert len(product_search.price_trends(db, "c1", "pollo")) == 2
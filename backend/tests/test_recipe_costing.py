@@ -0,0 +1,145 @@
+from sqlalchemy import event
+from app import models
+from app.services import recipe_costing
+from app.services.recipe_costing import recipe_cost_cache, CostGraph, RecipeCostCache, load_rows
+from app.services.cache_versions import CacheVersions
+import threading
+import pytest
+
+@pytest.fixture
+def db(db):
+    db.add_all([
+        models.Product(id="chicken", company_id="c1", name="Pechuga de pollo", unit="kg", last_price=20000),
+        models.Product(id="rice", company_id="c1", name="Arroz", unit="kg", last_price=4000),
+        models.Recipe(id="r1", company_id="c1", name="Arroz con pollo", sale_price=30000),
+        models.Recipe(id="r2", company_id="c1", name="Arroz blanco", sale_price=5000),
+        models.Recipe(id="r3", company_id="c1", name="Sin items", sale_price=0),
+        models.Recipe(id="other", company_id="c2", name="Otra empresa", sale_price=1),
+    ])
+    db.flush()
+    db.add_all([
+        models.RecipeItem(id="i1", recipe_id="r1", product_id="chicken", quantity=0.5),
+        models.RecipeItem(id="i2", recipe_id="r1", product_id="rice", quantity=0.25),
+        models.RecipeItem(id="i3", recipe_id="r2", product_id="rice", quantity=0.2),
+        models.RecipeItem(id="i4", recipe_id="r2", product_id="deleted-product", quantity=1),
+    ])
+    db.commit()
+    recipe_cost_cache.invalidate()
+    yield db
+    recipe_cost_cache.invalidate()
+
+def costs(db):
+    return {r["id"]: (r["total_cost"], round(r["margin"], 2)) for r in recipe_cost_cache.recipes(db, "c1")}
+
+def test_costs_and_margins_match_item_sums(db):
+    recipes = recipe_cost_cache.recipes(db, "c1")
+    assert [r["id"] for r in recipes] == ["r1", "r2", "r3"]
+    assert costs(db) == {"r1": (11000, 63.33), "r2": (800, 84.0), "r3": (0, 0)}
+    assert recipes[1]["items"][1] == {
+        "id": "i4", "product_name": "Unknown", "quantity": 1, "unit": "-", "unit_price": 0, "total_cost": 0
+    }
+    assert recipes[0]["items"][0]["unit"] == "kg"
+
+def test_graph_is_loaded_with_one_query_and_cached(db):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(db.get_bind(), "before_cursor_execute", listener)
+    try:
+        recipe_cost_cache.recipes(db, "c1")
+        recipe_cost_cache.recipes(db, "c1")
+    finally:
+        event.remove(db.get_bind(), "before_cursor_execute", listener)
+    assert len(statements) == 1
+
+def test_committed_price_change_patches_only_affected_recipes(db):
+    graph = recipe_cost_cache.graph(db, "c1")
+    db.query(models.Product).filter(models.Product.id == "chicken").one().last_price = 30000
+    db.commit()
+
+    assert recipe_cost_cache.graph(db, "c1") is graph
+    assert costs(db)["r1"] == (16000, 46.67)
+    assert costs(db)["r2"] == (800, 84.0)
+
+    # Rolled back changes never reach the cache
+    db.query(models.Product).filter(models.Product.id == "rice").one().last_price = 1
+    db.flush()
+    db.rollback()
+    assert costs(db)["r2"] == (800, 84.0)
+
+def test_structure_changes_reload_the_graph(db):
+    graph = recipe_cost_cache.graph(db, "c1")
+    db.add(models.RecipeItem(id="i5", recipe_id="r3", product_id="rice", quantity=1))
+    db.commit()
+    assert recipe_cost_cache.graph(db, "c1") is not graph
+    assert costs(db)["r3"] == (4000, 0)
+
+def test_update_prices_equals_full_rebuild(db):
+    graph = CostGraph(load_rows(db, "c1"))
+    assert graph.update_prices({"rice": 5000, "unknown": 1}) == 2
+    db.query(models.Product).filter(models.Product.id == "rice").one().last_price = 5000
+    fresh = CostGraph(load_rows(db, "c1"))
+    assert graph.costs.tolist() == fresh.costs.tolist()
+    assert graph.margins.tolist() == fresh.margins.tolist()
+
+def test_simulate_price_shock_by_name_and_id(db):
+    result = {r["id"]: r for r in recipe_cost_cache.simulate(db, "c1", [{"name": "pollo", "change_pct": 15}])}
+    assert result["r1"]["simulated_cost"] == pytest.approx(12500)
+    assert result["r1"]["cost_delta"] == pytest.approx(1500)
+    assert result["r2"]["cost_delta"] == 0
+
+    result = recipe_cost_cache.simulate(db, "c1", [{"product_id": "rice", "change_pct": -50}])
+    assert [r["simulated_cost"] for r in result] == pytest.approx([10500, 400, 0])
+    # Cached costs are untouched
+    assert costs(db)["r1"] == (11000, 63.33)
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+    def mget(self, *keys):
+        return [self.data.get(key) for key in keys]
+    def incr(self, key):
+        self.data[key] = self.data.get(key, 0) + 1
+        return self.data[key]
+
+def test_changes_are_published_to_other_workers(db):
+    redis = FakeRedis()
+    worker_a = RecipeCostCache(ttl_seconds=300, versions=CacheVersions("recipe_costs", redis_client=redis))
+    worker_b = RecipeCostCache(ttl_seconds=300, versions=CacheVersions("recipe_costs", redis_client=redis))
+    graph_a, graph_b = worker_a.graph(db, "c1"), worker_b.graph(db, "c1")
+    assert worker_b.graph(db, "c1") is graph_b
+
+    # A worker's own price patch keeps its graph; the other one reloads
+    db.query(models.Product).filter(models.Product.id == "chicken").one().last_price = 30000
+    db.commit()
+    worker_a.update_prices("c1", {"chicken": 30000})
+    assert worker_a.graph(db, "c1") is graph_a
+    reloaded = worker_b.graph(db, "c1")
+    assert reloaded is not graph_b
+    assert reloaded.costs.tolist() == graph_a.costs.tolist()
+
+    worker_a.invalidate(publish=True)
+    assert worker_b.graph(db, "c1") is not reloaded
+
+def test_graph_loads_outside_the_cache_lock(db, monkeypatch):
+    loading, release, loads = threading.Event(), threading.Event(), []
+    def slow_load_rows(session, company_id):
+        loads.append(company_id)
+        if company_id == "c1":
+            loading.set()
+            release.wait(timeout=5)
+        return []
+    monkeypatch.setattr(recipe_costing, "load_rows", slow_load_rows)
+    cache = RecipeCostCache(ttl_seconds=300)
+
+    results = []
+    readers = [threading.Thread(target=lambda: results.append(cache.graph(db, "c1"))) for _ in range(2)]
+    readers[0].start()
+    assert loading.wait(timeout=5)
+    readers[1].start()
+    # Another company is served while c1 is still loading
+    assert cache.recipes(db, "c2") == []
+    release.set()
+    for reader in readers:
+        reader.join(timeout=5)
+    assert results[0] is results[1]
+    assert loads == ["c1", "c2"]
@@ -0,0 +1,102 @@
+import io
+import base64
+import httpx
+from unittest.mock import MagicMock
+from app.services import storage, resumable_upload
+from app.services.resumable_upload import ResumableUploader, encode_metadata
+from app.services.storage_pool import StorageClientPool
+from app.services.storage_backends import UploadStream
+import pytest
+
+class TusServer:
+    """In-memory TUS endpoint. `fail_patches` PATCHes are cut off after keeping half their body."""
+    def __init__(self, fail_patches: int = 0):
+        self.uploads = {}
+        self.fail_patches = fail_patches
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append((request.method, dict(request.headers)))
+        if request.method == "POST":
+            location = f"/storage/v1/upload/resumable/{len(self.uploads)}"
+            self.uploads[location] = {
+                "data": bytearray(),
+                "length": request.headers.get("Upload-Length"),
+                "metadata": request.headers["Upload-Metadata"]
+            }
+            return httpx.Response(201, headers={"Location": location})
+        upload = self.uploads[request.url.path]
+        if request.method == "HEAD":
+            return httpx.Response(200, headers={"Upload-Offset": str(len(upload["data"]))})
+        assert int(request.headers["Upload-Offset"]) == len(upload["data"])
+        body = request.read()
+        if self.fail_patches:
+            self.fail_patches -= 1
+            upload["data"] += body[:len(body) // 2]
+            return httpx.Response(502)
+        upload["data"] += body
+        upload["length"] = request.headers.get("Upload-Length", upload["length"])
+        return httpx.Response(204, headers={"Upload-Offset": str(len(upload["data"]))})
+
+def make_uploader(server, chunk_size=4):
+    session = httpx.Client(transport=httpx.MockTransport(server))
+    return ResumableUploader(session, "http://storage.local/storage/v1/upload/resumable", {"apiKey": "key"}, chunk_size=chunk_size, retries=2)
+
+def test_uploads_in_chunks_with_metadata():
+    server = TusServer()
+    uploader = make_uploader(server)
+    content = b"0123456789"
+
+    sent = uploader.upload(UploadStream(io.BytesIO(content)), {"bucketName": "receipts", "objectName": "c1/a.pdf"}, size=len(content))
+
+    upload = server.uploads["/storage/v1/upload/resumable/0"]
+    assert sent == len(content) and bytes(upload["data"]) == content
+    assert upload["length"] == "10"
+    assert [method for method, _ in server.requests] == ["POST", "PATCH", "PATCH", "PATCH"]
+    assert server.requests[0][1]["tus-resumable"] == "1.0.0"
+    assert base64.b64decode(upload["metadata"].split(",")[1].split(" ")[1]) == b"c1/a.pdf"
+
+def test_failed_chunk_resumes_from_server_offset():
+    server = TusServer(fail_patches=1)
+    uploader = make_uploader(server)
+    content = b"abcdefgh"
+
+    assert uploader.upload(io.BytesIO(content), {"objectName": "c1/b.pdf"}, size=len(content)) == len(content)
+    assert bytes(server.uploads["/storage/v1/upload/resumable/0"]["data"]) == content
+    assert uploader.resumes == 1
+    assert [method for method, _ in server.requests] == ["POST", "PATCH", "HEAD", "PATCH", "PATCH"]
+
+def test_deferred_length_is_sent_with_last_chunk():
+    server = TusServer()
+    uploader = make_uploader(server)
+
+    uploader.upload(io.BytesIO(b"abcdef"), {"objectName": "c1/c.pdf"}, first_chunk=b"0123")
+
+    upload = server.uploads["/storage/v1/upload/resumable/0"]
+    assert bytes(upload["data"]) == b"0123abcdef"
+    assert server.requests[0][1]["upload-defer-length"] == "1"
+    assert upload["length"] == "10"
+
+def test_gives_up_after_retries():
+    server = TusServer(fail_patches=10)
+    with pytest.raises(httpx.HTTPStatusError):
+        make_uploader(server).upload(io.BytesIO(b"abcd"), {"objectName": "x"}, size=4)
+
+def test_encode_metadata_skips_missing_values():
+    assert encode_metadata({"bucketName": "receipts", "contentType": None}) == "bucketName cmVjZWlwdHM="
+
+def test_supabase_streams_large_files_through_tus(monkeypatch):
+    monkeypatch.setattr(storage, "UPLOAD_CHUNK_BYTES", 4)
+    monkeypatch.setattr(resumable_upload, "UPLOAD_CHUNK_BYTES", 4)
+    server = TusServer()
+    service = storage.SupabaseStorageService()
+    service.client = MagicMock()
+    service.pool = StorageClientPool("http://storage.local", "anon-key", transport=httpx.MockTransport(server))
+
+    stored = service.upload_stream(io.BytesIO(b"%PDF-0123456"), "big.pdf", "application/pdf", "c1", size=12, token="user-token")
+
+    assert bytes(server.uploads["/storage/v1/upload/resumable/0"]["data"]) == b"%PDF-0123456"
+    assert server.requests[0][1]["authorization"] == "Bearer user-token"
+    assert stored["size"] == 12 and stored["content_type"] == "application/pdf"
+    service.client.storage.from_.return_value.upload.assert_not_called()
+    assert service.pool.stats()["requests"] == 4
@@ -0,0 +1,84 @@
+from datetime import date
+from app import models
+from app.services import spend_rollups
+import pytest
+
+def rollups(db):
+    db.expire_all()
+    return {
+        (r.day, r.category, r.provider_id): (r.total_amount, r.purchase_count, r.rejected_amount, r.rejected_count)
+        for r in db.query(models.SpendRollup).filter(models.SpendRollup.purchase_count != 0).all()
+    }
+
+def purchase(**kwargs):
+    values = dict(company_id="c1", date=date(2024, 3, 1), amount=100, category="Carnes")
+    values.update(kwargs)
+    return models.Purchase(**values)
+
+def test_create_update_approve_reject_and_delete_are_tracked(db):
+    p1 = purchase()
+    db.add_all([p1, purchase(amount=50), purchase(category=None, provider_id="prov1", amount=20)])
+    db.commit()
+    assert rollups(db) == {
+        (date(2024, 3, 1), "Carnes", ""): (150, 2, 0, 0),
+        (date(2024, 3, 1), "", "prov1"): (20, 1, 0, 0),
+    }
+
+    # Re-categorize and move to another day (object expired after commit)
+    p1.category = "Frutas"
+    p1.date = date(2024, 3, 2)
+    db.commit()
+    assert rollups(db)[(date(2024, 3, 1), "Carnes", "")] == (50, 1, 0, 0)
+    assert rollups(db)[(date(2024, 3, 2), "Frutas", "")] == (100, 1, 0, 0)
+
+    p1.status = models.PurchaseStatus.REJECTED.value
+    db.commit()
+    assert rollups(db)[(date(2024, 3, 2), "Frutas", "")] == (100, 1, 100, 1)
+
+    p1.status = models.PurchaseStatus.APPROVED.value
+    p1.amount = 120
+    db.commit()
+    assert rollups(db)[(date(2024, 3, 2), "Frutas", "")] == (120, 1, 0, 0)
+
+    db.delete(p1)
+    db.commit()
+    assert (date(2024, 3, 2), "Frutas", "") not in rollups(db)
+    assert spend_rollups.check_consistency(db) == []
+
+def test_rebuild_and_consistency_check(db):
+    db.add_all([purchase(), purchase(company_id="c2", amount=70)])
+    db.commit()
+
+    # Drift introduced behind the ORM's back (e.g. a raw SQL fix)
+    db.query(models.Purchase).filter(models.Purchase.company_id == "c1").update({"amount": 999}, synchronize_session=False)
+    db.commit()
+    mismatches = spend_rollups.check_consistency(db)
+    assert [m["key"][0] for m in mismatches] == ["c1"]
+    assert mismatches[0]["expected"][0] == 999
+
+    assert spend_rollups.rebuild(db, company_id="c1") == 1
+    assert spend_rollups.check_consistency(db) == []
+
+def test_window_start():
+    assert spend_rollups.window_start(1, today=date(2024, 3, 15)) == date(2024, 3, 1)
+    assert spend_rollups.window_start(6, today=date(2024, 3, 15)) == date(2023, 10, 1)
+    assert spend_rollups.window_start(0, today=date(2024, 1, 31)) == date(2024, 1, 1)
+
+def test_provider_trends_pivot_within_window(db, monkeypatch):
+    db.add_all([
+        models.Provider(id="p1", company_id="c1", name="MacPollo"),
+        models.Provider(id="p2", company_id="c1", name="Coca Cola"),
+        purchase(provider_id="p1", date=date(2023, 1, 10), amount=999),  # outside the window
+        purchase(provider_id="p1", date=date(2024, 2, 10), amount=100),
+        purchase(provider_id="p1", date=date(2024, 2, 20), amount=50),
+        purchase(provider_id="p2", date=date(2024, 2, 21), amount=30),
+        purchase(provider_id="p2", date=date(2024, 3, 1), amount=10),
+        purchase(date=date(2024, 3, 1), amount=5),  # no provider
+    ])
+    db.commit()
+    monkeypatch.setattr(spend_rollups, "window_start", lambda months: date(2024, 2, 1))
+
+    assert spend_rollups.provider_trends(db, "c1", 2) == [
+        {"month": "Feb 2024", "MacPollo": 150, "Coca Cola": 30},
+        {"month": "Mar 2024", "Coca Cola": 10},
+    ]
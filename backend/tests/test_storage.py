@@ -1,3 +1,4 @@
+import io
 from unittest.mock import MagicMock, patch
 from app.services.storage import SupabaseStorageService
 import pytest
@@ -14,7 +15,8 @@ def test_upload_file(mock_supabase):
     service.bucket = "receipts"
     
     mock_file = MagicMock()
-    mock_file.read.return_value = b"file_content"
+    mock_file.file = io.BytesIO(b"file_content")
+    mock_file.size = len(b"file_content")
     mock_file.content_type = "image/jpeg"
     
     # Mock storage.from_.upload
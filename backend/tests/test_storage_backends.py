@@ -0,0 +1,141 @@
+import io
+import os
+import hashlib
+import uuid
+from unittest.mock import MagicMock
+from app.services.storage import create_storage_service, SupabaseStorageService
+from app.services import storage_backends
+from app.services.storage_backends import LocalStorageBackend, S3StorageBackend, UploadStream, UploadTooLarge
+from app.services.report_generator import generate_clearance_act
+import pytest
+
+@pytest.fixture
+def local(tmp_path):
+    return LocalStorageBackend(root=str(tmp_path), url_prefix="/uploads/files")
+
+def test_local_round_trip(local, tmp_path):
+    stored = local.upload_bytes(b"receipt", "Factura 01.jpg", "image/jpeg", "company_1")
+    path = stored["storage_path"]
+
+    assert path.startswith("company_1/") and path.endswith("_Factura01.jpg")
+    assert (tmp_path / path).read_bytes() == b"receipt"
+    assert local.download_file(path) == b"receipt"
+    assert local.get_file_url(path) == stored["file_url"] == f"/uploads/files/{path}"
+    assert local.delete_file(path) and local.download_file(path) is None
+
+    ops = local.stats()["operations"]
+    assert ops["put"]["count"] == 1 and ops["get"]["bytes"] == len(b"receipt")
+
+def test_local_put_replaces_and_rejects_escaping_paths(local):
+    local.put_bytes("exports/c1/audit.zip", b"v1", "application/zip")
+    local.put_bytes("exports/c1/audit.zip", b"v2", "application/zip")
+    assert local.download_file("exports/c1/audit.zip") == b"v2"
+
+    with pytest.raises(ValueError):
+        local.put_bytes("../outside.txt", b"x", "text/plain")
+    assert local.upload_bytes(b"x", "../../etc/passwd", "text/plain", "..")["storage_path"] is None
+
+def test_upload_stream_hashes_counts_and_sniffs_in_one_pass():
+    content = b"%PDF-1.7\n" + b"x" * 5000
+    stream = UploadStream(io.BytesIO(content), "application/octet-stream")
+
+    assert stream.content_type == "application/pdf" # sniffed before anything is consumed
+    assert stream.read(3) + stream.read() == content
+    assert stream.summary() == {"size": len(content), "sha256": hashlib.sha256(content).hexdigest(), "content_type": "application/pdf"}
+    assert UploadStream(io.BytesIO(b"plain text"), "text/csv").content_type == "text/csv"
+
+def test_upload_stream_enforces_max_bytes_while_reading():
+    with pytest.raises(UploadTooLarge):
+        UploadStream(io.BytesIO(b""), max_bytes=10, size=11) # declared size, before any transfer
+
+    stream = UploadStream(io.BytesIO(b"x" * 5000), max_bytes=3000) # size unknown or lying
+    assert stream.read(2000) == b"x" * 2000
+    with pytest.raises(UploadTooLarge) as exc:
+        stream.read(2000)
+    assert exc.value.status_code == 413
+
+def test_local_upload_stream_writes_chunks_and_cleans_up(local, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage_backends, "UPLOAD_CHUNK_BYTES", 4)
+    png = b"\x89PNG\r\n\x1a\n" + b"p" * 10
+    stored = local.upload_stream(io.BytesIO(png), "sig.png", "application/octet-stream", "c1")
+    assert local.download_file(stored["storage_path"]) == png
+    assert (stored["size"], stored["content_type"]) == (len(png), "image/png")
+    assert stored["sha256"] == hashlib.sha256(png).hexdigest()
+
+    with pytest.raises(UploadTooLarge):
+        local.upload_stream(io.BytesIO(b"y" * 30), "big.jpg", "image/jpeg", "c1", max_bytes=16)
+    assert [f.name for f in tmp_path.rglob("*") if f.is_file()] == [stored["filename"]] # no partial or temp file
+
+def test_s3_multipart_for_large_streams(monkeypatch):
+    monkeypatch.setattr(storage_backends, "UPLOAD_CHUNK_BYTES", 4)
+    client = MagicMock()
+    client.create_multipart_upload.return_value = {"UploadId": "u1"}
+    client.upload_part.side_effect = lambda **kwargs: {"ETag": f"e{kwargs['PartNumber']}"}
+    s3 = S3StorageBackend(bucket="receipts", client=client)
+
+    stored = s3.upload_stream(io.BytesIO(b"0123456789"), "big.pdf", "application/pdf", "c1")
+    assert stored["size"] == 10
+    assert [c.kwargs["Body"] for c in client.upload_part.call_args_list] == [b"0123", b"4567", b"89"]
+    assert client.complete_multipart_upload.call_args.kwargs["MultipartUpload"]["Parts"][-1] == {"ETag": "e3", "PartNumber": 3}
+    client.put_object.assert_not_called()
+
+    client.upload_part.side_effect = RuntimeError("network down")
+    assert s3.upload_stream(io.BytesIO(b"0123456789"), "big.pdf", "application/pdf", "c1")["storage_path"] is None
+    client.abort_multipart_upload.assert_called_once()
+
+def test_factory_selects_backend(monkeypatch, tmp_path):
+    monkeypatch.setenv("SUPABASE_URL", "https://fake.supabase.co")
+    assert isinstance(create_storage_service("supabase"), SupabaseStorageService)
+    assert isinstance(create_storage_service("local"), LocalStorageBackend)
+    with pytest.raises(ValueError):
+        create_storage_service("ftp")
+
+def test_driver_missing_an_operation_cannot_be_created():
+    class WriteOnly(storage_backends.StorageBackend):
+        def put_bytes(self, path, file_content, content_type):
+            return {"storage_path": path}
+
+    with pytest.raises(TypeError, match="delete_file"):
+        WriteOnly()
+    with pytest.raises(TypeError):
+        storage_backends.StorageBackend()
+
+def test_s3_driver_with_client():
+    client = MagicMock()
+    client.get_object.return_value = {"Body": io.BytesIO(b"pdf")}
+    client.generate_presigned_url.return_value = "https://s3/signed"
+    s3 = S3StorageBackend(bucket="receipts", client=client)
+
+    stored = s3.upload_bytes(b"pdf", "acta.pdf", "application/pdf", "c1")
+    assert client.put_object.call_args.kwargs["Key"] == stored["storage_path"]
+    assert s3.download_file(stored["storage_path"]) == b"pdf"
+    assert s3.get_file_url(stored["storage_path"]) == "https://s3/signed"
+
+@pytest.mark.skipif(not os.getenv("S3_TEST_ENDPOINT_URL"), reason="set S3_TEST_ENDPOINT_URL (e.g. a local MinIO) to run")
+def test_s3_against_minio():
+    """docker run -p 9000:9000 minio/minio server /data; S3_TEST_ENDPOINT_URL=http://localhost:9000"""
+    s3 = S3StorageBackend(
+        bucket=os.getenv("S3_TEST_BUCKET", "receipts"),
+        endpoint_url=os.environ["S3_TEST_ENDPOINT_URL"],
+        access_key_id=os.getenv("S3_TEST_ACCESS_KEY_ID", "minioadmin"),
+        secret_access_key=os.getenv("S3_TEST_SECRET_ACCESS_KEY", "minioadmin")
+    )
+    try:
+        s3.client.create_bucket(Bucket=s3.bucket)
+    except Exception:
+        pass # already there
+    path = f"tests/{uuid.uuid4()}.bin"
+    s3.put_bytes(path, b"minio", "application/octet-stream")
+    assert s3.download_file(path) == b"minio"
+    assert s3.get_file_url(path).startswith(os.environ["S3_TEST_ENDPOINT_URL"])
+    assert s3.delete_file(path)
+
+def test_clearance_act_embeds_signature_bytes():
+    from PIL import Image
+    png = io.BytesIO()
+    Image.new("RGB", (40, 20), "white").save(png, format="PNG")
+    data = {"company_name": "Acme", "date": "2024-01-01", "owner_name": "Ana", "total_sales": 0,
+            "total_expenses": 0, "balance": 0, "expense_details": []}
+
+    pdf = generate_clearance_act(data, png.getvalue())
+    assert pdf.startswith(b"%PDF") and b"/Image" in pdf
@@ -0,0 +1,76 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+from jose import jwt
+from app.services.storage_pool import StorageClientPool
+import pytest
+
+@pytest.fixture
+def storage_server():
+    """Local stand-in for the Supabase Storage API that records auth headers."""
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            seen.append((self.path, self.headers.get("Authorization")))
+            body = json.dumps({"Key": self.path}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}", seen
+    server.shutdown()
+
+def upload(handle, path):
+    handle.storage.from_("receipts").upload(path=path, file=b"data", file_options={"content-type": "image/png"})
+
+def test_clients_share_one_connection(storage_server):
+    url, seen = storage_server
+    pool = StorageClientPool(url, "anon-key", jwt_secret="secret", transport=httpx.HTTPTransport())
+    upload(pool.system_client(), "c1/a.png")
+    upload(pool.system_client(), "c1/b.png")
+    upload(pool.user_client("user-token"), "c1/c.png")
+
+    stats = pool.stats()
+    assert stats["requests"] == 3
+    assert stats["connections_opened"] == 1
+    assert stats["connection_reuse_rate"] == pytest.approx(2 / 3)
+    assert stats["system_token_refreshes"] == 1
+
+    system_token = seen[0][1].removeprefix("Bearer ")
+    assert jwt.decode(system_token, "secret", algorithms=["HS256"], options={"verify_aud": False})["role"] == "service_role"
+    assert seen[2][1] == "Bearer user-token"
+
+def test_system_token_is_resigned_before_expiry():
+    pool = StorageClientPool("http://storage.local", "anon-key", jwt_secret="secret", transport=httpx.MockTransport(lambda r: httpx.Response(200)))
+    first = pool.system_client()
+    assert pool.system_client() is first
+
+    pool._system_expires_at = 0 # about to expire
+    assert pool.system_client() is not first
+    assert pool.system_token_refreshes == 2
+
+def test_user_clients_are_reused_and_bounded():
+    pool = StorageClientPool("http://storage.local", "anon-key", transport=httpx.MockTransport(lambda r: httpx.Response(200)), max_user_clients=2)
+    a = pool.user_client("token-a")
+    assert pool.user_client("token-a") is a
+    pool.user_client("token-b")
+    pool.user_client("token-c")
+    assert pool.user_client("token-a") is not a
+    stats = pool.stats()
+    assert (stats["user_client_hits"], stats["user_clients"]) == (1, 2)
+
+def test_without_secret_system_client_uses_api_key():
+    pool = StorageClientPool("http://storage.local", "anon-key", transport=httpx.MockTransport(lambda r: httpx.Response(200)))
+    assert pool.system_client().storage.session.headers["Authorization"] == "Bearer anon-key"
@@ -0,0 +1,119 @@
+import time
+from unittest.mock import patch, MagicMock
+import pytest
+from celery import Celery, states
+from app.services import tasks
+
+def test_dispatch_falls_back_to_background_tasks_without_broker():
+    background_tasks = MagicMock()
+    task = MagicMock()
+    fallback = MagicMock()
+    with patch.object(tasks, "CELERY_ENABLED", False):
+        job_id = tasks.dispatch(task, background_tasks, fallback, "r1", company_id="c1")
+
+    assert job_id is None
+    task.apply_async.assert_not_called()
+    background_tasks.add_task.assert_called_once_with(fallback, "r1")
+
+def test_dispatch_enqueues_and_records_owner():
+    background_tasks = MagicMock()
+    task = MagicMock()
+    task.apply_async.return_value = MagicMock(id="job-1")
+    with patch.object(tasks, "CELERY_ENABLED", True), \
+         patch.object(tasks, "remember_job_owner") as remember:
+        job_id = tasks.dispatch(task, background_tasks, MagicMock(), "r1", company_id="c1")
+
+    assert job_id == "job-1"
+    task.apply_async.assert_called_once_with(args=["r1"], kwargs={"company_id": "c1"})
+    remember.assert_called_once_with("job-1", "c1")
+    background_tasks.add_task.assert_not_called()
+
+def test_dispatch_runs_in_process_when_broker_is_down():
+    background_tasks = MagicMock()
+    task = MagicMock()
+    task.apply_async.side_effect = ConnectionError("redis down")
+    fallback = MagicMock()
+    with patch.object(tasks, "CELERY_ENABLED", True):
+        assert tasks.dispatch(task, background_tasks, fallback, "r1", company_id="c1") is None
+    background_tasks.add_task.assert_called_once_with(fallback, "r1")
+
+class FakeZSetRedis:
+    """The sorted-set commands the fairness slots use."""
+    def __init__(self):
+        self.zsets = {}
+
+    def zremrangebyscore(self, key, low, high):
+        zset = self.zsets.setdefault(key, {})
+        for member in [m for m, score in zset.items() if score <= high]:
+            del zset[member]
+
+    def zadd(self, key, mapping):
+        self.zsets.setdefault(key, {}).update(mapping)
+
+    def zrank(self, key, member):
+        return sorted(self.zsets[key], key=self.zsets[key].get).index(member)
+
+    def zrem(self, key, member):
+        self.zsets.get(key, {}).pop(member, None)
+
+    def expire(self, key, seconds):
+        pass
+
+def make_task(func):
+    """A real bound task with the production retry options, run eagerly by .apply()."""
+    app = Celery("test_tasks", set_as_current=False)
+
+    @app.task(name="test_tasks.work", **tasks.TASK_RETRY_OPTIONS)
+    def work(self, receipt_id, company_id=None):
+        return tasks.run_fairly(self, company_id, func, receipt_id)
+    return work
+
+def test_run_fairly_requeues_under_same_id_when_company_at_limit():
+    fake_redis = FakeZSetRedis()
+    func = MagicMock(return_value="done")
+    work = make_task(func)
+    with patch.object(tasks, "get_redis", return_value=fake_redis), \
+         patch.object(tasks, "COMPANY_MAX_INFLIGHT", 1), \
+         patch.object(work, "signature_from_request") as requeue:
+        # Another task of the same company is already running
+        assert tasks.acquire_company_slot("c1", "t1")
+        # Deferred far more often than max_retries allows
+        for _ in range(work.max_retries + 3):
+            result = work.apply(args=["r2"], kwargs={"company_id": "c1"}, task_id="t2")
+            assert result.state == states.IGNORED
+        func.assert_not_called()
+        assert requeue.call_count == work.max_retries + 3
+        requeue.assert_called_with(countdown=tasks.FAIRNESS_REQUEUE_SECONDS)
+        requeue.return_value.apply_async.assert_called_with()
+
+        # Other companies are not affected
+        assert work.apply(args=["r3"], kwargs={"company_id": "c2"}, task_id="t3").get() == "done"
+
+        tasks.release_company_slot("c1", "t1")
+        assert work.apply(args=["r2"], kwargs={"company_id": "c1"}, task_id="t2").get() == "done"
+
+    assert fake_redis.zsets["celery:inflight:c1"] == {}
+    assert fake_redis.zsets["celery:inflight:c2"] == {}
+
+def test_run_fairly_keeps_retry_budget_for_real_failures():
+    fake_redis = FakeZSetRedis()
+    func = MagicMock(side_effect=RuntimeError("OCR provider down"))
+    work = make_task(func)
+    with patch.object(tasks, "get_redis", return_value=fake_redis):
+        result = work.apply(args=["r1"], kwargs={"company_id": "c1"}, task_id="t1")
+    assert result.state == states.FAILURE
+    assert isinstance(result.result, RuntimeError)
+    # The first run plus max_retries retries, each releasing its slot
+    assert func.call_count == 1 + work.max_retries == 4
+    assert fake_redis.zsets["celery:inflight:c1"] == {}
+
+def test_slot_of_crashed_worker_is_reclaimed_after_its_lease():
+    fake_redis = FakeZSetRedis()
+    with patch.object(tasks, "get_redis", return_value=fake_redis), \
+         patch.object(tasks, "COMPANY_MAX_INFLIGHT", 1):
+        assert tasks.acquire_company_slot("c1", "crashed")
+        # Rejected attempts do not extend the crashed worker's lease
+        for _ in range(3):
+            assert not tasks.acquire_company_slot("c1", "waiting")
+        fake_redis.zsets["celery:inflight:c1"]["crashed"] = time.time() - 1 # lease ran out
+        assert tasks.acquire_company_slot("c1", "waiting")
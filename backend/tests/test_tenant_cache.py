@@ -0,0 +1,99 @@
+import asyncio
+from sqlalchemy import event
+from app import models, auth
+from app.services.tenant_cache import TenantCache, tenant_cache
+import pytest
+
+@pytest.fixture
+def db(db):
+    db.add(models.Company(id="c1", user_id="u1", name="Acme"))
+    db.add(models.User(id="u1", email="u1@example.com", full_name="Ana", company_id="c1", role="ADMIN"))
+    db.commit()
+    tenant_cache.invalidate()
+    yield db
+    tenant_cache.invalidate()
+
+def count_selects(session):
+    statements = []
+    event.listen(session.get_bind(), "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+    def get(self, key):
+        return self.data.get(key)
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+    def delete(self, key):
+        self.data.pop(key, None)
+
+def make_user(user_id, company_id="c1"):
+    return models.User(id=user_id, email=f"{user_id}@example.com", company_id=company_id, role="STAFF", is_active=True)
+
+def test_hits_count_saved_roundtrips():
+    cache = TenantCache(ttl_seconds=60, max_entries=10)
+    assert cache.get("u1") is None
+    cache.set(make_user("u1"))
+    assert cache.get("u1", roundtrips=2)["company_id"] == "c1"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["db_roundtrips_saved"]) == (1, 1, 2)
+
+def test_users_without_company_are_not_cached():
+    cache = TenantCache(ttl_seconds=60)
+    cache.set(make_user("u1", company_id=None))
+    assert cache.get("u1") is None
+
+def test_lru_and_ttl():
+    cache = TenantCache(ttl_seconds=60, max_entries=2)
+    cache.set(make_user("a"))
+    cache.set(make_user("b"))
+    cache.get("a")
+    cache.set(make_user("c")) # evicts b, the least recently used
+    assert cache.get("b") is None and cache.get("a") and cache.get("c")
+
+    expired = TenantCache(ttl_seconds=0)
+    expired.set(make_user("a"))
+    assert expired.get("a") is None
+
+def test_redis_shared_between_workers_and_invalidated():
+    redis = FakeRedis()
+    worker_a, worker_b = TenantCache(ttl_seconds=60, redis_client=redis), TenantCache(ttl_seconds=60, redis_client=redis)
+    worker_a.set(make_user("u1"))
+    assert worker_b.get("u1")["role"] == "STAFF"
+
+    worker_a.invalidate("u1")
+    assert redis.data == {}
+
+def test_get_user_company_skips_queries_once_cached(db):
+    current = {"id": "u1", "email": "u1@example.com"}
+    assert asyncio.run(auth.get_user_company(current, db)) == "c1"
+
+    statements = count_selects(db)
+    assert asyncio.run(auth.get_user_company(current, db)) == "c1"
+    assert statements == []
+
+def test_cached_active_user_is_attached_without_select(db):
+    current = {"id": "u1", "email": "u1@example.com"}
+    asyncio.run(auth.get_current_active_user(current, db))
+    db.expunge_all()
+
+    statements = count_selects(db)
+    user = asyncio.run(auth.get_current_active_user(current, db))
+    assert (user.id, user.company_id, user.full_name) == ("u1", "c1", "Ana")
+    assert statements == []
+    # Relationships still load lazily from the session
+    assert [c.name for c in user.companies] == ["Acme"]
+
+def test_membership_change_invalidates(client, auth_headers, test_db):
+    assert client.get("/receipts/", headers=auth_headers).status_code == 200
+    assert tenant_cache.get("test-user-id") is not None
+
+    test_db.add(models.Company(id="other", name="Other", invitation_code="JOIN-ME"))
+    test_db.commit()
+    response = client.post("/auth/join", json={"invite_code": "JOIN-ME"}, headers=auth_headers)
+    assert response.status_code == 200
+    assert tenant_cache.get("test-user-id") is None
+    client.get("/receipts/", headers=auth_headers)
+    assert tenant_cache.get("test-user-id")["company_id"] == "other"